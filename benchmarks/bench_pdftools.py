@@ -0,0 +1,64 @@
+#!/usr/bin/env python
+
+"""Benchmark PDF type detection engines.
+
+Compares the text extraction based :func:`se.pdftools.detect_pdf_type` with
+the content stream profiler :func:`se.pdftools.profile_pdf`. By default the
+PDF files from the test suite are used; pass paths to benchmark other files:
+
+   $ python benchmarks/bench_pdftools.py
+   $ python benchmarks/bench_pdftools.py path/to/contract.pdf --repeat 20
+
+"""
+
+import argparse
+import os
+import sys
+import timeit
+from pathlib import Path
+
+BASE_PATH = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(BASE_PATH))
+
+from se.pdftools import detect_pdf_type, profile_pdf  # noqa: E402
+
+DEFAULT_FILES = [
+    BASE_PATH / "tests" / "resources" / "blank.pdf",
+    BASE_PATH / "tests" / "resources" / "agreement-10.pdf",
+]
+
+
+def bench(func, path: Path, repeat: int) -> float:
+    """Return the best wall time of a single call, in milliseconds."""
+    timings = timeit.repeat(lambda: func(path), number=1, repeat=repeat)
+    return min(timings) * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("files", nargs="*", type=Path, default=DEFAULT_FILES)
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    header = f"{'file':<32} {'pages':>5} {'detect, ms':>11} {'profile, ms':>12} {'speedup':>8}"
+    print(header)
+    print("-" * len(header))
+
+    for path in args.files:
+        expected = detect_pdf_type(path)
+        actual = profile_pdf(path)
+        if expected != actual:
+            print(f"{path}: results differ: {expected} != {actual}", file=sys.stderr)
+
+        detect_ms = bench(detect_pdf_type, path, args.repeat)
+        profile_ms = bench(profile_pdf, path, args.repeat)
+        speedup = detect_ms / profile_ms if profile_ms else float("inf")
+
+        print(
+            f"{os.path.basename(path):<32} {actual['total_pages']:>5} "
+            f"{detect_ms:>11.2f} {profile_ms:>12.2f} {speedup:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
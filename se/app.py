@@ -1,6 +1,7 @@
 import os
 import sys
 
+import click
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
@@ -22,6 +23,7 @@ def create_app(config=None) -> Flask:
     app = Flask(__name__)
 
     configure_app(app, config)
+    configure_proxy(app)
     configure_logging(app)
     configure_directories(app)
     configure_ai(app)
@@ -62,6 +64,19 @@ def configure_app(app: Flask, config_name=None):
     app.config.from_envvar("SE_SETTINGS", silent=True)
 
 
+def configure_proxy(app: Flask):
+    """Trust the X-Forwarded-For header set by the reverse proxies, if any.
+
+    The client address (request.remote_addr) is then the one seen by the
+    first of the PROXY_FIX_X_FOR proxies, instead of the last proxy.
+    """
+    x_for = app.config.get("PROXY_FIX_X_FOR", 0)
+    if x_for:
+        from werkzeug.middleware.proxy_fix import ProxyFix
+
+        app.wsgi_app = ProxyFix(app.wsgi_app, x_for=x_for)
+
+
 def configure_logging(app: Flask):
     """Configure the logger for the application."""
     import logging
@@ -121,10 +136,38 @@ def configure_ai(app: Flask):
     from llama_index.core import Settings
     from llama_index.llms.openai import OpenAI
 
+    from se.modules.index_cache import index_cache
+
+    index_cache.configure(max_bytes=app.config.get("INDEX_CACHE_BYTES", 0))
+
+    backend = app.config.get("LLM_BACKEND") or "openai"
+    if backend != "openai":
+        from llama_index.core import MockEmbedding
+
+        from se.modules.offline_llm import create_offline_llm
+
+        # Offline backends (load tests, CI) must not call the OpenAI API,
+        # neither for completions nor for embeddings.
+        Settings.llm = create_offline_llm(backend, app.config)
+        Settings.embed_model = MockEmbedding(embed_dim=8)
+        app.logger.info(f"Using the offline '{backend}' LLM backend")
+        return
+
     openai.api_key = app.config.get("OPENAI_API_KEY")
+    # Concurrent queries run in a new event loop for each analysis, and in
+    # several worker threads: a shared async client would keep connections
+    # bound to a closed loop, so each call gets its own client.
     model = app.config.get("OPENAI_MODEL")
     if model:
-        Settings.llm = OpenAI(model=model)
+        Settings.llm = OpenAI(model=model, reuse_client=False)
+
+    embedding_model = app.config.get("OPENAI_EMBEDDING_MODEL")
+    if embedding_model:
+        from llama_index.embeddings.openai import OpenAIEmbedding
+
+        Settings.embed_model = OpenAIEmbedding(
+            model=embedding_model, reuse_client=False
+        )
 
 
 def configure_blueprints(app: Flask):
@@ -182,6 +225,120 @@ def configure_extensions(app: Flask):
 
         demo_seed()
 
+    @app.cli.command("profile-pdfs")
+    @click.argument("directory", type=click.Path(exists=True, file_okay=False))
+    @click.option(
+        "-o",
+        "--output",
+        type=click.Path(dir_okay=False),
+        required=True,
+        help="NDJSON file to write results to.",
+    )
+    @click.option(
+        "-w",
+        "--workers",
+        type=click.IntRange(min=1),
+        default=os.cpu_count() or 1,
+        show_default=True,
+        help="Number of worker processes.",
+    )
+    @click.option(
+        "--resume",
+        is_flag=True,
+        help="Skip files already present in the output file and append to it.",
+    )
+    def profile_pdfs(directory, output, workers, resume):
+        """Profile PDF files in a directory tree."""
+        from se.modules.batch_profiler import (
+            open_output,
+            profile_directory,
+            read_processed_paths,
+        )
+
+        skip = read_processed_paths(output) if resume else set()
+        with open_output(output, resume) as stream:
+            summary = profile_directory(
+                directory,
+                stream,
+                workers=workers,
+                page_timeout=app.config.get("PDF_PAGE_TIMEOUT"),
+                skip=skip,
+            )
+
+        click.echo(summary.format(), err=True)
+
+    @app.cli.command("llm-cache")
+    @click.option("--clear", is_flag=True, help="Remove all cached responses.")
+    def llm_cache(clear):
+        """Show statistics of the LLM response cache."""
+        from se.modules.response_cache import get_response_cache
+
+        cache = get_response_cache(app.config)
+        if cache is None:
+            click.echo("The LLM response cache is disabled.", err=True)
+            return
+
+        if clear:
+            cache.clear()
+
+        for name, value in cache.stats().items():
+            click.echo(f"{name}: {value}")
+
+    @app.cli.command("expire-documents")
+    @click.option(
+        "--days",
+        type=click.IntRange(min=0),
+        default=30,
+        show_default=True,
+        help="Age in days of the deleted documents.",
+    )
+    def expire_documents(days):
+        """Delete the old documents, and their files once unused."""
+        from datetime import datetime, timedelta
+
+        from se.models import Document
+
+        deleted = Document.expire(datetime.utcnow() - timedelta(days=days))
+        click.echo(f"Deleted {deleted} documents.")
+
+    @app.cli.command()
+    @click.option(
+        "-c",
+        "--concurrency",
+        type=click.IntRange(min=1),
+        default=lambda: app.config.get("JOB_WORKER_CONCURRENCY", 2),
+        show_default="JOB_WORKER_CONCURRENCY",
+        help="Number of jobs run at the same time.",
+    )
+    @click.option(
+        "--burst",
+        is_flag=True,
+        help="Exit once the queue is empty.",
+    )
+    def worker(concurrency, burst):
+        """Run the queued analysis jobs."""
+        import signal
+
+        from se.modules.jobs import Worker
+
+        runner = Worker(
+            app,
+            concurrency=concurrency,
+            poll_interval=app.config.get("JOB_POLL_INTERVAL", 1.0),
+            visibility_timeout=app.config.get("JOB_VISIBILITY_TIMEOUT", 600),
+            max_in_flight=app.config.get("JOB_MAX_IN_FLIGHT", 0),
+        )
+
+        def stop(signum, frame):
+            click.echo("Stopping, waiting for the running jobs...", err=True)
+            runner.stop()
+
+        signal.signal(signal.SIGINT, stop)
+        signal.signal(signal.SIGTERM, stop)
+
+        click.echo(f"Worker {runner.name} running {concurrency} jobs", err=True)
+        runner.run(burst=burst)
+
 
 def configure_context_processors(app: Flask):
     """Configure the context processors."""
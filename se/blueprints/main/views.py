@@ -2,8 +2,10 @@
 
 import os
 
-from flask import abort, render_template
+from flask import Response, abort, current_app, render_template
 
+from se.modules.admission import get_admission_controller
+from se.modules.ocr import export_ocr_stats
 from se.utils import strtobool
 
 from . import main
@@ -42,3 +44,13 @@ def licensing():
 @main.route("/contact", methods=["GET"], endpoint="contact")
 def contact():
     return render_template("main/contact.html")
+
+
+@main.route("/metrics", methods=["GET"], endpoint="metrics")
+def metrics():
+    """Export the job queue, upload admissions and OCR pools, for Prometheus."""
+    return Response(
+        get_admission_controller(current_app.config).export()
+        + export_ocr_stats(current_app.config),
+        mimetype="text/plain; version=0.0.4",
+    )
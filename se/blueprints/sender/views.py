@@ -1,26 +1,42 @@
 """The views module for the sender role."""
 
-import json
 import os
+from typing import Optional, Union
 
 from flask import (
+    Response,
     current_app,
     flash,
+    jsonify,
+    make_response,
     redirect,
     render_template,
     request,
     session,
+    stream_with_context,
     url_for,
 )
 from flask_mail import Message
-
-from se.models import AnalysisResult, Document, File
-from se.modules.agent_controller import AgentController
+from werkzeug.exceptions import RequestEntityTooLarge
+
+from se.models import AnalysisResult, Document, File, Job
+from se.modules.admission import RESERVATION_HOLD, Rejection, get_admission_controller
+from se.modules.chunked_upload import (
+    ChunkedUpload,
+    OffsetMismatch,
+    UploadNotFound,
+    get_chunked_uploads,
+)
+from se.modules.jobs import enqueue_analysis, stream_job_events
 from se.modules.progress_tracker import get_tracker
-from se.modules.upload_manager import UploadManager
+from se.modules.upload_manager import UploadError, UploadFileInfo, UploadManager
 
 from . import sender
 
+# Bytes of a multipart upload request besides the file: part headers,
+# boundaries and the other form fields
+MULTIPART_OVERHEAD = 64 * 1024
+
 
 @sender.route("/sender", endpoint="welcome")
 def welcome():
@@ -35,11 +51,38 @@ def welcome():
 @sender.route("/analysis", endpoint="analysis")
 def analysis():
     analysis_id = request.args.get("a", type=int)
+    job_id = request.args.get("job", type=int)
     debug = request.args.get("debug", type=bool, default=False)
 
     tracker = get_tracker("sender")
     tracker.set_current_step("Review")
 
+    if job_id and not analysis_id:
+        job = Job.get(job_id)
+        if not job:
+            flash(f"Analysis job with ID {job_id} not found.", "error")
+            return render_template("sender/analysis.html")
+
+        if job.status == Job.FAILED:
+            flash(
+                f"{job.error or 'The analysis failed.'} "
+                "Please let us know about this bug.",
+                "error",
+            )
+            return redirect(url_for("sender.welcome"))
+
+        if job.status != Job.DONE:
+            # The page shows the progress of the job until the analysis is done
+            return render_template(
+                "sender/analysis.html",
+                job=job.as_dict(),
+                status_url=url_for("sender.job_status", job_id=job.id),
+                events_url=url_for("sender.job_events", job_id=job.id),
+                progress_steps=tracker.get_progress_steps(),
+            )
+
+        analysis_id = job.analysis_result_id
+
     if not analysis_id:
         flash("Upload a document to see the analysis results.", "error")
         return render_template("sender/analysis.html")
@@ -57,6 +100,42 @@ def analysis():
     )
 
 
+@sender.route("/jobs/<int:job_id>", endpoint="job_status")
+def job_status(job_id: int):
+    """Return the status of an analysis job as JSON."""
+    job = Job.get_or_404(job_id)
+    status = job.as_dict()
+    if job.status == Job.DONE:
+        status["analysis_url"] = url_for("sender.analysis", a=job.analysis_result_id)
+    return jsonify(status)
+
+
+@sender.route("/jobs/<int:job_id>/events", endpoint="job_events")
+def job_events(job_id: int):
+    """Stream the progress of an analysis job as Server-Sent Events.
+
+    Events: "planning", "steps" (the analysis steps), "category" (the result
+    of a category as soon as it is known), "missing_data" (an iteration
+    asking for missing data), "queued" (the job is retried), then "done" or
+    "failed". The stream is closed after JOB_EVENTS_MAX_DURATION seconds,
+    reconnecting browsers resume after the Last-Event-ID header.
+    """
+    job = Job.get_or_404(job_id)
+    last_event_id = request.headers.get("Last-Event-ID", type=int) or 0
+    events = stream_job_events(
+        job.id,
+        last_event_id,
+        poll_interval=current_app.config.get("JOB_EVENTS_POLL_INTERVAL", 1.0),
+        max_duration=current_app.config.get("JOB_EVENTS_MAX_DURATION", 30),
+    )
+
+    return Response(
+        stream_with_context(events),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 def allowed_file(filename) -> bool:
     """Check if the file has an allowed extension."""
     exts = current_app.config.get("ALLOWED_EXTENSIONS", {})
@@ -76,102 +155,281 @@ def validate_file(file):
             message += f". Allowed types: {', '.join(exts)}"
         return False, message
 
-    # Validate file size
-    file.stream.seek(0, os.SEEK_END)  # Move to the end of the file stream
-    file_size = file.stream.tell()  # Get the current position (file size in bytes)
-    file.stream.seek(0)  # Reset the cursor to the beginning of the file stream
+    # The size of the request is limited by the upload view, the size of the
+    # file is checked while it is stored, see UploadManager
+    return True, None
+
 
-    min_size = current_app.config.get("MIN_FILE_SIZE", 0)
+def _too_large_message() -> str:
     max_size = current_app.config.get("MAX_FILE_SIZE", 5 * 1024 * 1024)
+    return f"File size exceeds the maximum limit of {max_size / (1024 * 1024)} MB."
 
-    if file_size < min_size:
-        return False, f"File is too small. Minimum size is {min_size} bytes."
 
-    if file_size > max_size:
-        return (
-            False,
-            f"File size exceeds the maximum limit of {max_size / (1024 * 1024)} MB.",
-        )
+def _upload_manager() -> UploadManager:
+    return UploadManager(
+        current_app.config.get("UPLOADS_DIR"),
+        min_size=current_app.config.get("MIN_FILE_SIZE", 0),
+        max_size=current_app.config.get("MAX_FILE_SIZE", 5 * 1024 * 1024),
+    )
 
-    return True, None
 
+def _refresh_requested() -> bool:
+    # Forced refresh of cached LLM responses, e.g. /upload?refresh=1
+    return request.values.get("refresh", "0").lower() in ("1", "true", "yes")
 
-@sender.route("/upload", methods=["POST"])
-def upload():
-    file = request.files.get("file")
-    is_valid, error_message = validate_file(file)
 
-    if not is_valid:
-        flash(error_message or "Invalid file", "error")
-        return redirect(url_for("sender.welcome"))
+def _client() -> str:
+    """Return the identity of the client, to share the workers fairly."""
+    return request.remote_addr
 
-    # 1. Uploading the file
-    upload_manager = UploadManager(current_app.config.get("UPLOADS_DIR"))
-    uploaded_file = upload_manager.save_file(file)
 
-    model_file = File.create(
-        sha256_content=uploaded_file.sha256_content,
-        filename=uploaded_file.filename,
-        orig_filename=uploaded_file.orig_filename,
-        file_type=uploaded_file.content_type,
-        file_size=uploaded_file.content_length,
-    )
-    model_file.save()
+def _admit_upload(hold: float = RESERVATION_HOLD) -> Union[Job, Rejection]:
+    """Admit an upload of the client, before its body is read.
+
+    :param hold: Seconds the place of the upload is reserved in the queue.
+    :return: The reservation, to release once the upload ends (see
+             _release_upload), or the rejection.
+    """
+    return get_admission_controller(current_app.config).admit(_client(), hold)
+
+
+def _release_upload(reservation: Job):
+    get_admission_controller(current_app.config).release(reservation)
 
-    # 2. Create a Document entity
-    model_document = Document.create(
-        file=model_file,
-        type="Unknown",
-    )
-    model_document.save()
 
-    # 3. Analysis with LlamaIndex
-    # Initialize AgentController
-    agent = AgentController(
-        persist_dir=current_app.config.get("STORAGE_DIR") or "storage"
+def _retry_later(response, rejection: Rejection):
+    response.status_code = rejection.status_code
+    response.headers["Retry-After"] = str(rejection.retry_after)
+    return response
+
+
+@sender.route("/upload", methods=["POST"])
+def upload():
+    # Larger bodies are cut off while they are read, before they are parsed
+    # and spooled, see validate_file
+    request.max_content_length = (
+        current_app.config.get("MAX_FILE_SIZE", 5 * 1024 * 1024) + MULTIPART_OVERHEAD
     )
 
-    analysis_result, steps = agent.run(model_file.get_path())
+    # Rejected before the file is parsed, when the workers can't keep up
+    admission = _admit_upload()
+    if isinstance(admission, Rejection):
+        flash(admission.message, "error")
+        return _retry_later(make_response(welcome()), admission)
 
-    if not steps or len(steps) == 0:
-        message = (
-            "No analysis steps determined by the system. "
-            "Please let us know about this bug. "
-            "Error Code: SA1001"
+    try:
+        try:
+            file = request.files.get("file")
+        except RequestEntityTooLarge:
+            flash(_too_large_message(), "error")
+            return redirect(url_for("sender.welcome"))
+        is_valid, error_message = validate_file(file)
+
+        if not is_valid:
+            flash(error_message or "Invalid file", "error")
+            return redirect(url_for("sender.welcome"))
+
+        # 1. Uploading the file, stored once by content
+        upload_manager = _upload_manager()
+        try:
+            uploaded_file = upload_manager.save_file(file)
+        except UploadError as e:
+            flash(str(e), "error")
+            return redirect(url_for("sender.welcome"))
+
+        return redirect(
+            analyze_upload(
+                upload_manager, uploaded_file, _refresh_requested(), admission
+            )
         )
-        flash(message, "error")
-        return redirect(url_for("sender.welcome"))
-
-    if not analysis_result or len(analysis_result) == 0:
-        message = (
-            "No analysis result determined by the system. "
-            "Please let us know about this bug. "
-            "Error Code: SA1002"
+    finally:
+        _release_upload(admission)
+
+
+def analyze_upload(
+    upload_manager: UploadManager,
+    uploaded_file: UploadFileInfo,
+    refresh: bool,
+    reservation: Optional[Job] = None,
+) -> str:
+    """Queue the analysis of a stored upload, unless its content is known.
+
+    :param reservation: The place reserved in the queue by the admission of
+                        the upload, used by the queued job.
+    :return: The URL of the analysis page.
+    """
+    try:
+        model_file = File.get_by_content(uploaded_file.sha256_content)
+        if model_file is None:
+            model_file = File.create(
+                sha256_content=uploaded_file.sha256_content,
+                filename=uploaded_file.filename,
+                orig_filename=uploaded_file.orig_filename,
+                file_type=uploaded_file.content_type,
+                file_size=uploaded_file.content_length,
+            )
+        else:
+            if uploaded_file.created and model_file.filename != uploaded_file.filename:
+                # Content stored before the upload store, under another name
+                if os.path.exists(model_file.get_path()):
+                    upload_manager.delete_file(uploaded_file.filename)
+                else:
+                    model_file.filename = uploaded_file.filename
+                    model_file.save()
+
+            # Known content: show its analysis (or wait for the running one),
+            # the index and the responses don't depend on the file name.
+            if not refresh:
+                model_analysis_result = model_file.get_latest_analysis_result()
+                if model_analysis_result is not None:
+                    flash("This document has already been analyzed.", "success")
+                    return url_for("sender.analysis", a=model_analysis_result.id)
+
+                job = model_file.get_pending_job()
+                if job is not None:
+                    flash("This document is already being analyzed.", "success")
+                    return url_for("sender.analysis", job=job.id)
+
+            # Counts the document created below, File.create counts the first one
+            model_file.acquire()
+
+        # 2. Create a Document entity
+        model_document = Document.create(
+            file=model_file,
+            type="Unknown",
         )
-        flash(message, "error")
-        return redirect(url_for("sender.welcome"))
 
-    model_analysis_result = AnalysisResult.create(
-        document=model_document,
-        analysis_result=json.dumps(analysis_result),
-        analysis_steps=json.dumps(steps),
-    )
-    model_analysis_result.save()
+        # 3. Queue the analysis, run by the workers (flask worker)
+        job = enqueue_analysis(
+            model_document,
+            refresh=refresh,
+            max_attempts=current_app.config.get("JOB_MAX_ATTEMPTS", 3),
+            client=_client(),
+            reservation=reservation,
+        )
 
-    model_document.type = analysis_result.get("document_type", "Unknown")
-    model_document.save()
+        # The job also locates the signature fields of the document, stored
+        # with its analysis result, see AgentController._locate_signature_fields
+
+        # 4. Show /analysis, with the results once the job is done.
+        # For example '/analysis?job=2'
+        flash("File uploaded successfully!", "success")
+        return url_for("sender.analysis", job=job.id)
+    finally:
+        # Once the document holds its reference, or the upload was dropped
+        upload_manager.settle(uploaded_file)
+
+
+def _upload_status(upload: ChunkedUpload):
+    status = upload.as_dict()
+    status["url"] = url_for("sender.upload_chunk", upload_id=upload.upload_id)
+    return jsonify(status)
+
+
+@sender.route("/uploads", endpoint="create_upload", methods=["POST"])
+def create_upload():
+    """Start a chunked upload, for files too large for a single request.
+
+    The JSON body gives the ``filename``, ``size`` and ``content_type`` of
+    the file. The chunks are then sent in order with PUT requests on the
+    returned ``url``, with their ``offset`` as a query parameter, and the
+    upload is finalized by a POST on ``<url>/finalize``. After a dropped
+    connection, a GET on the ``url`` returns the offset to resume from.
+
+    Uploads are rejected with 503 (queue full) or 429 (too many analyses of
+    the client) and a Retry-After header when the workers can't keep up.
+    """
+    data = request.get_json(silent=True) or {}
+    filename = data.get("filename") or ""
+    if not allowed_file(filename):
+        return jsonify(error="Invalid file type"), 400
+    try:
+        size = int(data.get("size"))
+    except (TypeError, ValueError):
+        return jsonify(error="Invalid file size."), 400
+
+    # The place in the queue is kept until the upload is finalized, or
+    # expires with it
+    admission = _admit_upload(current_app.config.get("UPLOAD_EXPIRY", 86400))
+    if isinstance(admission, Rejection):
+        return _retry_later(
+            jsonify(
+                error=admission.message,
+                reason=admission.reason,
+                retry_after=admission.retry_after,
+            ),
+            admission,
+        )
 
-    # 4. Defining and adding signature fields
-    # TODO: Implement signature placement
+    try:
+        upload = get_chunked_uploads(current_app.config).create(
+            filename,
+            data.get("content_type") or "application/octet-stream",
+            size,
+            reservation_id=admission.id,
+        )
+    except UploadError as e:
+        _release_upload(admission)
+        return jsonify(error=str(e)), 400
+
+    response = _upload_status(upload)
+    response.status_code = 201
+    response.headers["Location"] = response.json["url"]
+    return response
+
+
+@sender.route("/uploads/<upload_id>", endpoint="upload_chunk", methods=["GET", "PUT"])
+def upload_chunk(upload_id: str):
+    """Return the state of a chunked upload, or append a chunk (PUT)."""
+    uploads = get_chunked_uploads(current_app.config)
+    if request.method == "GET":
+        upload = uploads.get(upload_id)
+        if upload is None:
+            return jsonify(error=f"Upload {upload_id} not found."), 404
+        return _upload_status(upload)
+
+    offset = request.args.get("offset", type=int)
+    if offset is None:
+        return jsonify(error="Missing offset."), 400
+    try:
+        upload = uploads.write_chunk(upload_id, offset, request.stream)
+    except UploadNotFound as e:
+        return jsonify(error=str(e)), 404
+    except OffsetMismatch as e:
+        return jsonify(error=str(e), offset=e.offset), 409
+    except UploadError as e:
+        return jsonify(error=str(e)), 400
+    return _upload_status(upload)
+
+
+@sender.route(
+    "/uploads/<upload_id>/finalize", endpoint="finalize_upload", methods=["POST"]
+)
+def finalize_upload(upload_id: str):
+    """Store a complete chunked upload and queue its analysis."""
+    upload_manager = _upload_manager()
+    uploads = get_chunked_uploads(current_app.config)
+    upload = uploads.get(upload_id)
+    reservation = None
+    if upload is not None and upload.reservation_id is not None:
+        # None once expired
+        reservation = Job.get(upload.reservation_id)
+    try:
+        uploaded_file = uploads.finalize(upload_id, upload_manager)
+    except UploadNotFound as e:
+        return jsonify(error=str(e)), 404
+    except UploadError as e:
+        return jsonify(error=str(e)), 400
 
-    # 5. Redirect to /analysis with the results.
-    # For example '/analysis?a=2&d=20250105_114947_File2_with_signatures.pdf'
-    flash("File uploaded successfully!", "success")
-    redirect_to = url_for(
-        "sender.analysis",
-        a=model_analysis_result.id,
-    )
-    return redirect(redirect_to)
+    try:
+        return jsonify(
+            redirect=analyze_upload(
+                upload_manager, uploaded_file, _refresh_requested(), reservation
+            )
+        )
+    finally:
+        if reservation is not None:
+            _release_upload(reservation)
 
 
 @sender.route("/send", endpoint="send")
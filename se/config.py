@@ -24,10 +24,122 @@ class Config:
     ALLOWED_EXTENSIONS = {"pdf"}
     MAX_FILE_SIZE = 5 * 1024 * 1024  # 5 MB
     MIN_FILE_SIZE = 1024  # Minimum size for a valid PDF file in bytes
+    # Larger files, up to MAX_UPLOAD_SIZE, are sent by the browser in chunks
+    # of UPLOAD_CHUNK_SIZE bytes and can be resumed. Chunked uploads inactive
+    # for UPLOAD_EXPIRY seconds are deleted.
+    MAX_UPLOAD_SIZE = int(os.getenv("MAX_UPLOAD_SIZE", 200 * 1024 * 1024))
+    UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", 4 * 1024 * 1024))
+    UPLOAD_EXPIRY = float(os.getenv("UPLOAD_EXPIRY", 24 * 3600))
+
+    # PDF profiling settings.
+    # Documents with at least PDF_PARALLEL_MIN_PAGES pages are profiled in a
+    # pool of PDF_PROFILE_WORKERS processes (1 disables the pool). A page
+    # taking longer than PDF_PAGE_TIMEOUT seconds to profile or extract is
+    # reported as "unknown": pages are then read in a child process, killed
+    # on a page over budget (0 reads them in the calling thread).
+    PDF_PROFILE_WORKERS = int(os.getenv("PDF_PROFILE_WORKERS", os.cpu_count() or 1))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 100))
+    PDF_PAGE_TIMEOUT = float(os.getenv("PDF_PAGE_TIMEOUT", 5.0))
+    # Opt-in sampling: when set, backfilled profiles inspect at most this many
+    # pages of a document (first, last and a stratified random sample).
+    PDF_SAMPLE_SIZE = int(os.getenv("PDF_SAMPLE_SIZE", 0))
+
+    # OCR settings.
+    # Image-based pages are OCRed by a pool of OCR_WORKERS tesseract processes
+    # when tesseract is installed. Recognised text is cached in OCR_CACHE_DIR.
+    OCR_ENABLED = strtobool(os.getenv("OCR_ENABLED", "true"))
+    OCR_WORKERS = int(os.getenv("OCR_WORKERS", os.cpu_count() or 1))
+    OCR_LANGUAGE = os.getenv("OCR_LANGUAGE", "eng")
+    OCR_TIMEOUT = float(os.getenv("OCR_TIMEOUT", 60.0))
+    OCR_CACHE_DIR = os.getenv("OCR_CACHE_DIR", os.path.join(STORAGE_DIR, "ocr"))
+
+    # Memory budget in bytes of the loaded vector store indexes kept in the
+    # process (0 disables the cache).
+    INDEX_CACHE_BYTES = int(os.getenv("INDEX_CACHE_BYTES", 256 * 1024 * 1024))
+
+    # LLM backend: "openai", or an offline backend for load tests and CI:
+    # "replay" answers with the responses recorded in LLM_REPLAY_FILE and
+    # "synthetic" makes up schema-valid responses. Offline backends simulate
+    # the provider latency (e.g. "fixed:0.5", "uniform:0.2,1.5",
+    # "lognormal:0,0.5") and inject errors and malformed responses.
+    LLM_BACKEND = os.getenv("LLM_BACKEND", "openai")
+    LLM_REPLAY_FILE = os.getenv(
+        "LLM_REPLAY_FILE", os.path.join(STORAGE_DIR, "data", "llm_responses.jsonl")
+    )
+    LLM_OFFLINE_LATENCY = os.getenv("LLM_OFFLINE_LATENCY", "")
+    LLM_OFFLINE_ERROR_RATE = float(os.getenv("LLM_OFFLINE_ERROR_RATE", 0.0))
+    LLM_OFFLINE_MALFORMED_RATE = float(os.getenv("LLM_OFFLINE_MALFORMED_RATE", 0.0))
+    LLM_OFFLINE_SEED = (
+        int(os.getenv("LLM_OFFLINE_SEED")) if os.getenv("LLM_OFFLINE_SEED") else None
+    )
 
     # OpenAI settings.
     OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
     OPENAI_MODEL = os.getenv("OPENAI_MODEL", default="gpt-4o-mini")
+    OPENAI_EMBEDDING_MODEL = os.getenv(
+        "OPENAI_EMBEDDING_MODEL", default="text-embedding-ada-002"
+    )
+    # Maximum number of analysis category queries sent to the LLM at the same
+    # time, 1 queries the categories one after another.
+    LLM_QUERY_CONCURRENCY = int(os.getenv("LLM_QUERY_CONCURRENCY", 4))
+    # Small text and list categories are packed into prompts of at most this
+    # many tokens, each answered by a single LLM call (0 disables packing).
+    LLM_BATCH_TOKEN_BUDGET = int(os.getenv("LLM_BATCH_TOKEN_BUDGET", 0))
+    # Maximum size in tokens of the earlier responses appended to a category
+    # prompt, compacted to the fields the category needs (0 appends none).
+    LLM_CONTEXT_TOKEN_CAP = int(os.getenv("LLM_CONTEXT_TOKEN_CAP", 512))
+
+    # LLM response cache, keyed by document content, prompt, model and
+    # retrieval settings. Entries expire after LLM_CACHE_TTL seconds and the
+    # least recently used ones are evicted over LLM_CACHE_MAX_BYTES.
+    LLM_CACHE_ENABLED = strtobool(os.getenv("LLM_CACHE_ENABLED", "true"))
+    LLM_CACHE_PATH = os.getenv(
+        "LLM_CACHE_PATH", os.path.join(STORAGE_DIR, "llm_cache.sqlite3")
+    )
+    LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", 30 * 24 * 3600))
+    LLM_CACHE_MAX_BYTES = int(os.getenv("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+    # Documents are indexed while their pages are extracted, by a pipeline of
+    # stages (chunking, embedding, vector store insert) connected by queues
+    # of INGEST_QUEUE_SIZE items. Chunks are embedded by INGEST_BATCH_SIZE.
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 64))
+    INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 8))
+
+    # Analysis job queue, run by `flask worker`. A claimed job is locked for
+    # JOB_VISIBILITY_TIMEOUT seconds, extended while it runs, and claimed
+    # again once expired (e.g. after a worker crash), up to JOB_MAX_ATTEMPTS.
+    JOB_WORKER_CONCURRENCY = int(os.getenv("JOB_WORKER_CONCURRENCY", 2))
+    JOB_POLL_INTERVAL = float(os.getenv("JOB_POLL_INTERVAL", 1.0))
+    JOB_VISIBILITY_TIMEOUT = float(os.getenv("JOB_VISIBILITY_TIMEOUT", 600))
+    JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", 3))
+    # At most JOB_MAX_IN_FLIGHT analyses run at the same time over all the
+    # workers (0 for no limit), the senders sharing them fairly.
+    JOB_MAX_IN_FLIGHT = int(os.getenv("JOB_MAX_IN_FLIGHT", 0))
+    # The progress of a job is streamed to the browser (see job_events) by
+    # polling its events every JOB_EVENTS_POLL_INTERVAL seconds. A stream
+    # holds a server thread and a database session, it is closed after
+    # JOB_EVENTS_MAX_DURATION seconds and the browser reconnects.
+    JOB_EVENTS_POLL_INTERVAL = float(os.getenv("JOB_EVENTS_POLL_INTERVAL", 1.0))
+    JOB_EVENTS_MAX_DURATION = float(os.getenv("JOB_EVENTS_MAX_DURATION", 30))
+
+    # Admission of uploads (see se.modules.admission): once UPLOAD_QUEUE_LIMIT
+    # analyses are waiting, or UPLOAD_CLIENT_LIMIT for a sender, uploads are
+    # rejected at once with a Retry-After of UPLOAD_RETRY_AFTER seconds.
+    UPLOAD_QUEUE_LIMIT = int(os.getenv("UPLOAD_QUEUE_LIMIT", 50))
+    UPLOAD_CLIENT_LIMIT = int(os.getenv("UPLOAD_CLIENT_LIMIT", 5))
+    UPLOAD_RETRY_AFTER = int(os.getenv("UPLOAD_RETRY_AFTER", 30))
+    # Number of reverse proxies in front of the application whose
+    # X-Forwarded-For header is trusted, so the senders are told apart by
+    # their own address. Keep 0 when the application is reached directly,
+    # as the header could then be forged.
+    PROXY_FIX_X_FOR = int(os.getenv("PROXY_FIX_X_FOR", 0))
+
+    # Embeddings of the document chunks, shared by all the documents and keyed
+    # by embedding model and chunk text, so only unseen chunks are embedded.
+    EMBEDDING_CACHE_ENABLED = strtobool(os.getenv("EMBEDDING_CACHE_ENABLED", "true"))
+    EMBEDDING_CACHE_PATH = os.getenv(
+        "EMBEDDING_CACHE_PATH", os.path.join(STORAGE_DIR, "embeddings.sqlite3")
+    )
 
     # Flask-DebugToolbar.
     # For more see https://flask-debugtoolbar.readthedocs.io/en/latest/#configuration
@@ -3,7 +3,7 @@
 import json
 import os
 from datetime import datetime
-from typing import List
+from typing import Any, Callable, Iterable, Iterator, List, Optional
 
 import sqlalchemy as sa
 from flask import abort
@@ -11,7 +11,7 @@ from sqlalchemy import orm as so
 from sqlalchemy.sql import func
 
 from se.app import db
-from se.pdftools import detect_pdf_type
+from se.pdftools import PageText, PDFTypeInfo, extract_pdf, profile_pdf, stream_pdf
 
 
 class BaseMixin:
@@ -123,10 +123,68 @@ class File(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         nullable=False,
     )
 
+    # PDF profile, see se.pdftools.PDFTypeInfo. These fields are computed
+    # once per content at upload and are NULL for rows created before the
+    # profile was persisted (see get_pdf_info).
+    is_pdf: so.Mapped[Optional[bool]] = so.mapped_column(
+        sa.Boolean(),
+        nullable=True,
+    )
+
+    total_pages: so.Mapped[Optional[int]] = so.mapped_column(
+        sa.Integer(),
+        nullable=True,
+    )
+
+    page_types: so.Mapped[Optional[list]] = so.mapped_column(
+        sa.JSON(),
+        nullable=True,
+    )
+
+    overall_type: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(50),
+        index=True,
+        nullable=True,
+    )
+
+    # Whether overall_type is certain, False for a sampled profile which
+    # didn't inspect every page (see se.pdftools.PDFSampleInfo). NULL for
+    # rows profiled before sampling, which inspected every page.
+    profile_exact: so.Mapped[Optional[bool]] = so.mapped_column(
+        sa.Boolean(),
+        nullable=True,
+    )
+
+    # 1-based numbers of the pages inspected by a sampled profile, NULL when
+    # every page was inspected.
+    inspected_pages: so.Mapped[Optional[list]] = so.mapped_column(
+        sa.JSON(),
+        nullable=True,
+    )
+
+    # Number of documents of the content, the stored file is deleted with
+    # the last one (see Document.delete).
+    ref_count: so.Mapped[int] = so.mapped_column(
+        sa.Integer(),
+        nullable=False,
+        default=1,
+        server_default="1",
+    )
+
     document: so.Mapped[List["Document"]] = so.relationship(
         back_populates="file",
     )
 
+    @classmethod
+    def get_by_content(cls, sha256_content: str) -> Optional["File"]:
+        """Return the latest file with the given content, if any."""
+        return db.session.scalar(
+            sa.select(cls)
+            .where(cls.sha256_content == sha256_content)
+            .order_by(cls.id.desc())
+            .limit(1)
+        )
+
     def get_path(self) -> str:
         """Return the full path to the file."""
         from flask import current_app
@@ -134,6 +192,177 @@ class File(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         upload_folder = current_app.config.get("UPLOADS_DIR", "uploads")
         return os.path.join(upload_folder, self.filename)
 
+    def acquire(self):
+        """Count another document of the content."""
+        db.session.execute(
+            sa.update(File)
+            .where(File.id == self.id)
+            .values(ref_count=File.ref_count + 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        db.session.refresh(self)
+
+    def release(self) -> bool:
+        """Release a document of the content.
+
+        The stored file is deleted with its last reference, unless another
+        row has it, e.g. after concurrent first uploads of the content.
+
+        :return: True if the stored file was deleted.
+        """
+        from flask import current_app
+
+        from se.modules.upload_manager import UploadManager
+
+        db.session.execute(
+            sa.update(File)
+            .where(File.id == self.id, File.ref_count > 0)
+            .values(ref_count=File.ref_count - 1)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        db.session.refresh(self)
+
+        def unused() -> bool:
+            # Under the lock of the stores. An upload which found the content
+            # before the delete stores it again, see UploadManager.settle
+            db.session.commit()  # Sees the references taken since the refresh
+            return not db.session.scalar(
+                sa.select(sa.func.count(File.id)).where(
+                    File.filename == self.filename, File.ref_count > 0
+                )
+            )
+
+        return UploadManager(
+            current_app.config.get("UPLOADS_DIR", "uploads")
+        ).delete_file(self.filename, unused=unused)
+
+    def get_latest_analysis_result(self) -> Optional["AnalysisResult"]:
+        """Return the latest analysis of the documents of the file."""
+        return db.session.scalar(
+            sa.select(AnalysisResult)
+            .join(Document)
+            .where(Document.file_id == self.id)
+            .order_by(AnalysisResult.id.desc())
+            .limit(1)
+        )
+
+    def get_pending_job(self) -> Optional["Job"]:
+        """Return a queued or running analysis of the documents of the file."""
+        return db.session.scalar(
+            sa.select(Job)
+            .join(Document)
+            .where(
+                Document.file_id == self.id,
+                Job.status.in_((Job.QUEUED, Job.PROCESSING)),
+            )
+            .order_by(Job.id.desc())
+            .limit(1)
+        )
+
+    def has_pdf_info(self) -> bool:
+        """Check if the PDF profile has been computed for this file."""
+        return self.is_pdf is not None
+
+    def is_pdf_info_exact(self) -> bool:
+        """Check if the stored PDF profile is certain, i.e. not sampled."""
+        return self.profile_exact is not False
+
+    def get_pdf_info(self, exact: bool = False) -> Optional[PDFTypeInfo]:
+        """Return the PDF profile of the file.
+
+        The profile is read from the database. Rows created before the profile
+        was persisted are backfilled lazily on first access, sampling the
+        pages if PDF_SAMPLE_SIZE is set. The profile has an ``exact`` key, and
+        the ``inspected_pages`` when sampled.
+
+        :param exact: Profile every page if the stored profile is sampled and
+                      not exact, e.g. when the type of each page is needed.
+        :return: The PDF profile or None if the file is not a PDF.
+        """
+        if self.file_type != "application/pdf":
+            return None
+
+        if not self.has_pdf_info() or (exact and not self.is_pdf_info_exact()):
+            self.update_pdf_info(sample=not exact)
+            self.save()
+
+        info = {
+            "is_pdf": bool(self.is_pdf),
+            "total_pages": self.total_pages or 0,
+            "page_types": list(self.page_types or []),
+            "overall_type": self.overall_type or "Unknown",
+            "exact": self.is_pdf_info_exact(),
+        }
+        if self.inspected_pages is not None:
+            info["inspected_pages"] = list(self.inspected_pages)
+        return info
+
+    def set_pdf_info(self, info: PDFTypeInfo):
+        """Store the given PDF profile on the model without saving it.
+
+        :param info: A full profile, or a sampled one (PDFSampleInfo).
+        """
+        self.is_pdf = info["is_pdf"]
+        self.total_pages = info["total_pages"]
+        self.page_types = list(info["page_types"])
+        self.overall_type = info["overall_type"]
+        self.profile_exact = info.get("exact", True)
+        inspected_pages = info.get("inspected_pages")
+        self.inspected_pages = (
+            list(inspected_pages) if inspected_pages is not None else None
+        )
+
+    def update_pdf_info(self, sample: bool = True):
+        """Compute the PDF profile of the file without saving the model.
+
+        The profile depends only on the file content, so it is copied from
+        any other file with the same sha256_content when available. Otherwise
+        the file is profiled from disk.
+
+        :param sample: Sample the pages if PDF_SAMPLE_SIZE is set. Otherwise
+                       only exact profiles are copied and every page is
+                       profiled.
+        """
+        query = sa.select(File).where(
+            File.sha256_content == self.sha256_content,
+            File.is_pdf.is_not(None),
+        )
+        if self.id is not None:
+            query = query.where(File.id != self.id)
+        if not sample:
+            query = query.where(File.profile_exact.is_not(False))
+
+        # Exact profiles first
+        donor = db.session.scalar(
+            query.order_by(File.profile_exact.is_(False)).limit(1)
+        )
+
+        if donor is not None:
+            info = {
+                "is_pdf": bool(donor.is_pdf),
+                "total_pages": donor.total_pages or 0,
+                "page_types": donor.page_types or [],
+                "overall_type": donor.overall_type or "Unknown",
+                "exact": donor.is_pdf_info_exact(),
+            }
+            if donor.inspected_pages is not None:
+                info["inspected_pages"] = donor.inspected_pages
+            self.set_pdf_info(info)
+        else:
+            from flask import current_app
+
+            config = current_app.config
+            info = profile_pdf(
+                self.get_path(),
+                workers=config.get("PDF_PROFILE_WORKERS", 1),
+                page_timeout=config.get("PDF_PAGE_TIMEOUT"),
+                min_parallel_pages=config.get("PDF_PARALLEL_MIN_PAGES", 100),
+                sample_size=(config.get("PDF_SAMPLE_SIZE") or None) if sample else None,
+            )
+            self.set_pdf_info(info)
+
 
 class Document(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
     __tablename__ = "documents"
@@ -164,6 +393,41 @@ class Document(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         cascade="all, delete-orphan",
     )
 
+    @classmethod
+    def expire(cls, before: datetime) -> int:
+        """Delete the documents created before the given time.
+
+        The documents still being analyzed are kept.
+
+        :param before: UTC time of creation of the newest deleted documents.
+        :return: The number of deleted documents.
+        """
+        pending = sa.select(Job.document_id).where(
+            Job.document_id.is_not(None),
+            Job.status.in_((Job.QUEUED, Job.PROCESSING)),
+        )
+        documents = db.session.scalars(
+            sa.select(cls).where(cls.created_at < before, cls.id.not_in(pending))
+        ).all()
+        for document in documents:
+            document.delete()
+        return len(documents)
+
+    def delete(self):
+        """Delete the document, its pages, analyses and jobs.
+
+        The stored file is deleted with the last document of its content.
+        """
+        jobs = sa.select(Job.id).where(Job.document_id == self.id)
+        db.session.execute(sa.delete(JobEvent).where(JobEvent.job_id.in_(jobs)))
+        db.session.execute(sa.delete(Job).where(Job.document_id == self.id))
+        db.session.execute(
+            sa.delete(AnalysisResult).where(AnalysisResult.document_id == self.id)
+        )
+        model_file = self.file
+        super().delete()
+        model_file.release()
+
     def get_num_pages(self) -> int:
         """Return the number of pages in the document."""
         return len(self.pages) if self.pages else 0
@@ -174,14 +438,161 @@ class Document(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         return "\n".join(page.page_content for page in pages)
 
     def get_pages_summary(self) -> List[dict]:
-        """Return a list of dictionaries with page_number and page_content."""
+        """Return a list of dictionaries with page_number, page_label and
+        page_content."""
         return [
-            {"page_number": page.page_number, "page_content": page.page_content}
+            {
+                "page_number": page.page_number,
+                "page_label": page.page_label or str(page.page_number),
+                "page_content": page.page_content,
+            }
             for page in sorted(self.pages, key=lambda p: p.page_number)
         ]
 
+    def extract_pages(
+        self, ingest: Optional[Callable[[Iterable[PageText]], Any]] = None
+    ):
+        """Extract the text of the pages and profile the file in a single pass.
+
+        Fills the pages table and stores the PDF profile on the file, so
+        neither the index nor the analysis views need to read the file
+        again. Image-based pages are OCRed (see ocr_pages). Does nothing for
+        files other than PDF.
+
+        :param ingest: Consumes the pages while they are extracted, e.g. to
+                       index them at the same time (LlamaAnalyzer.ingest).
+                       It may run them in other threads.
+        """
+        if self.file.file_type != "application/pdf":
+            return
+
+        from flask import current_app
+
+        page_timeout = current_app.config.get("PDF_PAGE_TIMEOUT")
+        if ingest is None:
+            info, pages = extract_pdf(self.file.get_path(), page_timeout)
+            self.ocr_pages(info, pages)
+        else:
+            from se.modules.ocr import get_ocr_pool
+
+            info: PDFTypeInfo = {
+                "is_pdf": False,
+                "total_pages": 0,
+                "page_types": [],
+                "overall_type": "Unknown",
+            }
+            pages = []
+            stream = _stream_pdf_pages(
+                self.file.get_path(),
+                info,
+                get_ocr_pool(current_app.config),
+                page_timeout,
+            )
+            try:
+                ingest(_collect(stream, pages))
+            except _ExtractionFailed:
+                # The index of the pages read so far is not persisted, and
+                # the pages are dropped as extract_pdf does
+                pages = []
+            pages.sort(key=lambda page: page["page_number"])
+
+        self.file.set_pdf_info(info)
+        self.file.save()
+        self.add_pages(pages)
+
+    def ocr_pages(self, info: PDFTypeInfo, pages: List[dict]):
+        """Replace the text of image-based pages with their OCR text.
+
+        Does nothing if OCR is disabled or tesseract is not installed.
+        """
+        indices = [
+            index
+            for index, page_type in enumerate(info["page_types"])
+            if page_type == "image-based" and index < len(pages)
+        ]
+        if not indices:
+            return
+
+        from flask import current_app
+
+        from se.modules.ocr import get_ocr_pool
+
+        pool = get_ocr_pool(current_app.config)
+        if pool is None:
+            return
+
+        for index, text in pool.recognize_pages(self.file.get_path(), indices).items():
+            pages[index]["page_content"] = text
+
+    def add_pages(self, pages: List[dict]):
+        """Store the content of the document pages with a single bulk insert.
+
+        :param pages: Dictionaries with page_number, page_content and
+                      optionally page_label keys, e.g. as returned by
+                      se.pdftools.extract_pdf.
+        """
+        if not pages:
+            return
+
+        db.session.execute(
+            sa.insert(Page),
+            [
+                {
+                    "document_id": self.id,
+                    "page_number": page["page_number"],
+                    "page_label": page.get("page_label"),
+                    "page_content": page["page_content"],
+                }
+                for page in pages
+            ],
+        )
+        db.session.commit()
+        db.session.expire(self, ["pages"])
+
+
+class _ExtractionFailed(Exception):
+    """The pages of a file could not all be extracted."""
+
+
+def _collect(items: Iterable, collected: list) -> Iterator:
+    """Iterate over items, keeping them in a list."""
+    for item in items:
+        collected.append(item)
+        yield item
+
+
+def _stream_pdf_pages(
+    path: str, info: PDFTypeInfo, ocr_pool=None, page_timeout: Optional[float] = None
+) -> Iterator[PageText]:
+    """Extract the pages of a PDF one by one, OCRing the image-based pages.
+
+    Text-based pages are yielded as soon as they are extracted. Image-based
+    pages are OCRed together once all the pages are read, so the OCR workers
+    run in parallel, and yielded last. See se.pdftools.stream_pdf for
+    ``info``.
+
+    Runs without the application or the database, e.g. in a pipeline thread.
+
+    :raise _ExtractionFailed: Once the pages are read, if the file could not
+                              be read to the end.
+    """
+    image_pages = {}
+    for page, page_type in stream_pdf(path, info, page_timeout):
+        if page_type == "image-based" and ocr_pool is not None:
+            image_pages[page["page_number"] - 1] = page
+        else:
+            yield page
+
+    if not info["is_pdf"]:
+        raise _ExtractionFailed(f"{path} could not be read")
+
+    if image_pages:
+        texts = ocr_pool.recognize_pages(path, image_pages)
+        for index, page in image_pages.items():
+            page["page_content"] = texts.get(index, page["page_content"])
+            yield page
+
 
-# TODO: No longer needed, remove
 class Page(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
     """Represents the content of a specific page of a document."""
 
@@ -208,6 +619,13 @@ class Page(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         nullable=False,
     )
 
+    # Label printed on the page, e.g. "iv" or "A-3", cited by the analyses.
+    # None for the pages stored before the labels were.
+    page_label: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(64),
+        nullable=True,
+    )
+
 
 class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
     __tablename__ = "analysis_results"
@@ -230,6 +648,13 @@ class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         sa.JSON(),
     )
 
+    # Time, tokens and cost of the LLM calls of the analysis, see
+    # se.modules.llm_metrics.RunMetrics. NULL for older analyses.
+    metrics: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.JSON(),
+        nullable=True,
+    )
+
     def get_analysis_object(self):
         """
         Return the parsed Python object from the JSON analysis_result field.
@@ -256,6 +681,19 @@ class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
         except json.JSONDecodeError as e:
             raise ValueError(f"Invalid JSON format in analysis_steps: {e}")
 
+    def get_metrics_object(self) -> dict:
+        """
+        Return the parsed Python object from the JSON metrics field.
+
+        :return: Parsed metrics, an empty dict if they were not recorded.
+        """
+        try:
+            if self.metrics and isinstance(self.metrics, str):
+                return json.loads(self.metrics)
+            return dict()
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Invalid JSON format in metrics: {e}")
+
     def get_combined_analysis(self) -> dict:
         """Merge the analysis steps and analysis result into a single dictionary."""
         step_data = self.get_steps_object()
@@ -272,12 +710,10 @@ class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
             "overall_type": "Unknown",
         }
 
-        # Detect if the file is a PDF.
-        file_type = self.document.file.file_type
-        if file_type == "application/pdf":
-            pdf_type = detect_pdf_type(self.document.file.get_path())
-            if pdf_type:
-                file_info = pdf_type
+        # Use the PDF profile stored at upload.
+        pdf_info = self.document.file.get_pdf_info()
+        if pdf_info:
+            file_info = pdf_info
 
         # Initialize the result dictionary
         result = {
@@ -285,6 +721,7 @@ class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
             "document_type": document_type,
             "file_name": self.document.file.orig_filename,
             "file_info": file_info,
+            "metrics": self.get_metrics_object(),
             "analysis": [],
         }
 
@@ -312,3 +749,135 @@ class AnalysisResult(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
             result["analysis"].append(analysis_item)
 
         return result
+
+
+class Job(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
+    """A background job, claimed and run by the workers.
+
+    A worker claims a queued job by setting it as processing and locking it
+    until ``locked_until`` (the visibility timeout), which the worker keeps
+    extending while the job runs. A processing job whose lock expired, e.g.
+    because its worker crashed, is claimed again. See se.modules.jobs.
+    """
+
+    __tablename__ = "jobs"
+
+    # A place in the queue taken by an upload in progress, until
+    # ``locked_until`` (see se.modules.jobs.reserve_analysis)
+    RESERVED = "reserved"
+    QUEUED = "queued"
+    PROCESSING = "processing"
+    DONE = "done"
+    FAILED = "failed"
+
+    kind: so.Mapped[str] = so.mapped_column(
+        sa.String(50),
+        nullable=False,
+        index=True,
+    )
+
+    status: so.Mapped[str] = so.mapped_column(
+        sa.String(20),
+        nullable=False,
+        index=True,
+        default=QUEUED,
+    )
+
+    document_id: so.Mapped[Optional[int]] = so.mapped_column(
+        sa.ForeignKey("documents.id"),
+        nullable=True,
+        index=True,
+    )
+
+    document: so.Mapped[Optional["Document"]] = so.relationship()
+
+    # The sender who queued the job (e.g. its IP address), the workers share
+    # the capacity fairly between senders
+    client: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(255),
+        nullable=True,
+        index=True,
+    )
+
+    # Options of the job, e.g. {"refresh": true}
+    payload: so.Mapped[Optional[dict]] = so.mapped_column(
+        sa.JSON(),
+        nullable=True,
+    )
+
+    attempts: so.Mapped[int] = so.mapped_column(
+        sa.Integer(),
+        nullable=False,
+        default=0,
+    )
+
+    max_attempts: so.Mapped[int] = so.mapped_column(
+        sa.Integer(),
+        nullable=False,
+        default=3,
+    )
+
+    locked_by: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.String(255),
+        nullable=True,
+    )
+
+    # UTC time the lock expires at
+    locked_until: so.Mapped[Optional[datetime]] = so.mapped_column(
+        sa.DateTime(),
+        nullable=True,
+        index=True,
+    )
+
+    error: so.Mapped[Optional[str]] = so.mapped_column(
+        sa.Text(),
+        nullable=True,
+    )
+
+    analysis_result_id: so.Mapped[Optional[int]] = so.mapped_column(
+        sa.ForeignKey("analysis_results.id"),
+        nullable=True,
+    )
+
+    analysis_result: so.Mapped[Optional["AnalysisResult"]] = so.relationship()
+
+    def is_finished(self) -> bool:
+        """Check whether the job is done or failed for good."""
+        return self.status in (self.DONE, self.FAILED)
+
+    def as_dict(self) -> dict:
+        """Return the status of the job."""
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "status": self.status,
+            "attempts": self.attempts,
+            "error": self.error,
+            "analysis_result_id": self.analysis_result_id,
+        }
+
+
+class JobEvent(BaseMixin, IdentityMixin, TimestampMixin, db.Model):
+    """A progress event of a job, e.g. the result of an analysis category.
+
+    Events are written by the workers and streamed to the browser by the
+    job events endpoint, in the order of their identifiers.
+    """
+
+    __tablename__ = "job_events"
+
+    job_id: so.Mapped[int] = so.mapped_column(
+        sa.ForeignKey("jobs.id"),
+        nullable=False,
+        index=True,
+    )
+
+    event: so.Mapped[str] = so.mapped_column(
+        sa.String(50),
+        nullable=False,
+    )
+
+    data: so.Mapped[Optional[dict]] = so.mapped_column(
+        sa.JSON(),
+        nullable=True,
+    )
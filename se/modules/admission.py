@@ -0,0 +1,157 @@
+"""Admission control of the uploads, in front of the analysis job queue."""
+
+import threading
+from dataclasses import dataclass
+from typing import Dict, Optional, Union
+
+from se.models import Job
+from se.modules.jobs import cancel_reservation, count_jobs, reserve_analysis
+
+# Reasons of the rejections
+QUEUE_FULL = "queue_full"
+CLIENT_LIMIT = "client_limit"
+
+# Seconds an upload keeps its place in the queue if it is never released,
+# e.g. when the server stops while reading it
+RESERVATION_HOLD = 600
+
+
+@dataclass
+class Rejection:
+    """An upload rejected before it is read, to be retried later."""
+
+    reason: str
+    message: str
+    status_code: int
+    # Seconds to wait before retrying, sent as the Retry-After header
+    retry_after: int
+
+
+class AdmissionController:
+    """Decides whether an upload is accepted, before reading it.
+
+    The workers run a bounded number of analyses at a time (see
+    JOB_MAX_IN_FLIGHT), the others wait in the job queue. Once the queue
+    holds ``queue_limit`` jobs, uploads are rejected at once instead of
+    making the queue grow. A client can't have more than ``client_limit``
+    analyses waiting or running, so a single sender can't fill the queue.
+
+    An admitted upload reserves its place in the queue while its body is
+    read (see reserve_analysis), so concurrent uploads are counted. The
+    place is released once the upload ends (see release).
+
+    The admitted (uploads that queued a job) and rejected counts are kept
+    in the process.
+
+    :param queue_limit: Maximum number of queued jobs, 0 for no limit.
+    :param client_limit: Maximum number of pending jobs of a client, 0 for
+                         no limit.
+    :param retry_after: Seconds the rejected clients are asked to wait.
+    """
+
+    def __init__(self, queue_limit: int = 50, client_limit: int = 5, retry_after=30):
+        self.queue_limit = queue_limit
+        self.client_limit = client_limit
+        self.retry_after = retry_after
+        self.admitted = 0
+        self.rejected: Dict[str, int] = {QUEUE_FULL: 0, CLIENT_LIMIT: 0}
+        self._lock = threading.Lock()
+
+    def admit(
+        self, client: Optional[str], hold: float = RESERVATION_HOLD
+    ) -> Union[Job, Rejection]:
+        """Admit an upload of the client, reserving its place in the queue.
+
+        :param hold: Seconds the place is reserved, if the upload is never
+                     released.
+        :return: The reservation, to release once the upload ends, or the
+                 rejection.
+        """
+        reservation = reserve_analysis(
+            client, hold, self.queue_limit, self.client_limit
+        )
+        if reservation is not None:
+            return reservation
+
+        jobs = count_jobs()
+        if (
+            self.queue_limit
+            and jobs[Job.RESERVED] + jobs[Job.QUEUED] >= self.queue_limit
+        ):
+            rejection = Rejection(
+                reason=QUEUE_FULL,
+                message="Too many documents are being analyzed, "
+                "please try again in a moment.",
+                status_code=503,
+                retry_after=self.retry_after,
+            )
+        else:
+            rejection = Rejection(
+                reason=CLIENT_LIMIT,
+                message="Your previous documents are still being analyzed, "
+                "please try again once they are done.",
+                status_code=429,
+                retry_after=self.retry_after,
+            )
+        with self._lock:
+            self.rejected[rejection.reason] += 1
+        return rejection
+
+    def release(self, reservation: Job):
+        """End an admitted upload.
+
+        The upload is counted as admitted if its reservation was queued,
+        its place is freed otherwise (invalid upload, error, or known
+        content whose analysis is reused).
+        """
+        if cancel_reservation(reservation):
+            return
+        with self._lock:
+            self.admitted += 1
+
+    def export(self) -> str:
+        """Export the queue depth and the admission counts.
+
+        :return: The metrics in the Prometheus text format.
+        """
+        jobs = count_jobs()
+        with self._lock:
+            admitted, rejected = self.admitted, dict(self.rejected)
+
+        lines = [
+            "# HELP se_jobs Analysis jobs waiting or running.",
+            "# TYPE se_jobs gauge",
+        ]
+        lines += [f'se_jobs{{status="{status}"}} {n}' for status, n in jobs.items()]
+        lines += [
+            "# HELP se_uploads_admitted_total Uploads admitted by the process.",
+            "# TYPE se_uploads_admitted_total counter",
+            f"se_uploads_admitted_total {admitted}",
+            "# HELP se_uploads_rejected_total Uploads rejected by the process.",
+            "# TYPE se_uploads_rejected_total counter",
+        ]
+        lines += [
+            f'se_uploads_rejected_total{{reason="{reason}"}} {n}'
+            for reason, n in rejected.items()
+        ]
+        return "\n".join(lines) + "\n"
+
+
+_controllers = {}
+_controllers_lock = threading.Lock()
+
+
+def get_admission_controller(config) -> AdmissionController:
+    """Return the process-wide admission controller of the application.
+
+    :param config: The application config.
+    """
+    key = (
+        config.get("UPLOAD_QUEUE_LIMIT", 50),
+        config.get("UPLOAD_CLIENT_LIMIT", 5),
+        config.get("UPLOAD_RETRY_AFTER", 30),
+    )
+    with _controllers_lock:
+        if key not in _controllers:
+            _controllers[key] = AdmissionController(*key)
+        return _controllers[key]
@@ -1,28 +1,99 @@
 import json
 import logging
 import os
+import time
 from pathlib import Path
-from typing import Union
-
-from se.modules.llama_analyzer import LlamaAnalyzer
+from typing import Iterable, List, Optional, Union
+
+from se.modules.embedding_cache import EmbeddingCache
+from se.modules.extractors import SKIPPED
+from se.modules.llama_analyzer import CATEGORY_EVENT, EventCallback, LlamaAnalyzer
+from se.modules.llm_metrics import RunMetrics
+from se.modules.prompt_context import PromptTokens
+from se.modules.response_cache import ResponseCache
+from se.pdftools import locate_signature_fields
 from se.utils import load_prompt
 
 logger = logging.getLogger("se.agent_controller")
 
 
 class AgentController:
-    def __init__(self, persist_dir: Union[str, Path], max_iterations=5):
-        self.analyzer = LlamaAnalyzer(persist_dir=persist_dir)
+    def __init__(
+        self,
+        persist_dir: Union[str, Path],
+        max_iterations=5,
+        query_concurrency: int = 1,
+        batch_token_budget: int = 0,
+        response_cache: Optional[ResponseCache] = None,
+        model: str = "",
+        embedding_cache: Optional[EmbeddingCache] = None,
+        context_token_cap: int = 512,
+        embedding_model: str = "",
+        on_event: Optional[EventCallback] = None,
+        ingest_batch_size: int = 64,
+        ingest_queue_size: int = 8,
+    ):
+        self.analyzer = LlamaAnalyzer(
+            persist_dir=persist_dir,
+            query_concurrency=query_concurrency,
+            batch_token_budget=batch_token_budget,
+            response_cache=response_cache,
+            model=model,
+            embedding_cache=embedding_cache,
+            context_token_cap=context_token_cap,
+            embedding_model=embedding_model,
+            ingest_batch_size=ingest_batch_size,
+            ingest_queue_size=ingest_queue_size,
+        )
+        # Progress events: planning, steps, category and missing_data
+        self.analyzer.on_event = on_event
         self.max_iterations = max_iterations
         self.analysis_result = {}
         self.steps = {}
         self.missing_data = {}
-
-    def run(self, file: str):
+        # The document was ingested for the next run, see ingest
+        self._ingested = False
+
+    def ingest(self, file: str, pages: Iterable[dict]):
+        """Index the pages of a file while they are extracted, before run.
+
+        The calls made to index the pages are part of the metrics of the
+        next run.
+        """
+        self.analyzer.metrics = RunMetrics()
+        self.analyzer.ingest(file, pages)
+        self._ingested = True
+
+    def run(
+        self,
+        file: str,
+        pages: Optional[List[dict]] = None,
+        content_hash: Optional[str] = None,
+        refresh: bool = False,
+    ):
+        """Run the analysis of the given file.
+
+        :param file: Path to the document file.
+        :param pages: Text of the pages extracted at upload (dictionaries with
+                      page_number and page_content keys). When given, the
+                      index is built from it instead of re-reading the file.
+        :param content_hash: SHA-256 of the file content. When given, LLM
+                             responses are cached for this content.
+        :param refresh: Query the LLM even if responses are cached.
+        """
         if not file or not os.path.exists(file):
             raise ValueError(f"File '{file}' does not exist.")
 
+        self.analyzer.content_hash = content_hash
+        self.analyzer.refresh_cache = refresh
+        self.analyzer.prompt_tokens = PromptTokens()
+        if not self._ingested:
+            self.analyzer.metrics = RunMetrics()
+        self._ingested = False
+        started = time.perf_counter()
+
         logger.info("Start agent...")
+        self.analyzer.emit("planning", {})
 
         # Determine dynamic initial analysis steps.
         # This should be done only once for the initial analysis.
@@ -44,7 +115,7 @@ class AgentController:
         # }
         steps_are_valid = False
         for i in range(self.max_iterations):
-            self.steps = self.analyzer.determine_analysis_steps(file=file)
+            self.steps = self.analyzer.determine_analysis_steps(file=file, pages=pages)
             steps_are_valid = self._validate_analysis_steps(self.steps)
             if steps_are_valid:
                 break
@@ -53,8 +124,33 @@ class AgentController:
             logger.error("Unable to determine analysis steps")
             return None, None
 
+        self.analyzer.emit("steps", self.steps)
+
+        # Signature fields are located from the layout of the document,
+        # so the LLM is only asked for the remaining categories.
+        analysis_steps = self.steps
+        signature_fields = self._locate_signature_fields(file)
+        if signature_fields is not None:
+            logger.info("Signature fields located without the LLM")
+            self.analyzer.record_extraction("signature_fields", SKIPPED)
+            self.analyzer.emit(
+                CATEGORY_EVENT,
+                {"category": "signature_fields", "result": signature_fields},
+            )
+            analysis_steps = {
+                **self.steps,
+                "analysis_steps": [
+                    step
+                    for step in self.steps["analysis_steps"]
+                    if step["category"] != "signature_fields"
+                ],
+            }
+
         for i in range(self.max_iterations):
             if len(self.missing_data) > 0:
+                self.analyzer.emit(
+                    "missing_data", {"iteration": i, "missing": self.missing_data}
+                )
                 missing_result = self.analyzer.analyze_text(
                     file=file,
                     # We already did the initial analysis,
@@ -66,18 +162,84 @@ class AgentController:
 
                 logger.info("Analysis incomplete. Prepare a prompt for missing data...")
                 self.analysis_result = self._merge_missing_to_analysis(missing_result)
+                for category in (missing_result or {}).get("categories") or {}:
+                    self.analyzer.emit(
+                        CATEGORY_EVENT,
+                        {
+                            "category": category,
+                            "result": self.analysis_result.get(category),
+                        },
+                    )
             else:
                 self.analysis_result = self.analyzer.analyze_text(
                     file=file,
-                    steps=self.steps,
+                    steps=analysis_steps,
+                    pages=pages,
                 )
 
+            if signature_fields is not None and self.analysis_result is not None:
+                self.analysis_result["signature_fields"] = signature_fields
+
             if self._is_analysis_complete():
                 logger.info("Analysis complete.")
                 break
 
+        tokens = self.analyzer.prompt_tokens
+        logger.info(
+            f"Prompt tokens: {tokens.total_before} before compaction, "
+            f"{tokens.total_after} after ({tokens.saved_ratio:.0%} saved)"
+        )
+
+        metrics = self.analyzer.metrics
+        metrics.elapsed = time.perf_counter() - started
+        if metrics.ingestion is not None:
+            metrics.elapsed += metrics.ingestion["elapsed"]
+        totals = metrics.totals()
+        logger.info(
+            f"Analysis took {metrics.elapsed:.2f}s with {totals['calls']} calls, "
+            f"{totals['prompt_tokens']} prompt and {totals['completion_tokens']} "
+            f"completion tokens (${totals['cost']:.4f})"
+        )
+
         return self.analysis_result, self.steps
 
+    def _locate_signature_fields(self, file: str) -> Optional[list]:
+        """Locate the signature fields of a PDF file from its layout.
+
+        The fields are formatted for the "signature_fields" analysis step.
+
+        :return: The signature fields, None if the step is not applicable,
+                 nothing was found or the step columns can't be filled.
+        """
+        step = next(
+            (
+                step
+                for step in self.steps.get("analysis_steps", [])
+                if step["category"] == "signature_fields"
+            ),
+            None,
+        )
+        if step is None or not file.lower().endswith(".pdf"):
+            return None
+
+        # Nothing found: let the LLM look for words asking for a signature
+        fields = locate_signature_fields(file)
+        if not fields:
+            return None
+
+        if step["type"] == "table":
+            columns = [c.lower().replace(" ", "_") for c in step.get("columns", [])]
+            if any(column not in fields[0] for column in columns):
+                return None
+            return fields
+
+        lines = [
+            f"{field['field_type']} ({field['party'] or 'Unknown party'}), "
+            f"page {field['page']}"
+            for field in fields
+        ]
+        return lines if step["type"] == "list" else "; ".join(lines)
+
     def _is_analysis_complete(self):
         """Check if the analysis has all required fields."""
         if not self.analysis_result:
@@ -0,0 +1,204 @@
+"""Batch profiling of PDF files for offline triage."""
+
+import hashlib
+import json
+import math
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Iterable, Iterator, List, Optional, Set, TextIO, Union
+
+from se.pdftools import profile_pdf
+
+
+@dataclass
+class ProfileSummary:
+    """Throughput statistics of a batch profiling run."""
+
+    files: int = 0
+    pages: int = 0
+    errors: int = 0
+    skipped: int = 0
+    elapsed: float = 0.0
+    latencies_ms: List[float] = field(default_factory=list)
+
+    def add(self, record: dict):
+        """Account a single profiling result."""
+        self.files += 1
+        self.pages += record.get("pages") or 0
+        self.latencies_ms.append(record["elapsed_ms"])
+        if record.get("error") or not record.get("is_pdf"):
+            self.errors += 1
+
+    @property
+    def files_per_second(self) -> float:
+        return self.files / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def pages_per_second(self) -> float:
+        return self.pages / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def p95_latency_ms(self) -> float:
+        """95th percentile of per-file latency (nearest-rank method)."""
+        if not self.latencies_ms:
+            return 0.0
+        ordered = sorted(self.latencies_ms)
+        rank = math.ceil(0.95 * len(ordered))
+        return ordered[rank - 1]
+
+    def format(self) -> str:
+        """Return a human-readable summary."""
+        return (
+            f"Profiled {self.files} files ({self.pages} pages) "
+            f"in {self.elapsed:.2f}s, skipped {self.skipped}, "
+            f"failed {self.errors}\n"
+            f"Throughput: {self.files_per_second:.2f} files/s, "
+            f"{self.pages_per_second:.2f} pages/s\n"
+            f"Latency: p95 {self.p95_latency_ms:.2f} ms per file"
+        )
+
+
+def find_pdf_files(directory: Union[str, Path]) -> Iterator[Path]:
+    """Yield PDF files under the directory tree, in a stable order."""
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if name.lower().endswith(".pdf"):
+                yield Path(root) / name
+
+
+def read_processed_paths(output: Union[str, Path]) -> Set[str]:
+    """Return paths already present in a previous NDJSON output file.
+
+    Lines which can't be parsed (e.g. the last line of an interrupted run)
+    are ignored, so the corresponding files are profiled again.
+    """
+    processed = set()
+    if not os.path.exists(output):
+        return processed
+
+    with open(output, "r", encoding="utf-8") as f:
+        for line in f:
+            try:
+                processed.add(json.loads(line)["path"])
+            except (json.JSONDecodeError, KeyError, TypeError):
+                continue
+
+    return processed
+
+
+def open_output(output: Union[str, Path], resume: bool = False) -> TextIO:
+    """Open the NDJSON output file, appending to it when resuming."""
+    if not resume:
+        return open(output, "w", encoding="utf-8")
+
+    needs_newline = False
+    if os.path.exists(output) and os.path.getsize(output) > 0:
+        with open(output, "rb") as f:
+            f.seek(-1, os.SEEK_END)
+            needs_newline = f.read(1) != b"\n"
+
+    stream = open(output, "a", encoding="utf-8")
+    if needs_newline:
+        # Terminate the partial line left by an interrupted run
+        stream.write("\n")
+    return stream
+
+
+def profile_file(path: str, page_timeout: Optional[float] = None) -> dict:
+    """Profile a single file and return its NDJSON record."""
+    started = time.perf_counter()
+    record = {"path": path, "sha256": None, "pages": 0}
+
+    try:
+        sha256_hash = hashlib.sha256()
+        with open(path, "rb") as f:
+            while chunk := f.read(1024 * 1024):
+                sha256_hash.update(chunk)
+        record["sha256"] = sha256_hash.hexdigest()
+
+        info = profile_pdf(path, page_timeout=page_timeout)
+        record.update(
+            {
+                "pages": info["total_pages"],
+                "page_types": info["page_types"],
+                "overall_type": info["overall_type"],
+                "is_pdf": info["is_pdf"],
+            }
+        )
+    except OSError as e:
+        record["error"] = str(e)
+
+    record["elapsed_ms"] = round((time.perf_counter() - started) * 1000, 3)
+    return record
+
+
+def _profile_serial(paths, page_timeout) -> Iterator[dict]:
+    for path in paths:
+        yield profile_file(path, page_timeout)
+
+
+def _profile_pool(paths, workers, page_timeout) -> Iterator[dict]:
+    """Profile files in a process pool, keeping a bounded number in flight."""
+    max_pending = workers * 4
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = set()
+        for path in paths:
+            pending.add(executor.submit(profile_file, path, page_timeout))
+            if len(pending) >= max_pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    yield future.result()
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+
+
+def profile_directory(
+    directory: Union[str, Path],
+    output: TextIO,
+    workers: int = 1,
+    page_timeout: Optional[float] = None,
+    skip: Optional[Iterable[str]] = None,
+) -> ProfileSummary:
+    """Profile all PDF files under the directory tree.
+
+    Results are written to ``output`` as NDJSON, one line per file, as soon
+    as each file is processed. Records are not ordered when several workers
+    are used.
+
+    :param directory: Root of the directory tree to scan.
+    :param output: Text stream to write NDJSON records to.
+    :param workers: Number of worker processes, 1 profiles in this process.
+    :param page_timeout: Time budget per page in seconds.
+    :param skip: Paths to skip, e.g. read from a previous output file.
+    :return: Throughput summary of the run.
+    """
+    skip = set(skip or [])
+    summary = ProfileSummary()
+
+    paths = []
+    for path in find_pdf_files(directory):
+        if str(path) in skip:
+            summary.skipped += 1
+        else:
+            paths.append(str(path))
+
+    started = time.perf_counter()
+    if workers > 1:
+        records = _profile_pool(paths, workers, page_timeout)
+    else:
+        records = _profile_serial(paths, page_timeout)
+
+    for record in records:
+        output.write(json.dumps(record) + "\n")
+        output.flush()
+        summary.add(record)
+
+    summary.elapsed = time.perf_counter() - started
+    return summary
@@ -0,0 +1,306 @@
+"""Resumable uploads of large files, sent in chunks."""
+
+import hashlib
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from typing import Any, BinaryIO, Dict, Iterator, Optional, Tuple
+
+from se.modules.upload_manager import UploadError, UploadFileInfo, UploadManager
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+UPLOAD_ID = re.compile(r"[0-9a-f]{32}")
+
+# Size of the reads from the request stream
+READ_SIZE = 64 * 1024
+
+
+class UploadNotFound(UploadError):
+    """The upload doesn't exist, or expired."""
+
+
+class OffsetMismatch(UploadError):
+    """A chunk was sent for another offset than the one expected."""
+
+    def __init__(self, offset: int):
+        super().__init__(f"Expected a chunk at offset {offset}.")
+        self.offset = offset
+
+
+@dataclass
+class ChunkedUpload:
+    """An upload in progress.
+
+    ``offset`` is the number of bytes received and stored, the next chunk
+    starts there.
+    """
+
+    upload_id: str
+    orig_filename: str
+    content_type: str
+    size: int
+    offset: int = 0
+    created_at: float = 0.0
+    # The job reserved when the upload was admitted, see se.modules.admission
+    reservation_id: Optional[int] = None
+
+    def is_complete(self) -> bool:
+        return self.offset == self.size
+
+    def as_dict(self) -> dict:
+        return asdict(self)
+
+
+class ChunkedUploads:
+    """Uploads in progress, stored in a directory.
+
+    An upload has a ``<id>.json`` file of its metadata and a ``<id>.part``
+    file of the bytes received so far. The size of the part file is the
+    acknowledged offset, so an upload can be resumed from any process after
+    a dropped connection or a restart.
+
+    The content is hashed as the chunks arrive. The hash state can't be
+    stored on disk, it is kept in the process and the received bytes are only
+    hashed again when another process received the previous chunks.
+
+    :param directory: Directory of the uploads, on the file system of the
+                      upload folder so complete files are moved, not copied.
+    :param max_size: Maximum size of an upload in bytes, no limit if None.
+    :param expiry: Seconds after which an inactive upload is deleted.
+    """
+
+    def __init__(
+        self, directory: str, max_size: Optional[int] = None, expiry: float = 86400
+    ):
+        self.directory = directory
+        self.max_size = max_size
+        self.expiry = expiry
+        os.makedirs(directory, exist_ok=True)
+        # Hash of the part files by upload: (hashed bytes, hash)
+        self._hashes: Dict[str, Tuple[int, Any]] = {}
+        self._lock = threading.Lock()
+        self._upload_locks: Dict[str, threading.Lock] = {}
+
+    def _path(self, upload_id: str, extension: str) -> str:
+        if not UPLOAD_ID.fullmatch(upload_id):
+            raise UploadNotFound(f"Upload {upload_id} not found.")
+        return os.path.join(self.directory, f"{upload_id}{extension}")
+
+    @contextmanager
+    def _locked(self, upload_id: str) -> Iterator[None]:
+        """Serialize the writes of an upload, across threads and processes."""
+        path = self._path(upload_id, ".json")
+        with self._lock:
+            lock = self._upload_locks.setdefault(upload_id, threading.Lock())
+
+        with lock:
+            try:
+                f = open(path, "rb")
+            except FileNotFoundError:
+                raise UploadNotFound(f"Upload {upload_id} not found.")
+            with f:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+                yield
+
+    def create(
+        self,
+        orig_filename: str,
+        content_type: str,
+        size: int,
+        reservation_id: Optional[int] = None,
+    ) -> ChunkedUpload:
+        """Start an upload of ``size`` bytes.
+
+        :param reservation_id: The job reserved for the analysis, if any.
+
+        :raise UploadError: If the upload is too large.
+        """
+        if size < 0:
+            raise UploadError("Invalid file size.")
+        if self.max_size is not None and size > self.max_size:
+            raise UploadError(
+                "File size exceeds the maximum limit of "
+                f"{self.max_size / (1024 * 1024)} MB."
+            )
+
+        self.cleanup()
+
+        upload = ChunkedUpload(
+            upload_id=uuid.uuid4().hex,
+            orig_filename=orig_filename,
+            content_type=content_type,
+            size=size,
+            created_at=time.time(),
+            reservation_id=reservation_id,
+        )
+        open(self._path(upload.upload_id, ".part"), "wb").close()
+        metadata = {k: v for k, v in upload.as_dict().items() if k != "offset"}
+        with open(self._path(upload.upload_id, ".json"), "w") as f:
+            json.dump(metadata, f)
+        with self._lock:
+            self._hashes[upload.upload_id] = (0, hashlib.sha256())
+
+        return upload
+
+    def get(self, upload_id: str) -> Optional[ChunkedUpload]:
+        """Return the upload with its current offset, None if unknown."""
+        if not UPLOAD_ID.fullmatch(upload_id):
+            return None
+        try:
+            with open(self._path(upload_id, ".json")) as f:
+                metadata = json.load(f)
+            offset = os.path.getsize(self._path(upload_id, ".part"))
+        except (FileNotFoundError, ValueError):
+            return None
+        return ChunkedUpload(offset=offset, **metadata)
+
+    def _get(self, upload_id: str) -> ChunkedUpload:
+        upload = self.get(upload_id)
+        if upload is None:
+            raise UploadNotFound(f"Upload {upload_id} not found.")
+        return upload
+
+    def _hash(self, upload: ChunkedUpload) -> Any:
+        """Return the hash of the received bytes."""
+        with self._lock:
+            hashed, sha256_hash = self._hashes.get(upload.upload_id, (-1, None))
+        if hashed == upload.offset:
+            return sha256_hash
+
+        logger.info(f"Hashing the {upload.offset} bytes of upload {upload.upload_id}")
+        sha256_hash = hashlib.sha256()
+        with open(self._path(upload.upload_id, ".part"), "rb") as f:
+            while chunk := f.read(READ_SIZE):
+                sha256_hash.update(chunk)
+        return sha256_hash
+
+    def write_chunk(
+        self, upload_id: str, offset: int, stream: BinaryIO
+    ) -> ChunkedUpload:
+        """Append a chunk read from a stream at the given offset.
+
+        A chunk cut by a dropped connection is kept up to the last byte
+        received, the upload then resumes from the returned offset.
+
+        :raise OffsetMismatch: If the offset isn't the one of the upload.
+        :raise UploadError: If the chunk goes past the size of the upload.
+        """
+        with self._locked(upload_id):
+            upload = self._get(upload_id)
+            if offset != upload.offset:
+                raise OffsetMismatch(upload.offset)
+
+            sha256_hash = self._hash(upload)
+            remaining = upload.size - upload.offset
+            written = 0
+            try:
+                with open(self._path(upload_id, ".part"), "ab") as part:
+                    try:
+                        while chunk := stream.read(READ_SIZE):
+                            if len(chunk) > remaining - written:
+                                raise UploadError(
+                                    "Chunk exceeds the size of the upload."
+                                )
+                            part.write(chunk)
+                            sha256_hash.update(chunk)
+                            written += len(chunk)
+                    finally:
+                        part.flush()
+                        os.fsync(part.fileno())
+            finally:
+                upload.offset += written
+                with self._lock:
+                    self._hashes[upload_id] = (upload.offset, sha256_hash)
+
+        return upload
+
+    def finalize(self, upload_id: str, upload_manager: UploadManager) -> UploadFileInfo:
+        """Store a complete upload in the upload store.
+
+        :raise UploadError: If the upload is incomplete or the file too small.
+        """
+        with self._locked(upload_id):
+            upload = self._get(upload_id)
+            if not upload.is_complete():
+                raise UploadError(
+                    f"Upload incomplete: {upload.offset} of {upload.size} bytes."
+                )
+
+            file_info = upload_manager.store_file(
+                self._path(upload_id, ".part"),
+                self._hash(upload).hexdigest(),
+                upload.size,
+                orig_filename=upload.orig_filename,
+                content_type=upload.content_type,
+            )
+            # The part is the copy of a content already stored, see settle
+            self.discard(upload_id, keep_part=file_info.copy_path is not None)
+
+        return file_info
+
+    def discard(self, upload_id: str, keep_part: bool = False):
+        """Delete an upload, in progress or stored."""
+        for extension in (".json",) if keep_part else (".part", ".json"):
+            path = self._path(upload_id, extension)
+            if os.path.exists(path):
+                os.remove(path)
+        with self._lock:
+            self._hashes.pop(upload_id, None)
+            self._upload_locks.pop(upload_id, None)
+
+    def cleanup(self) -> int:
+        """Delete the uploads inactive for longer than the expiry.
+
+        :return: Number of deleted uploads.
+        """
+        deadline = time.time() - self.expiry
+        deleted = 0
+        for name in os.listdir(self.directory):
+            upload_id, extension = os.path.splitext(name)
+            if extension != ".json" or not UPLOAD_ID.fullmatch(upload_id):
+                continue
+            try:
+                last_write = max(
+                    os.path.getmtime(self._path(upload_id, ".json")),
+                    os.path.getmtime(self._path(upload_id, ".part")),
+                )
+            except FileNotFoundError:
+                last_write = 0
+            if last_write < deadline:
+                logger.info(f"Deleting expired upload {upload_id}")
+                self.discard(upload_id)
+                deleted += 1
+        return deleted
+
+
+_uploads = {}
+_uploads_lock = threading.Lock()
+
+
+def get_chunked_uploads(config) -> ChunkedUploads:
+    """Return the process-wide chunked uploads configured for the application.
+
+    :param config: The application config.
+    """
+    directory = os.path.join(config.get("UPLOADS_DIR") or "uploads", ".chunks")
+    with _uploads_lock:
+        if directory not in _uploads:
+            _uploads[directory] = ChunkedUploads(
+                directory,
+                max_size=config.get("MAX_UPLOAD_SIZE"),
+                expiry=config.get("UPLOAD_EXPIRY", 86400),
+            )
+        return _uploads[directory]
@@ -0,0 +1,181 @@
+"""Persistent cache of chunk embeddings shared by all documents."""
+
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+from array import array
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Sequence, Union
+
+from llama_index.core.schema import BaseNode, MetadataMode
+
+from se.modules.prompt_context import count_tokens
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash TEXT NOT NULL,
+    embedding BLOB NOT NULL,
+    PRIMARY KEY (model, text_hash)
+);
+"""
+
+# SQLite limits the number of host parameters of a statement.
+_BATCH_SIZE = 500
+
+
+def normalize_text(text: str) -> str:
+    """Normalize the whitespace of a chunk, which doesn't change its meaning."""
+    return " ".join(text.split())
+
+
+def text_hash(text: str) -> str:
+    """Return the cache key of a chunk text."""
+    return hashlib.sha256(normalize_text(text).encode("utf-8")).hexdigest()
+
+
+def model_id(embed_model) -> str:
+    """Return the identifier of an embedding model, part of the cache key."""
+    name = getattr(embed_model, "model_name", None) or "unknown"
+    return f"{type(embed_model).__name__}:{name}"
+
+
+@dataclass
+class EmbeddingStats:
+    """Embedding cache lookups of a single index build."""
+
+    hits: int = 0
+    misses: int = 0
+    # Tokens sent to the embedding model
+    tokens: int = 0
+
+    @property
+    def hit_ratio(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+
+class EmbeddingCache:
+    """Embeddings stored in an SQLite file, keyed by model and chunk text hash.
+
+    Embeddings are stored as float32 arrays, which halves their size and is
+    more precise than what similarity search needs.
+
+    :param path: Path to the SQLite file.
+    """
+
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def get_many(self, model: str, hashes: Iterable[str]) -> Dict[str, List[float]]:
+        """Return the cached embeddings of the given text hashes."""
+        hashes = list(dict.fromkeys(hashes))
+        found = {}
+        with self._lock:
+            for start in range(0, len(hashes), _BATCH_SIZE):
+                batch = hashes[start : start + _BATCH_SIZE]
+                rows = self._connection.execute(
+                    "SELECT text_hash, embedding FROM embeddings "
+                    f"WHERE model = ? AND text_hash IN ({', '.join('?' * len(batch))})",
+                    (model, *batch),
+                )
+                for key, blob in rows:
+                    found[key] = array("f", blob).tolist()
+        return found
+
+    def put_many(self, model: str, embeddings: Dict[str, Sequence[float]]):
+        """Store embeddings by text hash."""
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, embedding) "
+                "VALUES (?, ?, ?)",
+                [
+                    (model, key, array("f", embedding).tobytes())
+                    for key, embedding in embeddings.items()
+                ],
+            )
+
+    def count(self) -> int:
+        with self._lock:
+            (count,) = self._connection.execute(
+                "SELECT COUNT(*) FROM embeddings"
+            ).fetchone()
+        return count
+
+
+def embed_nodes_cached(
+    nodes: Sequence[BaseNode], embed_model, cache: EmbeddingCache
+) -> EmbeddingStats:
+    """Set the embeddings of the nodes, only embedding chunks not in the cache.
+
+    Chunks missing from the cache are embedded in a single batch and added
+    to the cache. Nodes then carry their embedding, so building an index
+    from them doesn't call the embedding model again.
+    """
+    model = model_id(embed_model)
+    texts = {}
+    for node in nodes:
+        if node.embedding is None:
+            text = node.get_content(metadata_mode=MetadataMode.EMBED)
+            texts.setdefault(text_hash(text), text)
+
+    cached = cache.get_many(model, texts)
+    missing = [key for key in texts if key not in cached]
+
+    if missing:
+        logger.debug(f"Embedding {len(missing)} of {len(texts)} chunks with {model}")
+        vectors = embed_model.get_text_embedding_batch([texts[key] for key in missing])
+        computed = dict(zip(missing, vectors))
+        cache.put_many(model, computed)
+        cached.update(computed)
+
+    stats = EmbeddingStats(tokens=sum(count_tokens(texts[key]) for key in missing))
+    for node in nodes:
+        if node.embedding is None:
+            key = text_hash(node.get_content(metadata_mode=MetadataMode.EMBED))
+            node.embedding = cached[key]
+            if key in missing:
+                stats.misses += 1
+            else:
+                stats.hits += 1
+
+    return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_embedding_cache(config) -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache configured for the application.
+
+    :param config: The application config.
+    :return: The cache, None if it is disabled.
+    """
+    if not config.get("EMBEDDING_CACHE_ENABLED", True):
+        return None
+
+    path = config.get("EMBEDDING_CACHE_PATH") or os.path.join(
+        config.get("STORAGE_DIR") or "storage", "embeddings.sqlite3"
+    )
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = EmbeddingCache(path)
+        return _caches[path]
@@ -0,0 +1,447 @@
+"""Rule-based pre-extractors that answer analysis categories without an LLM.
+
+Extractors run over the text of the document before the LLM is queried.
+When an extractor is confident about its result, the LLM query for the
+category is skipped. When it found candidates but is not sure about them,
+the query is shrunk to a verification of the candidates.
+"""
+
+import re
+import threading
+from abc import ABC, abstractmethod
+from collections import Counter, defaultdict
+from dataclasses import dataclass
+from datetime import date
+from decimal import Decimal
+from typing import Dict, List, Optional, Sequence, Tuple
+
+# Outcomes recorded per category, see ExtractionStats.
+SKIPPED = "skipped"
+VERIFIED = "verified"
+QUERIED = "queried"
+
+
+@dataclass
+class Extraction:
+    """Result of a rule-based extraction for a single analysis category.
+
+    :param category: The analysis category.
+    :param value: The result, in the format the LLM would return for the
+                  category step (a list of rows, a list of strings or a text).
+    :param confident: Whether the result can replace the LLM query.
+    """
+
+    category: str
+    value: object
+    confident: bool
+
+
+class Extractor(ABC):
+    """Base class for rule-based extractors.
+
+    Subclasses find records (dictionaries with the fields listed in
+    ``fields``) in the text. Records are formatted according to the type of
+    the analysis step; table columns are matched to fields by name or by one
+    of the field ``aliases``.
+    """
+
+    #: Analysis categories the extractor answers.
+    categories: Tuple[str, ...] = ()
+
+    #: Record fields, the first one being the value of the record.
+    fields: Tuple[str, ...] = ()
+
+    #: Alternative column names for the fields.
+    aliases: Dict[str, Tuple[str, ...]] = {}
+
+    @abstractmethod
+    def find(self, text: str) -> Tuple[List[dict], bool]:
+        """Find the records in the text.
+
+        :return: The records and whether all of them are unambiguous.
+        """
+        pass
+
+    def _column_field(self, column: str) -> Optional[str]:
+        key = column.lower().replace(" ", "_")
+        for name in self.fields:
+            if key == name or key in self.aliases.get(name, ()):
+                return name
+        return None
+
+    def _format(self, records: List[dict], step: dict) -> Tuple[object, bool]:
+        """Format the records for the step, tell if all columns were matched."""
+        value, *details = self.fields
+        if step.get("type") == "table":
+            columns = step.get("columns") or list(self.fields)
+            fields = [self._column_field(column) for column in columns]
+            rows = [
+                {
+                    column.lower().replace(" ", "_"): (
+                        record.get(name, "") if name else ""
+                    )
+                    for column, name in zip(columns, fields)
+                }
+                for record in records
+            ]
+            return rows, all(fields)
+
+        lines = [
+            " - ".join(
+                str(record[name]) for name in (value, *details) if record.get(name)
+            )
+            for record in records
+        ]
+        if step.get("type") == "text":
+            return "; ".join(lines), True
+        return lines, True
+
+    def extract(self, text: str, step: dict) -> Optional[Extraction]:
+        """Extract the category of the step from the text.
+
+        :return: The extraction, None if nothing was found.
+        """
+        records, unambiguous = self.find(text)
+        if not records:
+            return None
+
+        value, complete = self._format(records, step)
+        return Extraction(step["category"], value, unambiguous and complete)
+
+
+def _label(text: str, labels: "re.Pattern") -> Optional[str]:
+    """Return the last label found in the text, capitalized."""
+    found = labels.findall(text)
+    if not found:
+        return None
+    label = " ".join(found[-1].split())
+    return label[0].upper() + label[1:].lower()
+
+
+def _context(text: str, start: int, size: int = 80) -> str:
+    """Return the text of the same line preceding the position."""
+    line_start = text.rfind("\n", 0, start) + 1
+    return text[max(line_start, start - size) : start]
+
+
+_MONTHS = {
+    name: number
+    for number, names in enumerate(
+        (
+            ("january", "jan"),
+            ("february", "feb"),
+            ("march", "mar"),
+            ("april", "apr"),
+            ("may",),
+            ("june", "jun"),
+            ("july", "jul"),
+            ("august", "aug"),
+            ("september", "sep", "sept"),
+            ("october", "oct"),
+            ("november", "nov"),
+            ("december", "dec"),
+        ),
+        start=1,
+    )
+    for name in names
+}
+
+_MONTH = r"(?P<{}>" + "|".join(sorted(_MONTHS, key=len, reverse=True)) + r")\.?"
+_DAY = r"(?P<{}>\d{{1,2}})(?:st|nd|rd|th)?"
+
+_DATE_RE = re.compile(
+    r"\b(?:"
+    r"(?P<iso_y>\d{4})-(?P<iso_m>\d{1,2})-(?P<iso_d>\d{1,2})"
+    r"|"
+    + _MONTH.format("md_m")
+    + r"\s+"
+    + _DAY.format("md_d")
+    + r",?\s+(?P<md_y>\d{4})"
+    r"|"
+    + _DAY.format("dm_d")
+    + r"\s+(?:day\s+)?(?:of\s+)?"
+    + _MONTH.format("dm_m")
+    + r",?\s+(?P<dm_y>\d{4})"
+    r"|(?P<num_a>\d{1,2})[/.](?P<num_b>\d{1,2})[/.](?P<num_y>\d{4})"
+    r")\b",
+    re.IGNORECASE,
+)
+
+_DATE_LABEL_RE = re.compile(
+    r"\b((?:effective|commencement|start|end|termination|expiration|expiry"
+    r"|closing|completion|delivery|due|payment|renewal|execution|signing"
+    r"|signature|notice|deadline|dated|signed|executed|terminates?|expires?"
+    r"|commences?)(?:\s+date)?)\b",
+    re.IGNORECASE,
+)
+
+
+class DateExtractor(Extractor):
+    """Extract dates, normalized to YYYY-MM-DD.
+
+    Numeric dates (e.g. 03/04/2025) are read month first; they are
+    ambiguous unless the day is greater than 12.
+    """
+
+    categories = ("dates", "key_dates", "important_dates")
+    fields = ("date", "details")
+    aliases = {
+        "date": ("day",),
+        "details": ("description", "event", "purpose", "type", "name"),
+    }
+
+    def find(self, text: str) -> Tuple[List[dict], bool]:
+        records, seen = [], set()
+        unambiguous = True
+
+        for match in _DATE_RE.finditer(text):
+            parsed, exact = self._parse(match)
+            if parsed is None:
+                continue
+
+            label = _label(_context(text, match.start()), _DATE_LABEL_RE)
+            unambiguous &= exact and label is not None
+            record = {
+                "date": parsed.isoformat(),
+                "details": label or " ".join(_context(text, match.start()).split()),
+            }
+            key = (record["date"], record["details"])
+            if key not in seen:
+                seen.add(key)
+                records.append(record)
+
+        return records, unambiguous
+
+    @staticmethod
+    def _parse(match: "re.Match") -> Tuple[Optional[date], bool]:
+        groups = match.groupdict()
+        exact = True
+        if groups["iso_y"]:
+            year, month, day = groups["iso_y"], groups["iso_m"], groups["iso_d"]
+        elif groups["md_y"]:
+            year, day = groups["md_y"], groups["md_d"]
+            month = _MONTHS[groups["md_m"].lower()]
+        elif groups["dm_y"]:
+            year, day = groups["dm_y"], groups["dm_d"]
+            month = _MONTHS[groups["dm_m"].lower()]
+        else:
+            year, month, day = groups["num_y"], groups["num_a"], groups["num_b"]
+            if int(month) > 12:
+                month, day = day, month
+            else:
+                exact = int(day) > 12 or month == day
+
+        try:
+            return date(int(year), int(month), int(day)), exact
+        except ValueError:
+            return None, False
+
+
+_CURRENCY_SYMBOLS = {"$": "USD", "€": "EUR", "£": "GBP"}
+
+_NUMBER = r"(?P<{}>\d{{1,3}}(?:,\d{{3}})+|\d+)(?:\.(?P<{}>\d{{1,2}}))?"
+
+_AMOUNT_RE = re.compile(
+    r"(?:(?P<symbol>[$€£])\s?|\b(?P<code>USD|EUR|GBP)\s?)"
+    + _NUMBER.format("number", "cents")
+    + r"|\b"
+    + _NUMBER.format("number2", "cents2")
+    + r"\s?(?P<code2>USD|EUR|GBP|dollars|euros?|pounds)\b",
+    re.IGNORECASE,
+)
+
+_CURRENCY_NAMES = {"dollars": "USD", "euro": "EUR", "euros": "EUR", "pounds": "GBP"}
+
+_AMOUNT_LABEL_RE = re.compile(
+    r"\b((?:purchase\s+|sale\s+|total\s+|contract\s+)?price|fees?|deposit|rent"
+    r"|salary|compensation|payment|penalty|fine|consideration|retainer|bonus"
+    r"|total|sum|amount)\b",
+    re.IGNORECASE,
+)
+
+
+class AmountExtractor(Extractor):
+    """Extract currency amounts, normalized to a decimal and an ISO code."""
+
+    categories = ("amounts", "monetary_amounts", "fees", "prices", "payments")
+    fields = ("amount", "currency", "details")
+    aliases = {
+        "amount": ("value", "sum", "price"),
+        "currency": ("currency_code",),
+        "details": ("description", "purpose", "type", "name"),
+    }
+
+    def find(self, text: str) -> Tuple[List[dict], bool]:
+        records, seen = [], set()
+        unambiguous = True
+
+        for match in _AMOUNT_RE.finditer(text):
+            groups = match.groupdict()
+            number = groups["number"] or groups["number2"]
+            cents = groups["cents"] or groups["cents2"] or "0"
+            if groups["symbol"]:
+                currency = _CURRENCY_SYMBOLS[groups["symbol"]]
+            else:
+                code = (groups["code"] or groups["code2"]).lower()
+                currency = _CURRENCY_NAMES.get(code, code.upper())
+
+            amount = (
+                Decimal(number.replace(",", "")) + Decimal(cents.ljust(2, "0")) / 100
+            )
+            label = _label(_context(text, match.start()), _AMOUNT_LABEL_RE)
+            unambiguous &= label is not None
+            record = {
+                "amount": f"{amount:.2f}",
+                "currency": currency,
+                "details": label or " ".join(_context(text, match.start()).split()),
+            }
+            key = tuple(record.values())
+            if key not in seen:
+                seen.add(key)
+                records.append(record)
+
+        return records, unambiguous
+
+
+_PARTY_ROLES = frozenset(
+    role.lower()
+    for role in (
+        "Agent",
+        "Borrower",
+        "Buyer",
+        "Client",
+        "Company",
+        "Consultant",
+        "Contractor",
+        "Customer",
+        "Disclosing Party",
+        "Distributor",
+        "Employee",
+        "Employer",
+        "Guarantor",
+        "Investor",
+        "Landlord",
+        "Lender",
+        "Lessee",
+        "Lessor",
+        "Licensee",
+        "Licensor",
+        "Owner",
+        "Party A",
+        "Party B",
+        "Provider",
+        "Purchaser",
+        "Receiving Party",
+        "Seller",
+        "Supplier",
+        "Tenant",
+        "Vendor",
+    )
+)
+
+# A name followed by its defined role, e.g. ACME Inc. ("Seller") or
+# John Doe (hereinafter referred to as the "Buyer").
+_PARTY_RE = re.compile(
+    r"(?P<name>[A-Z][^()\"“”;]{0,120}?)\s*\(\s*"
+    r"(?:hereinafter\s+)?(?:(?:referred\s+to\s+|defined\s+)?as\s+)?(?:the\s+)?"
+    r"[\"“](?P<role>[A-Z][A-Za-z ]{1,30})[\"”]\s*\)",
+)
+
+_PARTY_PREFIX_RE = re.compile(r"^.*\b(?:between|and|by|with|from|to)\s+", re.DOTALL)
+_PARTY_DESCRIPTOR_RE = re.compile(r",\s+(?:an?|the)\s.*$", re.IGNORECASE | re.DOTALL)
+
+
+class PartyExtractor(Extractor):
+    """Extract parties defined by role, e.g. ACME Inc. ("Seller")."""
+
+    categories = ("parties", "contracting_parties")
+    fields = ("name", "role")
+    aliases = {
+        "name": ("party", "party_name", "full_name"),
+        "role": ("defined_as", "definition", "type", "party_role"),
+    }
+
+    def find(self, text: str) -> Tuple[List[dict], bool]:
+        records, seen = [], set()
+
+        for match in _PARTY_RE.finditer(text):
+            role = " ".join(match.group("role").split())
+            if role.lower() not in _PARTY_ROLES or role.lower() in seen:
+                continue
+
+            name = _PARTY_DESCRIPTOR_RE.sub("", match.group("name"))
+            name = " ".join(_PARTY_PREFIX_RE.sub("", name).split()).strip(" ,:")
+            if not name or len(name.split()) > 8:
+                continue
+
+            seen.add(role.lower())
+            records.append({"name": name, "role": role})
+
+        # A contract has at least two parties
+        return records, len(records) >= 2
+
+
+def default_extractors() -> List[Extractor]:
+    return [DateExtractor(), AmountExtractor(), PartyExtractor()]
+
+
+def pre_extract(
+    text: str, steps: Sequence[dict], extractors: Sequence[Extractor]
+) -> Dict[str, Extraction]:
+    """Run the extractors over the text for the given analysis steps.
+
+    :return: The extractions by category. Categories without an extractor
+             or for which nothing was found are omitted.
+    """
+    by_category = {
+        category: extractor
+        for extractor in extractors
+        for category in extractor.categories
+    }
+
+    extractions = {}
+    for step in steps:
+        extractor = by_category.get(step["category"])
+        if extractor is None:
+            continue
+
+        extraction = extractor.extract(text, step)
+        if extraction is not None:
+            extractions[step["category"]] = extraction
+
+    return extractions
+
+
+class ExtractionStats:
+    """Thread-safe counters of LLM queries skipped by pre-extraction."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counts: Dict[str, Counter] = defaultdict(Counter)
+
+    def record(self, category: str, outcome: str):
+        """Record the outcome (SKIPPED, VERIFIED or QUERIED) for a category."""
+        with self._lock:
+            self._counts[category][outcome] += 1
+
+    def reset(self):
+        with self._lock:
+            self._counts.clear()
+
+    def skip_rates(self) -> Dict[str, dict]:
+        """Return the counters and the skip rate of every category."""
+        with self._lock:
+            rates = {}
+            for category, counts in sorted(self._counts.items()):
+                total = sum(counts.values())
+                rates[category] = {
+                    SKIPPED: counts[SKIPPED],
+                    VERIFIED: counts[VERIFIED],
+                    QUERIED: counts[QUERIED],
+                    "skip_rate": counts[SKIPPED] / total if total else 0.0,
+                }
+            return rates
+
+
+# Process-wide statistics of the pre-extraction.
+extraction_stats = ExtractionStats()
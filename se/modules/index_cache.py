@@ -0,0 +1,159 @@
+"""Process-wide cache of loaded vector store indexes."""
+
+import json
+import logging
+import sys
+import threading
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Callable, Dict
+
+logger = logging.getLogger(__name__)
+
+# Approximate memory used by an embedding component held in a Python list
+# (the pointer plus the float object).
+_FLOAT_BYTES = 8 + sys.getsizeof(0.0)
+
+
+def estimate_index_size(index) -> int:
+    """Estimate the memory held by a VectorStoreIndex, in bytes.
+
+    Counts the text and metadata of the nodes in the docstore and the
+    embeddings in the vector store, which dominate the index footprint.
+    """
+    size = 0
+    try:
+        for node in index.docstore.docs.values():
+            size += len(node.get_content().encode("utf-8"))
+            size += len(json.dumps(node.metadata, default=str))
+    except Exception as e:
+        logger.debug(f"Unable to measure the docstore: {e}")
+
+    try:
+        embeddings = index.vector_store.data.embedding_dict
+        size += sum(len(vector) for vector in embeddings.values()) * _FLOAT_BYTES
+    except Exception as e:
+        logger.debug(f"Unable to measure the vector store: {e}")
+
+    return size
+
+
+@dataclass
+class _Entry:
+    value: Any
+    size: int
+
+
+class IndexCache:
+    """A thread-safe LRU cache of indexes with a memory budget.
+
+    Entries are evicted, least recently used first, when the estimated size
+    of the cached indexes exceeds ``max_bytes``. An index larger than the
+    whole budget is returned but not cached. Concurrent requests for the
+    same key wait for a single load instead of loading the index twice.
+
+    :param max_bytes: Memory budget in bytes, 0 disables the cache.
+    :param sizeof: Function estimating the size of a cached value.
+    """
+
+    def __init__(
+        self,
+        max_bytes: int = 256 * 1024 * 1024,
+        sizeof: Callable[[Any], int] = estimate_index_size,
+    ):
+        self.max_bytes = max_bytes
+        self.sizeof = sizeof
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._size = 0
+        self._lock = threading.Lock()
+        self._loading: Dict[str, threading.Lock] = {}
+
+    def configure(self, max_bytes: int):
+        """Change the memory budget, evicting entries if needed."""
+        with self._lock:
+            self.max_bytes = max_bytes
+            self._evict()
+
+    def _evict(self):
+        while self._entries and self._size > self.max_bytes:
+            key, entry = self._entries.popitem(last=False)
+            self._size -= entry.size
+            self.evictions += 1
+            logger.debug(f"Evicted index {key} ({entry.size} bytes)")
+
+    def _lookup(self, key: str):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry.value
+
+    def get_or_load(self, key: str, loader: Callable[[], Any]) -> Any:
+        """Return the cached value for the key, loading it on a miss.
+
+        :param key: Cache key, e.g. the persist directory of the index.
+        :param loader: Function loading (or building) the value.
+        """
+        with self._lock:
+            value = self._lookup(key)
+            if value is not None:
+                return value
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        with key_lock:
+            with self._lock:
+                # Loaded by another thread while we were waiting
+                value = self._lookup(key)
+                if value is not None:
+                    return value
+                self.misses += 1
+
+            try:
+                value = loader()
+                size = self.sizeof(value)
+                with self._lock:
+                    if 0 < self.max_bytes and size <= self.max_bytes:
+                        self._entries[key] = _Entry(value, size)
+                        self._size += size
+                        self._evict()
+            finally:
+                with self._lock:
+                    self._loading.pop(key, None)
+
+        return value
+
+    def invalidate(self, key: str):
+        """Remove the value for the key from the cache."""
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._size -= entry.size
+
+    def clear(self):
+        """Remove all the values and reset the counters."""
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self) -> dict:
+        """Return the cache counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "size": self._size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+
+# Indexes shared by all the analyzers of the process.
+index_cache = IndexCache()
@@ -0,0 +1,225 @@
+"""Pipelines of stages running concurrently, connected by bounded queues."""
+
+import logging
+import queue
+import threading
+import time
+from dataclasses import asdict, dataclass
+from typing import Any, Callable, Iterable, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# A stage transforms the items of its input into the items of its output,
+# e.g. one page into several chunks, or several chunks into one batch.
+StageFunction = Callable[[Iterator[Any]], Iterable[Any]]
+
+# End of the items of a queue
+_END = object()
+
+# Interval to check for a failed stage while waiting on a queue
+_POLL_INTERVAL = 0.1
+
+
+class _Stopped(Exception):
+    """Another stage failed."""
+
+
+@dataclass
+class StageMetrics:
+    """Metrics of a pipeline stage.
+
+    Times are in seconds. ``busy_time`` is the time spent processing,
+    ``wait_time`` waiting for items of the previous stage (starved) and
+    ``blocked_time`` waiting for the next stage to take the items
+    (backpressure). The stage with the most busy time is the bottleneck.
+    """
+
+    name: str
+    items_in: int = 0
+    items_out: int = 0
+    busy_time: float = 0.0
+    wait_time: float = 0.0
+    blocked_time: float = 0.0
+
+    @property
+    def throughput(self) -> float:
+        """Items processed by second of busy time."""
+        return self.items_in / self.busy_time if self.busy_time else 0.0
+
+    def as_dict(self) -> dict:
+        return {**asdict(self), "throughput": self.throughput}
+
+
+@dataclass
+class PipelineMetrics:
+    stages: List[StageMetrics]
+    elapsed: float = 0.0
+
+    def bottleneck(self) -> Optional[StageMetrics]:
+        """Return the busiest stage, which limits the throughput."""
+        return max(self.stages, key=lambda stage: stage.busy_time, default=None)
+
+    def as_dict(self) -> dict:
+        bottleneck = self.bottleneck()
+        return {
+            "elapsed": self.elapsed,
+            "bottleneck": bottleneck.name if bottleneck else None,
+            "stages": [stage.as_dict() for stage in self.stages],
+        }
+
+
+class Pipeline:
+    """Stages running in their own thread, connected by bounded queues.
+
+    A stage takes the next item as soon as it has passed on the previous one,
+    so the stages work on different items at the same time. A full queue
+    blocks the stage feeding it, which bounds the items in flight.
+
+    Example:
+        >>> pipeline = Pipeline(queue_size=4)
+        >>> pipeline.add_stage("double", lambda items: (i * 2 for i in items))
+        >>> pipeline.run("source", range(3))
+        [0, 2, 4]
+
+    :param queue_size: Maximum number of items waiting between two stages.
+    """
+
+    def __init__(self, queue_size: int = 8):
+        self.queue_size = queue_size
+        self.stages: List[Tuple[str, StageFunction]] = []
+        self.metrics: Optional[PipelineMetrics] = None
+        self._stop = threading.Event()
+        self._error: Optional[BaseException] = None
+
+    def add_stage(self, name: str, function: StageFunction) -> "Pipeline":
+        self.stages.append((name, function))
+        return self
+
+    def run(self, name: str, source: Iterable[Any]) -> List[Any]:
+        """Run the pipeline on the items of a source, read by its own stage.
+
+        :param name: Name of the source stage, e.g. "extract".
+        :return: The items of the last stage.
+        :raise: The first exception raised by a stage.
+        """
+        started = time.perf_counter()
+        self._stop.clear()
+        self._error = None
+        stages = [(name, lambda items: items)] + self.stages
+        self.metrics = PipelineMetrics(
+            stages=[StageMetrics(name=stage_name) for stage_name, _ in stages]
+        )
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in stages]
+        threads = []
+        for i, (stage_name, function) in enumerate(stages):
+            metrics = self.metrics.stages[i]
+            items = (
+                self._source(source, metrics)
+                if i == 0
+                else self._items(queues[i - 1], metrics)
+            )
+            thread = threading.Thread(
+                target=self._run_stage,
+                args=(function, items, queues[i], metrics),
+                name=f"pipeline-{stage_name}",
+                daemon=True,
+            )
+            thread.start()
+            threads.append(thread)
+
+        results = []
+        try:
+            for item in self._items(queues[-1]):
+                results.append(item)
+        except _Stopped:
+            pass
+        finally:
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+
+        self.metrics.elapsed = time.perf_counter() - started
+        if self._error is not None:
+            raise self._error
+        return results
+
+    def _source(self, source: Iterable[Any], metrics: StageMetrics) -> Iterator[Any]:
+        for item in source:
+            metrics.items_in += 1
+            yield item
+
+    def _items(
+        self, items: queue.Queue, metrics: Optional[StageMetrics] = None
+    ) -> Iterator[Any]:
+        """Iterate over the items of a queue, until its end."""
+        while True:
+            started = time.perf_counter()
+            item = self._get(items)
+            if metrics is not None:
+                metrics.wait_time += time.perf_counter() - started
+            if item is _END:
+                return
+            if metrics is not None:
+                metrics.items_in += 1
+            yield item
+
+    def _get(self, items: queue.Queue) -> Any:
+        while True:
+            try:
+                return items.get(timeout=_POLL_INTERVAL)
+            except queue.Empty:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _put(self, items: queue.Queue, item: Any):
+        while True:
+            try:
+                items.put(item, timeout=_POLL_INTERVAL)
+                return
+            except queue.Full:
+                if self._stop.is_set():
+                    raise _Stopped()
+
+    def _run_stage(
+        self,
+        function: StageFunction,
+        items: Iterator[Any],
+        output: queue.Queue,
+        metrics: StageMetrics,
+    ):
+        started = time.perf_counter()
+        try:
+            for item in function(items):
+                put_started = time.perf_counter()
+                self._put(output, item)
+                metrics.blocked_time += time.perf_counter() - put_started
+                metrics.items_out += 1
+            self._put(output, _END)
+        except _Stopped:
+            pass
+        except BaseException as e:
+            logger.exception(f"Stage {metrics.name} failed")
+            if self._error is None:
+                self._error = e
+            self._stop.set()
+        finally:
+            metrics.busy_time = max(
+                time.perf_counter()
+                - started
+                - metrics.wait_time
+                - metrics.blocked_time,
+                0.0,
+            )
+
+
+def batched(items: Iterator[Any], size: int) -> Iterator[List[Any]]:
+    """Group items in lists of at most ``size`` items."""
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
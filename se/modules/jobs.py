@@ -0,0 +1,575 @@
+"""Database-backed job queue running the document analyses in workers.
+
+Uploads enqueue an analysis job and return immediately. Workers, started
+with ``flask worker`` and scaled separately from the web tier, claim the
+jobs from the jobs table (see se.models.Job) and run them.
+
+A claimed job is locked for a visibility timeout that the worker extends
+while the job runs. If the worker crashes, the lock expires and the job is
+claimed again by another worker, until it has been attempted
+``max_attempts`` times.
+"""
+
+import functools
+import json
+import logging
+import os
+import socket
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, Optional
+
+import sqlalchemy as sa
+from flask import Flask, current_app
+from sqlalchemy.orm import aliased
+
+from se.app import db
+from se.models import AnalysisResult, Document, Job, JobEvent
+from se.modules.llama_analyzer import EventCallback
+from se.modules.ocr import remove_ocr_stats, save_ocr_stats
+
+logger = logging.getLogger("se.jobs")
+
+ANALYSIS = "analysis"
+# Statuses of the jobs waiting or running
+PENDING = (Job.RESERVED, Job.QUEUED, Job.PROCESSING)
+
+
+class AnalysisError(Exception):
+    """The analysis produced no usable result, retrying won't help."""
+
+    def __init__(self, code: str, message: str):
+        super().__init__(f"{message} Error Code: {code}")
+        self.code = code
+
+
+def enqueue_analysis(
+    document: Document,
+    refresh: bool = False,
+    max_attempts: int = 3,
+    client: Optional[str] = None,
+    reservation: Optional[Job] = None,
+) -> Job:
+    """Queue the analysis of the document.
+
+    :param document: The document to analyze.
+    :param refresh: Query the LLM even if responses are cached.
+    :param max_attempts: Number of times the job is run before it fails.
+    :param client: The sender of the document, see claim_job.
+    :param reservation: The place reserved when the upload was admitted
+                        (see reserve_analysis), queued instead of a new job.
+    """
+    values = {
+        "kind": ANALYSIS,
+        "status": Job.QUEUED,
+        "client": client,
+        "payload": {"refresh": refresh},
+        "max_attempts": max_attempts,
+    }
+    if reservation is not None:
+        queued = db.session.execute(
+            sa.update(Job)
+            .where(Job.id == reservation.id, Job.status == Job.RESERVED)
+            .values(document_id=document.id, locked_until=None, **values)
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if queued.rowcount:
+            db.session.refresh(reservation)
+            return reservation
+
+    return Job.create(document=document, **values)
+
+
+def _waiting(now: datetime):
+    """Jobs taking a place in the queue, reservations included."""
+    return sa.or_(
+        Job.status == Job.QUEUED,
+        sa.and_(Job.status == Job.RESERVED, Job.locked_until >= now),
+    )
+
+
+def reserve_analysis(
+    client: Optional[str],
+    hold: float,
+    queue_limit: int = 0,
+    client_limit: int = 0,
+) -> Optional[Job]:
+    """Reserve a place in the queue for the analysis of an upload.
+
+    The limits are checked and the place taken by a single statement, so
+    concurrent uploads can't all pass the check before any job is queued.
+    The reservation is queued by enqueue_analysis once the upload is stored,
+    or cancelled (see cancel_reservation). It expires after ``hold``
+    seconds, e.g. if the upload is abandoned.
+
+    :param client: The sender of the upload.
+    :param hold: Seconds the place is reserved.
+    :param queue_limit: Maximum number of waiting jobs, 0 for no limit.
+    :param client_limit: Maximum number of pending jobs of the client, 0
+                         for no limit.
+    :return: The reserved job, None if a limit is reached.
+    """
+    now = datetime.utcnow()
+    db.session.execute(
+        sa.delete(Job)
+        .where(Job.status == Job.RESERVED, Job.locked_until < now)
+        .execution_options(synchronize_session=False)
+    )
+
+    conditions = []
+    if queue_limit:
+        waiting = sa.select(sa.func.count(Job.id)).where(_waiting(now))
+        conditions.append(waiting.scalar_subquery() < queue_limit)
+    if client_limit and client is not None:
+        pending = sa.select(sa.func.count(Job.id)).where(
+            Job.client == client,
+            sa.or_(_waiting(now), Job.status == Job.PROCESSING),
+        )
+        conditions.append(pending.scalar_subquery() < client_limit)
+
+    reservation = sa.select(
+        sa.literal(ANALYSIS),
+        sa.literal(Job.RESERVED),
+        sa.literal(client, sa.String()),
+        sa.literal(0),
+        sa.literal(1),
+        sa.literal(now + timedelta(seconds=hold), sa.DateTime()),
+    ).where(sa.true(), *conditions)
+    job_id = db.session.scalar(
+        sa.insert(Job)
+        .from_select(
+            ["kind", "status", "client", "attempts", "max_attempts", "locked_until"],
+            reservation,
+        )
+        .returning(Job.id)
+    )
+    db.session.commit()
+    return db.session.get(Job, job_id) if job_id is not None else None
+
+
+def cancel_reservation(reservation: Job) -> bool:
+    """Free the place of a reservation not queued, e.g. a rejected upload.
+
+    :return: False if the reservation was queued.
+    """
+    cancelled = db.session.execute(
+        sa.delete(Job)
+        .where(Job.id == reservation.id, Job.status == Job.RESERVED)
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return cancelled.rowcount > 0
+
+
+def count_jobs(client: Optional[str] = None) -> Dict[str, int]:
+    """Count the reserved, queued and processing jobs, of all or of one client.
+
+    Expired reservations are not counted.
+    """
+    query = sa.select(Job.status, sa.func.count(Job.id)).where(
+        sa.or_(_waiting(datetime.utcnow()), Job.status == Job.PROCESSING)
+    )
+    if client is not None:
+        query = query.where(Job.client == client)
+    counts = dict(db.session.execute(query.group_by(Job.status)).all())
+    return {status: counts.get(status, 0) for status in PENDING}
+
+
+def _expired(now: datetime):
+    return sa.and_(Job.status == Job.PROCESSING, Job.locked_until < now)
+
+
+def _running(now: datetime, client=None):
+    """Count the processing jobs still locked, of all or of one client."""
+    running = aliased(Job)
+    query = sa.select(sa.func.count(running.id)).where(
+        running.status == Job.PROCESSING, running.locked_until >= now
+    )
+    if client is not None:
+        query = query.where(running.client == client)
+    return query.scalar_subquery()
+
+
+def claim_job(
+    worker_id: str, visibility_timeout: float, max_in_flight: int = 0
+) -> Optional[Job]:
+    """Claim the next queued job, or a processing job whose lock expired.
+
+    Jobs are shared fairly between clients: the next job is the oldest of
+    the clients with the fewest running jobs, so a client queuing many
+    documents doesn't hold every worker.
+
+    Each candidate is claimed with a conditional update, so a job is only
+    claimed once when several workers race for it. Expired jobs that have
+    no attempts left are set as failed.
+
+    :param worker_id: Identifier of the claiming worker.
+    :param visibility_timeout: Seconds the job is locked for.
+    :param max_in_flight: Maximum number of jobs running at the same time
+                          over all the workers, 0 for no limit.
+    :return: The claimed job, None if there is nothing to run.
+    """
+    now = datetime.utcnow()
+    db.session.execute(
+        sa.update(Job)
+        .where(_expired(now), Job.attempts >= Job.max_attempts)
+        .values(
+            status=Job.FAILED,
+            error="The job timed out.",
+            locked_by=None,
+            locked_until=None,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+
+    claimable = sa.or_(Job.status == Job.QUEUED, _expired(now))
+    candidates = db.session.scalars(
+        sa.select(Job.id)
+        .where(claimable)
+        .order_by(_running(now, Job.client), Job.id)
+        .limit(10)
+    ).all()
+
+    conditions = [claimable]
+    if max_in_flight > 0:
+        # Checked by the claim itself, so racing workers can't exceed it
+        conditions.append(_running(now) < max_in_flight)
+
+    for job_id in candidates:
+        result = db.session.execute(
+            sa.update(Job)
+            .where(Job.id == job_id, *conditions)
+            .values(
+                status=Job.PROCESSING,
+                attempts=Job.attempts + 1,
+                locked_by=worker_id,
+                locked_until=now + timedelta(seconds=visibility_timeout),
+            )
+            .execution_options(synchronize_session=False)
+        )
+        db.session.commit()
+        if result.rowcount == 1:
+            return db.session.get(Job, job_id, populate_existing=True)
+
+    return None
+
+
+def extend_lock(job_id: int, worker_id: str, visibility_timeout: float) -> bool:
+    """Extend the lock of a job held by the worker.
+
+    :return: False if the worker lost the lock.
+    """
+    result = db.session.execute(
+        sa.update(Job)
+        .where(
+            Job.id == job_id,
+            Job.status == Job.PROCESSING,
+            Job.locked_by == worker_id,
+        )
+        .values(locked_until=datetime.utcnow() + timedelta(seconds=visibility_timeout))
+        .execution_options(synchronize_session=False)
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def finish_job(
+    job: Job,
+    worker_id: str,
+    analysis_result: Optional[AnalysisResult] = None,
+    error: Optional[str] = None,
+    retry: bool = False,
+):
+    """Set the job as done, failed or queued again for another attempt.
+
+    Nothing is changed if the worker lost the lock of the job, which is
+    then run (or was already finished) by another worker.
+    """
+    if error is None:
+        values = {"status": Job.DONE, "error": None}
+        if analysis_result is not None:
+            values["analysis_result_id"] = analysis_result.id
+    elif retry and job.attempts < job.max_attempts:
+        values = {"status": Job.QUEUED, "error": error}
+    else:
+        values = {"status": Job.FAILED, "error": error}
+
+    result = db.session.execute(
+        sa.update(Job)
+        .where(
+            Job.id == job.id,
+            Job.status == Job.PROCESSING,
+            Job.locked_by == worker_id,
+        )
+        .values(locked_by=None, locked_until=None, **values)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 1:
+        # Committed with the status, so a finished job always has its event
+        data = {key: value for key, value in values.items() if key != "status"}
+        db.session.add(JobEvent(job_id=job.id, event=values["status"], data=data))
+    else:
+        logger.warning(f"Job {job.id} was taken over by another worker")
+    db.session.commit()
+    db.session.refresh(job)
+
+
+def add_job_event(job_id: int, event: str, data: Optional[dict] = None):
+    """Record a progress event of a job."""
+    JobEvent.create(job_id=job_id, event=event, data=data or {})
+
+
+def format_event(event: str, data: dict, event_id: Optional[int] = None) -> str:
+    """Format an event for a Server-Sent Events stream."""
+    lines = [f"id: {event_id}"] if event_id is not None else []
+    lines += [f"event: {event}", f"data: {json.dumps(data)}"]
+    return "\n".join(lines) + "\n\n"
+
+
+def stream_job_events(
+    job_id: int,
+    last_event_id: int = 0,
+    poll_interval: float = 1.0,
+    keepalive: float = 15.0,
+    max_duration: float = 30.0,
+) -> Iterator[str]:
+    """Stream the events of a job as Server-Sent Events.
+
+    The events are polled from the database, as they are written by the
+    workers in other processes. The stream ends with the "done" or "failed"
+    event of the job, or after ``max_duration`` seconds, when the browser
+    reconnects with the identifier of the last event it received.
+
+    An open stream holds a server thread and a database session, so the
+    streams are kept short and the application must be served by a
+    threaded (or async) server.
+
+    :param job_id: Identifier of the job.
+    :param last_event_id: Only stream the events after this one.
+    :param poll_interval: Seconds between two reads of the events.
+    :param max_duration: Seconds after which the stream is closed.
+    """
+    started = last_sent = time.monotonic()
+    yield f"retry: {int(poll_interval * 4000)}\n\n"
+
+    while time.monotonic() - started < max_duration:
+        # Read the status first: the events of a finished job are committed
+        # with (or before) its status, so none is missed below.
+        job = db.session.get(Job, job_id, populate_existing=True)
+        if job is None:
+            return
+        events = db.session.scalars(
+            sa.select(JobEvent)
+            .where(JobEvent.job_id == job_id, JobEvent.id > last_event_id)
+            .order_by(JobEvent.id)
+        ).all()
+        # End the read transaction to see the next commits of the workers
+        db.session.rollback()
+
+        for event in events:
+            last_event_id = event.id
+            last_sent = time.monotonic()
+            yield format_event(event.event, event.data or {}, event.id)
+            if event.event in (Job.DONE, Job.FAILED):
+                return
+
+        if job.is_finished():
+            # Finished without an event, e.g. failed after a timeout
+            yield format_event(job.status, job.as_dict())
+            return
+
+        if time.monotonic() - last_sent >= keepalive:
+            last_sent = time.monotonic()
+            yield ": keepalive\n\n"
+        time.sleep(poll_interval)
+
+
+def analyze_document(
+    document: Document,
+    refresh: bool = False,
+    on_event: Optional[EventCallback] = None,
+) -> AnalysisResult:
+    """Extract the text of the document, analyze it and store the result.
+
+    :param document: The document to analyze.
+    :param refresh: Query the LLM even if responses are cached.
+    :param on_event: Receives the progress events of the analysis.
+    :raise AnalysisError: If the analysis gave no steps or no result.
+    """
+    from se.modules.agent_controller import AgentController
+    from se.modules.embedding_cache import get_embedding_cache
+    from se.modules.response_cache import get_response_cache
+
+    config = current_app.config
+    model_file = document.file
+
+    agent = AgentController(
+        persist_dir=config.get("STORAGE_DIR") or "storage",
+        query_concurrency=config.get("LLM_QUERY_CONCURRENCY", 1),
+        batch_token_budget=config.get("LLM_BATCH_TOKEN_BUDGET", 0),
+        response_cache=get_response_cache(config),
+        model=config.get("OPENAI_MODEL") or "",
+        embedding_cache=get_embedding_cache(config),
+        context_token_cap=config.get("LLM_CONTEXT_TOKEN_CAP", 512),
+        embedding_model=config.get("OPENAI_EMBEDDING_MODEL") or "",
+        on_event=on_event,
+        ingest_batch_size=config.get("INGEST_BATCH_SIZE", 64),
+        ingest_queue_size=config.get("INGEST_QUEUE_SIZE", 8),
+    )
+
+    # Extract the text once: it fills the pages table and the PDF profile,
+    # and the pages are indexed while they are extracted. A retried job keeps
+    # the pages of the earlier attempt.
+    if not document.pages:
+        document.extract_pages(
+            ingest=functools.partial(agent.ingest, model_file.get_path())
+        )
+
+    analysis_result, steps = agent.run(
+        model_file.get_path(),
+        pages=document.get_pages_summary(),
+        content_hash=model_file.sha256_content,
+        refresh=refresh,
+    )
+
+    if not steps:
+        raise AnalysisError("SA1001", "No analysis steps determined by the system.")
+    if not analysis_result:
+        raise AnalysisError("SA1002", "No analysis result determined by the system.")
+
+    model_analysis_result = AnalysisResult.create(
+        document=document,
+        analysis_result=json.dumps(analysis_result),
+        analysis_steps=json.dumps(steps),
+        metrics=json.dumps(agent.analyzer.metrics.as_dict()),
+    )
+
+    document.type = analysis_result.get("document_type", "Unknown")
+    document.save()
+
+    return model_analysis_result
+
+
+class Worker:
+    """A pool of threads claiming and running jobs.
+
+    Analyses mostly wait for the LLM, so threads are enough to run several
+    at a time. Run more worker processes to scale out.
+
+    :param app: The application, each thread runs in its own app context.
+    :param concurrency: Number of jobs run at the same time.
+    :param poll_interval: Seconds to wait for new jobs when the queue is empty.
+    :param visibility_timeout: Seconds a claimed job stays locked without
+                               the lock being extended.
+    :param max_in_flight: Maximum number of jobs running at the same time
+                          over all the worker processes, 0 for no limit.
+    """
+
+    def __init__(
+        self,
+        app: Flask,
+        concurrency: int = 1,
+        poll_interval: float = 1.0,
+        visibility_timeout: float = 600,
+        max_in_flight: int = 0,
+    ):
+        self.app = app
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.visibility_timeout = visibility_timeout
+        self.max_in_flight = max_in_flight
+        self.name = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping = threading.Event()
+
+    def stop(self):
+        """Stop claiming jobs, running jobs are finished."""
+        self._stopping.set()
+
+    def run(self, burst: bool = False):
+        """Run jobs until stopped.
+
+        :param burst: Return once the queue is empty instead of waiting.
+        """
+        threads = [
+            threading.Thread(
+                target=self._loop, args=(f"{self.name}/{i}", burst), daemon=True
+            )
+            for i in range(self.concurrency)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        remove_ocr_stats(self.app.config, self.name)
+
+    def _loop(self, worker_id: str, burst: bool):
+        while not self._stopping.is_set():
+            job = None
+            with self.app.app_context():
+                try:
+                    job = claim_job(
+                        worker_id, self.visibility_timeout, self.max_in_flight
+                    )
+                    if job is not None:
+                        self.run_job(job, worker_id)
+                except Exception:
+                    logger.exception("Unable to claim or run a job")
+                finally:
+                    db.session.remove()
+
+            if job is None:
+                if burst:
+                    return
+                self._stopping.wait(self.poll_interval)
+
+    def _heartbeat(self, job_id: int, worker_id: str, done: threading.Event):
+        """Extend the lock of the job until it is done."""
+        while not done.wait(self.visibility_timeout / 3):
+            with self.app.app_context():
+                try:
+                    if not extend_lock(job_id, worker_id, self.visibility_timeout):
+                        logger.warning(f"Lost the lock of job {job_id}")
+                        return
+                except Exception:
+                    logger.exception(f"Unable to extend the lock of job {job_id}")
+                finally:
+                    db.session.remove()
+
+    def run_job(self, job: Job, worker_id: str):
+        """Run a claimed job and record its outcome."""
+        logger.info(f"Running job {job.id} ({job.kind}), attempt {job.attempts}")
+        done = threading.Event()
+        heartbeat = threading.Thread(
+            target=self._heartbeat, args=(job.id, worker_id, done), daemon=True
+        )
+        heartbeat.start()
+
+        try:
+            if job.kind != ANALYSIS or job.document is None:
+                raise AnalysisError("SA1003", f"Unable to run the job {job.kind}.")
+            payload = job.payload or {}
+            job_id = job.id
+            result = analyze_document(
+                job.document,
+                refresh=payload.get("refresh"),
+                on_event=lambda event, data: add_job_event(job_id, event, data),
+            )
+        except AnalysisError as e:
+            logger.error(f"Job {job.id} failed: {e}")
+            db.session.rollback()
+            finish_job(job, worker_id, error=str(e))
+        except Exception as e:
+            logger.exception(f"Job {job.id} failed")
+            db.session.rollback()
+            finish_job(job, worker_id, error=str(e), retry=True)
+        else:
+            logger.info(f"Job {job.id} done")
+            finish_job(job, worker_id, analysis_result=result)
+        finally:
+            done.set()
+            heartbeat.join()
+            # Exported by the web processes, see export_ocr_stats
+            save_ocr_stats(self.app.config, self.name)
@@ -1,18 +1,59 @@
+import asyncio
 import hashlib
 import json
 import logging
+import mimetypes
 import os
+import time
 from pathlib import Path
-from typing import Optional, Union
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Union
 
 from llama_index.core import (
+    Document,
+    Settings,
     SimpleDirectoryReader,
     StorageContext,
     VectorStoreIndex,
     load_index_from_storage,
 )
+from llama_index.core.ingestion import run_transformations
+from llama_index.core.schema import BaseNode, MetadataMode, QueryBundle
 
 from se.modules.data_collector import JSONLCollector
+from se.modules.embedding_cache import (
+    EmbeddingCache,
+    EmbeddingStats,
+    embed_nodes_cached,
+)
+from se.modules.extractors import (
+    QUERIED,
+    SKIPPED,
+    VERIFIED,
+    default_extractors,
+    extraction_stats,
+    pre_extract,
+)
+from se.modules.index_cache import index_cache
+from se.modules.ingestion import Pipeline, PipelineMetrics, batched
+from se.modules.llm_metrics import (
+    INDEX,
+    QUERY,
+    CallMetrics,
+    RunMetrics,
+    TokenUsage,
+    estimate_cost,
+    register_usage_handler,
+    track_usage,
+)
+from se.modules.prompt_context import (
+    PromptTokens,
+    context_prompt,
+    count_tokens,
+    legacy_context,
+    normalize_prompt,
+)
+from se.modules.response_cache import ResponseCache, cache_key
+from se.pdftools import PDFDocument
 from se.utils import clean_json_string, load_prompt
 
 logger = logging.getLogger("se.llama_analyzer")
@@ -28,14 +69,170 @@ def default_prompts() -> dict:
     }
 
 
+# Metadata kept out of embeddings and LLM prompts, same as SimpleDirectoryReader.
+EXCLUDED_METADATA_KEYS = ["file_name", "file_type", "file_size"]
+
+# The upload path is unique to every file, so it would make the embedded
+# text of identical chunks differ and defeat the embedding cache.
+EXCLUDED_EMBED_METADATA_KEYS = EXCLUDED_METADATA_KEYS + ["file_path"]
+
+
+def _page_document(file: str, page_label: str, text: str) -> Document:
+    """Build a document for a single page of the given file."""
+    doc = Document(
+        text=text,
+        metadata={
+            "page_label": page_label,
+            "file_path": file,
+            "file_name": os.path.basename(file),
+            "file_type": mimetypes.guess_type(file)[0],
+            "file_size": os.path.getsize(file),
+        },
+    )
+    doc.excluded_embed_metadata_keys.extend(EXCLUDED_EMBED_METADATA_KEYS)
+    doc.excluded_llm_metadata_keys.extend(EXCLUDED_METADATA_KEYS)
+    return doc
+
+
+def load_documents(file: str, pages: Optional[List[dict]] = None) -> List[Document]:
+    """Load a file as a list of documents, one document per PDF page.
+
+    When the text of the pages is already extracted (e.g. from the Page
+    table), the documents are built from it without reading the file.
+    Otherwise PDF files are read through the shared memory-mapped reader
+    (se.pdftools.PDFDocument), and other files by SimpleDirectoryReader.
+    The documents carry the same metadata as SimpleDirectoryReader produces,
+    so that page labels are available to the prompts.
+
+    :param file: Path to the document file.
+    :param pages: Dictionaries with page_number, page_content and optionally
+                  page_label keys.
+    """
+    if pages:
+        return [
+            _page_document(
+                file,
+                page.get("page_label", str(page["page_number"])),
+                page["page_content"],
+            )
+            for page in sorted(pages, key=lambda p: p["page_number"])
+        ]
+
+    if not file.lower().endswith(".pdf"):
+        return SimpleDirectoryReader(input_files=[file]).load_data()
+
+    with PDFDocument(file) as pdf:
+        return [
+            _page_document(file, pdf.page_label(index), text)
+            for index, text in pdf.extract_text()
+        ]
+
+
+# Settings of the query engine. They change the retrieved context, so they
+# are part of the response cache key.
+RETRIEVAL_SETTINGS = {"similarity_top_k": 2, "response_mode": "compact"}
+
+# Prefix of the keys of queries packing several categories.
+BATCH_KEY_PREFIX = "batch:"
+
+# Prefix of the keys of custom prompts, e.g. asking for missing data.
+CUSTOM_KEY_PREFIX = "custom_prompt_"
+
+# Receives the progress events of an analysis: the event name and its data.
+EventCallback = Callable[[str, dict], None]
+
+# Event sent with the result of a category as soon as it is known.
+CATEGORY_EVENT = "category"
+
+JSON_ONLY_INSTRUCTION = (
+    "Your entire response/output is going to consist of a single JSON object {}, "
+    "and you will NOT wrap it within JSON markdown markers."
+)
+
+
+# Fields of the earlier responses given as context to the prompt of a step,
+# in priority order. Other steps only get the document type.
+CONTEXT_FIELDS = {
+    "risks": ("document_type", "obligations"),
+}
+DEFAULT_CONTEXT_FIELDS = ("document_type",)
+
+
+def _in_event_loop() -> bool:
+    """Check whether an event loop is running in the current thread."""
+    try:
+        asyncio.get_running_loop()
+    except RuntimeError:
+        return False
+    return True
+
+
 class LlamaAnalyzer:
     """A dynamic analyzer that supports adaptive interaction with the user."""
 
-    def __init__(self, persist_dir: Union[str, Path]):
+    def __init__(
+        self,
+        persist_dir: Union[str, Path],
+        query_concurrency: int = 1,
+        batch_token_budget: int = 0,
+        response_cache: Optional[ResponseCache] = None,
+        model: str = "",
+        embedding_cache: Optional[EmbeddingCache] = None,
+        context_token_cap: int = 512,
+        embedding_model: str = "",
+        ingest_batch_size: int = 64,
+        ingest_queue_size: int = 8,
+    ):
+        """Initialize the analyzer.
+
+        :param persist_dir: Directory to persist indexes and responses to.
+        :param query_concurrency: Maximum number of category queries run at
+                                  the same time, 1 runs them in order.
+        :param batch_token_budget: Maximum size in tokens of a prompt packing
+                                   several text and list categories, 0 queries
+                                   every category on its own.
+        :param response_cache: Cache of the responses, None disables caching.
+        :param model: Name of the LLM, part of the response cache key.
+        :param embedding_cache: Cache of the chunk embeddings, None embeds
+                                every chunk of the indexed documents.
+        :param context_token_cap: Maximum size in tokens of the earlier
+                                  responses appended to a prompt, 0 appends
+                                  none.
+        :param embedding_model: Name of the embedding model, used to estimate
+                                the cost of the embeddings.
+        :param ingest_batch_size: Number of chunks embedded by request when
+                                  ingesting a document (see ingest).
+        :param ingest_queue_size: Maximum number of items waiting between
+                                  two stages of the ingestion pipeline.
+        """
         self.persist_dir = persist_dir
+        self.query_concurrency = query_concurrency
+        self.batch_token_budget = batch_token_budget
+        self.response_cache = response_cache
+        self.model = model
+        self.embedding_cache = embedding_cache
+        self.context_token_cap = context_token_cap
+        # Prompt tokens with and without context compaction, reset by run
+        self.prompt_tokens = PromptTokens()
+        self.embedding_model = embedding_model
+        self.ingest_batch_size = ingest_batch_size
+        self.ingest_queue_size = ingest_queue_size
+        # Time, tokens and cost of the calls, reset by run
+        self.metrics = RunMetrics()
+        # Embedding cache lookups of the last index build
+        self.embedding_stats: Optional[EmbeddingStats] = None
+        # SHA-256 of the analyzed document, responses are cached when set
+        self.content_hash: Optional[str] = None
+        # Skip cached responses (they are still updated)
+        self.refresh_cache = False
         self.additional_context = []
         self.index = None
         self.query_engine = None
+        self.extractors = default_extractors()
+        # Progress events, see EventCallback
+        self.on_event: Optional[EventCallback] = None
+        # Count the tokens of the calls made by the query engines
+        register_usage_handler()
 
         # Initialize data collector for responses
         responses_file = Path(self.persist_dir) / "data" / "llm_responses.jsonl"
@@ -47,33 +244,281 @@ class LlamaAnalyzer:
         if context not in self.additional_context:
             self.additional_context += [context]
 
-    def _load_index(self, file: str):
-        """Load the index from the persisted storage or build it from the given text or file."""
-        # Check if persisted storage exists
-        index_persist_dir = str(self.index_base_dir / os.path.basename(file))
+    def _load_index(self, file: str, pages: Optional[List[dict]] = None):
+        """Load the index from the persisted storage or build it from the given pages or file.
 
-        # Load documents and build in-memory index.
-        if not os.path.exists(index_persist_dir):
-            docs = SimpleDirectoryReader(input_files=[file]).load_data()
-            self.index = VectorStoreIndex.from_documents(docs)
+        Loaded indexes are kept in the process-wide index cache, so repeated
+        analyses of the same document don't read the storage again.
+        """
+        index_persist_dir = self._index_persist_dir(file)
 
-            # Persist the index to storage
-            self.index.storage_context.persist(persist_dir=index_persist_dir)
-        else:
+        def load():
+            # Load documents and build in-memory index.
+            if not os.path.exists(index_persist_dir):
+                docs = load_documents(file, pages)
+                index = self._build_index(file, docs)
+
+                # Persist the index to storage
+                index.storage_context.persist(persist_dir=index_persist_dir)
+                return index
+
+            logger.info(f"Loading index from {index_persist_dir}...")
             storage_context = StorageContext.from_defaults(
                 persist_dir=index_persist_dir
             )
-            self.index = load_index_from_storage(storage_context)
+            return load_index_from_storage(storage_context)
+
+        self.index = index_cache.get_or_load(os.path.abspath(index_persist_dir), load)
 
         # Create a query engine if not already initialized
         if not self.query_engine:
             logger.info("Initializing query engine from the index...")
-            self.query_engine = self.index.as_query_engine()
+            self.query_engine = self.index.as_query_engine(**RETRIEVAL_SETTINGS)
+
+    def _index_persist_dir(self, file: str) -> str:
+        return str(self.index_base_dir / os.path.basename(file))
+
+    def ingest(self, file: str, pages: Iterable[dict]) -> Optional[PipelineMetrics]:
+        """Build the index of a file while its pages are extracted.
+
+        The pages go through a pipeline of stages running concurrently:
+        chunking, embedding in batches and insertion in the vector store. The
+        first chunks are embedded while the next pages are still extracted.
+        The index is persisted and cached for the analysis, as _load_index
+        does.
+
+        The pages are consumed even if the file is already indexed. If they
+        raise an error, e.g. the file can't be read to the end, the index is
+        not persisted and the error is raised.
+
+        :param file: Path to the document file.
+        :param pages: Dictionaries with page_number and page_content keys.
+        :return: The metrics of the pipeline stages, None if the file was
+                 already indexed.
+        """
+        index_persist_dir = self._index_persist_dir(file)
+        if os.path.exists(index_persist_dir):
+            for _ in pages:
+                pass
+            return None
+
+        index = VectorStoreIndex(nodes=[])
+        stats = EmbeddingStats()
+
+        def chunk(pages: Iterator[dict]) -> Iterator[BaseNode]:
+            for page in pages:
+                doc = _page_document(
+                    file,
+                    page.get("page_label", str(page["page_number"])),
+                    page["page_content"],
+                )
+                yield from run_transformations([doc], Settings.transformations)
+
+        def embed(nodes: Iterator[BaseNode]) -> Iterator[List[BaseNode]]:
+            for batch in batched(nodes, self.ingest_batch_size):
+                if self.embedding_cache is None:
+                    texts = [
+                        node.get_content(metadata_mode=MetadataMode.EMBED)
+                        for node in batch
+                    ]
+                    vectors = Settings.embed_model.get_text_embedding_batch(texts)
+                    for node, vector in zip(batch, vectors):
+                        node.embedding = vector
+                    stats.misses += len(batch)
+                    stats.tokens += sum(
+                        count_tokens(text, self.embedding_model) for text in texts
+                    )
+                else:
+                    batch_stats = embed_nodes_cached(
+                        batch, Settings.embed_model, self.embedding_cache
+                    )
+                    stats.hits += batch_stats.hits
+                    stats.misses += batch_stats.misses
+                    stats.tokens += batch_stats.tokens
+                yield batch
+
+        def insert(batches: Iterator[List[BaseNode]]) -> Iterator[int]:
+            for batch in batches:
+                index.insert_nodes(batch)
+                yield len(batch)
+
+        pipeline = (
+            Pipeline(queue_size=self.ingest_queue_size)
+            .add_stage("chunk", chunk)
+            .add_stage("embed", embed)
+            .add_stage("insert", insert)
+        )
+        pipeline.run("extract", pages)
+        index.storage_context.persist(persist_dir=index_persist_dir)
+        index_cache.get_or_load(os.path.abspath(index_persist_dir), lambda: index)
+
+        metrics = pipeline.metrics
+        self.embedding_stats = stats
+        self.metrics.ingestion = metrics.as_dict()
+        self.metrics.record(
+            CallMetrics(
+                name="index",
+                kind=INDEX,
+                wall_time=metrics.elapsed,
+                embedding_tokens=stats.tokens,
+                cost=estimate_cost(self.embedding_model, stats.tokens),
+            )
+        )
+        bottleneck = metrics.bottleneck()
+        logger.info(
+            f"Ingested {os.path.basename(file)} in {metrics.elapsed:.2f}s, "
+            f"{stats.hits}/{stats.hits + stats.misses} chunks cached, "
+            f"bottleneck: {bottleneck.name} ({bottleneck.busy_time:.2f}s busy)"
+        )
+        return metrics
+
+    def _build_index(self, file: str, docs: List[Document]) -> VectorStoreIndex:
+        """Build an index of the documents, reusing cached chunk embeddings."""
+        started = time.perf_counter()
+
+        # Split the documents as from_documents does, so the chunks can be
+        # counted and only the ones missing from the cache are embedded.
+        nodes = run_transformations(docs, Settings.transformations)
+        if self.embedding_cache is None:
+            tokens = sum(
+                count_tokens(
+                    node.get_content(metadata_mode=MetadataMode.EMBED),
+                    self.embedding_model,
+                )
+                for node in nodes
+            )
+        else:
+            self.embedding_stats = embed_nodes_cached(
+                nodes, Settings.embed_model, self.embedding_cache
+            )
+            tokens = self.embedding_stats.tokens
+            logger.info(
+                f"Embedding cache of {os.path.basename(file)}: "
+                f"{self.embedding_stats.hits}/{len(nodes)} chunks cached "
+                f"(hit ratio {self.embedding_stats.hit_ratio:.0%})"
+            )
+        index = VectorStoreIndex(nodes=nodes)
+
+        self.metrics.record(
+            CallMetrics(
+                name="index",
+                kind=INDEX,
+                wall_time=time.perf_counter() - started,
+                embedding_tokens=tokens,
+                cost=estimate_cost(self.embedding_model, tokens),
+            )
+        )
+        return index
 
     def query(self, prompt, name=None):
         """Query the index with the given prompt."""
-        # Run the query
-        response = self.query_engine.query(prompt)  # type: ignore
+        started = time.perf_counter()
+        key = self._cache_key(prompt)
+        cached = self._cached_response(key)
+        if cached is not None:
+            self._record_cached(name, started)
+            return cached
+
+        # Run the query, retrieving and synthesizing as the query engine does
+        query_bundle = QueryBundle(prompt)
+        with track_usage(self.model, self.embedding_model) as usage:
+            nodes = self.query_engine.retrieve(query_bundle)  # type: ignore
+            retrieval_time = time.perf_counter() - started
+            response = self.query_engine.synthesize(query_bundle, nodes)  # type: ignore
+        self._record_query(
+            name, prompt, nodes, response, started, retrieval_time, usage
+        )
+        return self._handle_response(prompt, response, name, key)
+
+    async def aquery(self, prompt, name=None):
+        """Query the index with the given prompt asynchronously."""
+        started = time.perf_counter()
+        key = self._cache_key(prompt)
+        cached = self._cached_response(key)
+        if cached is not None:
+            self._record_cached(name, started)
+            return cached
+
+        query_bundle = QueryBundle(prompt)
+        with track_usage(self.model, self.embedding_model) as usage:
+            nodes = await self.query_engine.aretrieve(query_bundle)  # type: ignore
+            retrieval_time = time.perf_counter() - started
+            response = await self.query_engine.asynthesize(  # type: ignore
+                query_bundle, nodes
+            )
+        self._record_query(
+            name, prompt, nodes, response, started, retrieval_time, usage
+        )
+        return self._handle_response(prompt, response, name, key)
+
+    def _record_cached(self, name, started: float):
+        self.metrics.record(
+            CallMetrics(
+                name=name or "query",
+                kind=QUERY,
+                wall_time=time.perf_counter() - started,
+                cached=True,
+            )
+        )
+
+    def _record_query(
+        self,
+        name,
+        prompt,
+        nodes,
+        response,
+        started: float,
+        retrieval_time: float,
+        usage: Optional[TokenUsage] = None,
+    ):
+        """Record the time, tokens and cost of a query.
+
+        The tokens are those of the LLM and embedding calls seen in the
+        usage, templates and refine calls included. When the query engine
+        made no LLM call seen by the usage handler, the prompt tokens are
+        estimated as those of the query and the retrieved chunks, and the
+        embedding tokens as those of the query.
+        """
+        wall_time = time.perf_counter() - started
+        if usage is not None and usage.llm_calls:
+            prompt_tokens = usage.prompt_tokens
+            completion_tokens = usage.completion_tokens
+        else:
+            prompt_tokens = count_tokens(prompt, self.model) + sum(
+                count_tokens(node.node.get_content(MetadataMode.LLM), self.model)
+                for node in nodes
+            )
+            completion_tokens = count_tokens(str(response), self.model)
+        if usage is not None and usage.embedding_calls:
+            embedding_tokens = usage.embedding_tokens
+        else:
+            embedding_tokens = count_tokens(prompt, self.embedding_model)
+        self.metrics.record(
+            CallMetrics(
+                name=name or "query",
+                kind=QUERY,
+                wall_time=wall_time,
+                retrieval_time=retrieval_time,
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                embedding_tokens=embedding_tokens,
+                cost=estimate_cost(self.model, prompt_tokens, completion_tokens)
+                + estimate_cost(self.embedding_model, embedding_tokens),
+            )
+        )
+
+    def _cache_key(self, prompt: str) -> Optional[str]:
+        if self.response_cache is None or not self.content_hash:
+            return None
+        return cache_key(self.content_hash, prompt, self.model, RETRIEVAL_SETTINGS)
+
+    def _cached_response(self, key: Optional[str]) -> Optional[str]:
+        if key is None or self.refresh_cache:
+            return None
+        return self.response_cache.get(key)  # type: ignore
+
+    def _handle_response(self, prompt, response, name=None, key=None) -> str:
+        """Clean up and store the response to a query."""
         result = str(response).strip()
 
         # Remove ```json from the start and ``` from the end using regex
@@ -84,16 +529,22 @@ class LlamaAnalyzer:
         data = {"prompt": prompt, "response": json.loads(result)}
         self.response_collector.store(data, name)
 
+        if key is not None:
+            self.response_cache.set(key, result)  # type: ignore
+
         return result
 
-    def determine_analysis_steps(self, file: str) -> dict:
+    def determine_analysis_steps(
+        self, file: str, pages: Optional[List[dict]] = None
+    ) -> dict:
         """Determine document type and necessary analysis steps.
 
         :param file: Path to the document file.
+        :param pages: Extracted pages to build the index from, if any.
         :return: JSON response with analysis steps.
         """
         # Load or build the index
-        self._load_index(file)
+        self._load_index(file, pages)
 
         # Run the initial query to determine steps
         prompt = load_prompt("initial_analysis")
@@ -112,12 +563,18 @@ class LlamaAnalyzer:
 
         return filtered_steps
 
-    def analyze_text(self, file: str, steps: dict, prompt: Optional[str] = None):
+    def analyze_text(
+        self,
+        file: str,
+        steps: dict,
+        prompt: Optional[str] = None,
+        pages: Optional[List[dict]] = None,
+    ):
         """Analyze the given text using LlamaIndex (VectorStoreIndex)."""
         logger.info("Start analyzing...")
 
         # Load or build the index
-        self._load_index(file)
+        self._load_index(file, pages)
 
         responses = {}
         prompts = {}
@@ -126,9 +583,10 @@ class LlamaAnalyzer:
                 {"document_type": steps["document_type"]}
             )
 
-        if prompt:
+        custom = bool(prompt)
+        if custom:
             logger.info("Using custom prompt for analysis...")
-            key = f"custom_prompt_{hashlib.sha256(prompt.encode()).hexdigest()}"
+            key = f"{CUSTOM_KEY_PREFIX}{hashlib.sha256(prompt.encode()).hexdigest()}"
             prompts[key] = prompt
         else:
             logger.info("Building prompts for analysis steps...")
@@ -146,16 +604,87 @@ class LlamaAnalyzer:
 
         logger.info(f"Prompts to use for analysis: {prompts.keys()}")
 
+        # Answer what we can with rules before asking the LLM.
+        extractions = {}
+        categories = {step["category"] for step in steps.get("analysis_steps", [])}
+        if pages and categories:
+            text = "\n".join(page["page_content"] for page in pages)
+            extractions = pre_extract(text, steps["analysis_steps"], self.extractors)
+
         # Query the index for each prompt and store the results.
+        queries = {}
         for key, prompt in prompts.items():
-            if len(responses) and prompt:
-                logger.debug("Using additional context for the query")
-                prompt += "\nThe following information have been already extracted:\n"
-                for r in responses.values():
-                    prompt += f"{r}\n"
+            extraction = extractions.get(key)
+            if extraction and extraction.confident:
+                logger.info(f"Skipping query for '{key}', extracted by rules")
+                self.record_extraction(key, SKIPPED)
+                responses[key] = json.dumps({key: extraction.value})
+                self._emit_category(key, responses[key])
+                self.response_collector.store(
+                    {
+                        "prompt": None,
+                        "response": {key: extraction.value},
+                        "rules": True,
+                    },
+                    key,
+                )
+                continue
+
+            if extraction:
+                logger.info(f"Shrinking query for '{key}' to a verification")
+                self.record_extraction(key, VERIFIED)
+                prompt = load_prompt(
+                    "verify_extraction",
+                    category=key,
+                    extracted=json.dumps({key: extraction.value}, indent=2),
+                )
+            elif key in categories:
+                self.record_extraction(key, QUERIED)
+
+            queries[key] = prompt
+
+        batches = {}
+        if self.batch_token_budget and not custom:
+            steps_by_category = {s["category"]: s for s in steps["analysis_steps"]}
+            batchable = [
+                steps_by_category[key]
+                for key in queries
+                if key not in extractions and key in steps_by_category
+            ]
+            for group in self._group_steps(batchable):
+                batch_key = BATCH_KEY_PREFIX + "+".join(s["category"] for s in group)
+                batches[batch_key] = group
+                for step in group:
+                    del queries[step["category"]]
+                queries[batch_key] = self._build_batch_prompt(group)
+
+        responses.update(self._run_queries(queries, responses))
+
+        # Split the batched responses, query failed categories on their own
+        fallback = {}
+        for batch_key, group in batches.items():
+            results = self._split_batch_response(responses.pop(batch_key), group)
+            for step in group:
+                category = step["category"]
+                if category in results:
+                    responses[category] = json.dumps({category: results[category]})
+                    self._emit_category(category, responses[category])
+                else:
+                    logger.info(f"Category '{category}' missing in batch, re-querying")
+                    fallback[category] = prompts[category]
 
-            logger.debug(f"Performing query for key '{key}' with prompt: {prompt}")
-            responses[key] = self.query(prompt, key)
+        if fallback:
+            responses.update(self._run_queries(fallback, responses))
+
+        # Merge the responses in the order of the analysis steps
+        responses = {
+            key: responses[key]
+            for key in ("document_type", *prompts)
+            if key in responses
+        }
+
+        if categories:
+            logger.debug(f"Pre-extraction skip rates: {extraction_stats.skip_rates()}")
 
         # Build a structured result dictionary
         result = {}
@@ -168,6 +697,194 @@ class LlamaAnalyzer:
 
         return result
 
+    def record_extraction(self, category: str, outcome: str):
+        """Record whether a category was answered by rules (see ExtractionStats).
+
+        The outcomes are counted for the process and stored with the metrics
+        of the run.
+        """
+        extraction_stats.record(category, outcome)
+        self.metrics.pre_extraction.record(category, outcome)
+
+    def emit(self, event: str, data: dict):
+        """Send a progress event, errors of the callback are only logged."""
+        if self.on_event is None:
+            return
+        try:
+            self.on_event(event, data)
+        except Exception:
+            logger.exception(f"Unable to send the '{event}' event")
+
+    def _emit_category(self, key: str, response: Optional[str]):
+        """Send the result of a category as soon as its response arrives."""
+        if self.on_event is None or not response:
+            return
+        if key.startswith((BATCH_KEY_PREFIX, CUSTOM_KEY_PREFIX)):
+            return
+        try:
+            data = json.loads(response)
+        except json.JSONDecodeError:
+            return
+        result = data.get(key, data) if isinstance(data, dict) else data
+        self.emit(CATEGORY_EVENT, {"category": key, "result": result})
+
+    def _run_queries(
+        self, queries: Dict[str, str], responses: Dict[str, str]
+    ) -> Dict[str, str]:
+        """Run the queries, concurrently if enabled, and return the responses.
+
+        Sequential queries get the earlier responses they need as context.
+        """
+        if self.query_concurrency > 1 and len(queries) > 1 and not _in_event_loop():
+            return asyncio.run(
+                self._query_concurrently(
+                    queries,
+                    (
+                        {"document_type": responses["document_type"]}
+                        if "document_type" in responses
+                        else {}
+                    ),
+                )
+            )
+
+        results = {}
+        for key, prompt in queries.items():
+            prompt = self._prepare_prompt(key, prompt, {**responses, **results})
+            logger.debug(f"Performing query for key '{key}' with prompt: {prompt}")
+            results[key] = self._tolerant(key, lambda: self.query(prompt, key))
+            self._emit_category(key, results[key])
+
+        return results
+
+    def _prepare_prompt(self, key: str, prompt: str, context: Dict[str, str]) -> str:
+        """Append the fields of the earlier responses needed by the prompt.
+
+        The context is compacted to the fields listed in CONTEXT_FIELDS and
+        capped at ``context_token_cap`` tokens, instead of every earlier raw
+        response. The prompt tokens with and without compaction are recorded.
+        """
+        if not prompt:
+            return prompt
+
+        fields = CONTEXT_FIELDS.get(key, DEFAULT_CONTEXT_FIELDS)
+        compacted = normalize_prompt(
+            context_prompt(prompt, context, fields, self.context_token_cap, self.model)
+        )
+        self.prompt_tokens.record(
+            key,
+            count_tokens(prompt + legacy_context(context), self.model),
+            count_tokens(compacted, self.model),
+        )
+        return compacted
+
+    @staticmethod
+    def _tolerant(key: str, run):
+        """Run a query, returning None on malformed responses to a batch."""
+        if not key.startswith(BATCH_KEY_PREFIX):
+            return run()
+        try:
+            return run()
+        except ValueError as e:
+            logger.warning(f"Malformed response for '{key}': {e}")
+            return None
+
+    async def _query_concurrently(
+        self, queries: Dict[str, str], context: Optional[Dict[str, str]] = None
+    ) -> Dict[str, str]:
+        """Run independent queries concurrently.
+
+        At most ``query_concurrency`` queries are in flight at a time. Unlike
+        sequential queries, which see the earlier responses they need (see
+        CONTEXT_FIELDS), each query only gets the document type as context.
+
+        :param queries: Prompts by category.
+        :param context: JSON response of the document type by key, if known.
+        :return: Responses by category, in the order of the queries.
+        """
+        semaphore = asyncio.Semaphore(self.query_concurrency)
+
+        async def run(key: str, prompt: str) -> str:
+            prompt = self._prepare_prompt(key, prompt, context or {})
+            async with semaphore:
+                logger.debug(f"Performing query for key '{key}' with prompt: {prompt}")
+                if not key.startswith(BATCH_KEY_PREFIX):
+                    response = await self.aquery(prompt, key)
+                    self._emit_category(key, response)
+                    return response
+                try:
+                    return await self.aquery(prompt, key)
+                except ValueError as e:
+                    logger.warning(f"Malformed response for '{key}': {e}")
+                    return None
+
+        results = await asyncio.gather(
+            *(run(key, prompt) for key, prompt in queries.items())
+        )
+        return dict(zip(queries, results))
+
+    def _group_steps(self, steps: List[dict]) -> List[List[dict]]:
+        """Pack text and list steps into groups fitting the token budget.
+
+        Steps are packed in order. Groups of a single step are dropped, as
+        these steps are better served by their own prompt.
+        """
+        groups, group, size = [], [], 0
+        overhead = count_tokens(load_prompt("batch_analysis", sections=[]), self.model)
+
+        for step in steps:
+            if step.get("type") not in ("text", "list"):
+                continue
+
+            tokens = count_tokens(self._build_generic_prompt(step), self.model)
+            if group and overhead + size + tokens > self.batch_token_budget:
+                groups.append(group)
+                group, size = [], 0
+            group.append(step)
+            size += tokens
+
+        groups.append(group)
+        return [group for group in groups if len(group) > 1]
+
+    def _build_batch_prompt(self, steps: List[dict]) -> str:
+        """Build a single prompt for several steps from their generic prompts."""
+        sections = [
+            {
+                "category": step["category"],
+                "prompt": self._build_generic_prompt(step)
+                .replace(JSON_ONLY_INSTRUCTION, "")
+                .strip(),
+            }
+            for step in steps
+        ]
+        return load_prompt(
+            "batch_analysis",
+            sections=sections,
+            categories=[step["category"] for step in steps],
+        )
+
+    @staticmethod
+    def _split_batch_response(response: Optional[str], steps: List[dict]) -> dict:
+        """Split a batched response into valid per-category results.
+
+        Categories missing from the response or with a value not matching
+        their step type are left out.
+        """
+        try:
+            data = json.loads(response) if response else {}
+        except json.JSONDecodeError:
+            return {}
+        if not isinstance(data, dict):
+            return {}
+
+        results = {}
+        for step in steps:
+            value = data.get(step["category"])
+            if step["type"] == "list" and isinstance(value, list):
+                results[step["category"]] = value
+            elif step["type"] == "text" and isinstance(value, (str, list)):
+                results[step["category"]] = value
+        return results
+
     def _build_generic_prompt(self, step: dict) -> str:
         """Build a generic prompt for the given step.
 
@@ -222,60 +939,35 @@ class LlamaAnalyzer:
         if not step:
             return ""
 
+        category = step["category"]
         reason = f"{step['reason']}\n" if "reason" in step else ""
         number = "" if step["type"] == "text" else "all "
-        instr = f"Use step-by-step reasoning to extract {number}{step['category']} from the document.\n"
-        instr += f"Format the result in JSON:\n"
-        prompt = f"{reason}{instr}"
+        prompt = (
+            f"{reason}Use step-by-step reasoning to extract {number}{category} "
+            "from the document.\nFormat the result in JSON:\n"
+        )
 
         if step["type"] == "table":
-            prompt_obj = "{\n"
-            for column in step["columns"]:
-                prompt_obj += (
-                    f'          "{column.lower()}": "Description of the field",\n'
-                )
-            prompt_obj += "        },\n"
-            prompt_obj += "        ...\n"
-
-            prompt += """
-            {
-              "%s": [
-                %s
-              ]
-            }
-            """ % (
-                step["category"],
-                prompt_obj,
+            fields = ",\n".join(
+                f'      "{column.lower()}": "Description of the field"'
+                for column in step["columns"]
+            )
+            prompt += (
+                f'{{\n  "{category}": [\n    {{\n{fields}\n    }},\n    ...\n  ]\n}}\n'
             )
             prompt += f"Use the following fields to describe the table: {', '.join(step['columns'])}\n"
         elif step["type"] == "list":
-            prompt += """
-                {
-                  "%s": [
-                    "description 1",
-                    "description 2",
-                    ...
-                  ]
-                }
-                """ % (
-                step["category"]
-            )
+            prompt += f'{{\n  "{category}": [\n    "description 1",\n    "description 2",\n    ...\n  ]\n}}\n'
         else:
-            prompt += """
-                {
-                  "%s": "Description of the field"
-                }
-                """ % (
-                step["category"]
-            )
+            prompt += f'{{\n  "{category}": "Description of the field"\n}}\n'
 
-        prompt += '\nIf no %s %s found, return {"%s": []}.\n' % (
-            step["category"],
+        prompt += 'If no %s %s found, return {"%s": []}.\n' % (
+            category,
             "is" if step["type"] == "text" else "are",
-            step["category"],
+            category,
         )
 
-        prompt += "Your entire response/output is going to consist of a single JSON object {}, and you will NOT wrap it within JSON markdown markers."
+        prompt += JSON_ONLY_INSTRUCTION
 
         return prompt
 
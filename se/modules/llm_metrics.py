@@ -0,0 +1,233 @@
+"""Time, token and cost accounting of the LLM and embedding calls."""
+
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from llama_index.core import Settings
+from llama_index.core.callbacks import CBEventType, EventPayload
+from llama_index.core.callbacks.base_handler import BaseCallbackHandler
+from llama_index.core.callbacks.token_counting import TokenCounter, get_llm_token_counts
+
+from se.modules.extractors import ExtractionStats
+from se.modules.prompt_context import count_tokens, get_tokenizer
+
+# Prices in USD per million tokens (input, output) as published by OpenAI.
+# Embedding models only have an input price.
+PRICES: Dict[str, Tuple[float, float]] = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+    "gpt-4.1-nano": (0.10, 0.40),
+    "gpt-4.1-mini": (0.40, 1.60),
+    "gpt-4.1": (2.00, 8.00),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "text-embedding-3-small": (0.02, 0.0),
+    "text-embedding-3-large": (0.13, 0.0),
+    "text-embedding-ada-002": (0.10, 0.0),
+}
+
+
+def model_price(model: str) -> Optional[Tuple[float, float]]:
+    """Return the price of the model, matching dated versions of known models.
+
+    :return: Input and output price per million tokens, None if unknown.
+    """
+    if model in PRICES:
+        return PRICES[model]
+    # e.g. gpt-4o-mini-2024-07-18, longest names first so gpt-4o-mini
+    # is not priced as gpt-4o
+    for name in sorted(PRICES, key=len, reverse=True):
+        if model.startswith(f"{name}-"):
+            return PRICES[name]
+    return None
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int = 0) -> float:
+    """Estimate the cost of a call in USD, 0 for models with no known price."""
+    price = model_price(model)
+    if price is None:
+        return 0.0
+    return (input_tokens * price[0] + output_tokens * price[1]) / 1_000_000
+
+
+@dataclass
+class CallMetrics:
+    """Metrics of a single call.
+
+    Times are in seconds. ``retrieval_time`` is part of ``wall_time``.
+    Token counts are those of the LLM and embedding calls (see
+    track_usage), estimated with the tokenizer of the model when no call
+    was seen.
+    """
+
+    name: str
+    kind: str
+    wall_time: float = 0.0
+    retrieval_time: float = 0.0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_tokens: int = 0
+    cost: float = 0.0
+    cached: bool = False
+
+
+@dataclass
+class TokenUsage:
+    """Tokens of the LLM and embedding calls made within track_usage.
+
+    The LLM tokens are the usage reported by the provider, counted with
+    the tokenizer of the model when the response has none.
+    """
+
+    model: str = ""
+    embedding_model: str = ""
+    llm_calls: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    embedding_calls: int = 0
+    embedding_tokens: int = 0
+
+
+_usage: ContextVar[Optional[TokenUsage]] = ContextVar("token_usage", default=None)
+
+
+class UsageHandler(BaseCallbackHandler):
+    """Adds the tokens of the LLM and embedding events to the current usage."""
+
+    def __init__(self):
+        super().__init__(event_starts_to_ignore=[], event_ends_to_ignore=[])
+
+    def on_event_start(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        parent_id: str = "",
+        **kwargs: Any,
+    ) -> str:
+        return event_id
+
+    def on_event_end(
+        self,
+        event_type: CBEventType,
+        payload: Optional[Dict[str, Any]] = None,
+        event_id: str = "",
+        **kwargs: Any,
+    ) -> None:
+        usage = _usage.get()
+        if usage is None or not payload:
+            return
+
+        if event_type == CBEventType.LLM:
+            counter = TokenCounter(tokenizer=get_tokenizer(usage.model))
+            counts = get_llm_token_counts(counter, payload, event_id)
+            usage.llm_calls += 1
+            usage.prompt_tokens += counts.prompt_token_count
+            usage.completion_tokens += counts.completion_token_count
+        elif event_type == CBEventType.EMBEDDING:
+            chunks = payload.get(EventPayload.CHUNKS) or []
+            usage.embedding_calls += 1
+            usage.embedding_tokens += sum(
+                count_tokens(chunk, usage.embedding_model) for chunk in chunks
+            )
+
+    def start_trace(self, trace_id: Optional[str] = None) -> None:
+        pass
+
+    def end_trace(
+        self,
+        trace_id: Optional[str] = None,
+        trace_map: Optional[Dict[str, List[str]]] = None,
+    ) -> None:
+        pass
+
+
+_handler = UsageHandler()
+
+
+def register_usage_handler():
+    """Add the usage handler to the callback manager of the llama-index settings.
+
+    The LLM and embedding models get the manager when read from the
+    settings, so the handler has to be added before the indexes and query
+    engines are built.
+    """
+    manager = Settings.callback_manager
+    if _handler not in manager.handlers:
+        manager.add_handler(_handler)
+
+
+@contextmanager
+def track_usage(model: str = "", embedding_model: str = "") -> Iterator[TokenUsage]:
+    """Count the tokens of the LLM and embedding calls made in the block.
+
+    Every asyncio task runs in a copy of the context, so the calls of
+    concurrent queries are counted apart.
+
+    :param model: Name of the LLM, for its tokenizer.
+    :param embedding_model: Name of the embedding model, for its tokenizer.
+    """
+    register_usage_handler()
+    usage = TokenUsage(model=model, embedding_model=embedding_model)
+    token = _usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _usage.reset(token)
+
+
+# Kinds of calls
+QUERY = "query"
+INDEX = "index"
+
+_TOTALS = (
+    "wall_time",
+    "retrieval_time",
+    "prompt_tokens",
+    "completion_tokens",
+    "embedding_tokens",
+    "cost",
+)
+
+
+class RunMetrics:
+    """Calls of an analysis run, recorded from any thread."""
+
+    def __init__(self):
+        self.calls: List[CallMetrics] = []
+        # Wall time of the whole run, shorter than the sum of the call times
+        # when queries run concurrently.
+        self.elapsed = 0.0
+        # Metrics of the ingestion pipeline stages, see LlamaAnalyzer.ingest
+        self.ingestion: Optional[dict] = None
+        # Categories answered by rules instead of the LLM, see
+        # LlamaAnalyzer.record_extraction
+        self.pre_extraction = ExtractionStats()
+        self._lock = threading.Lock()
+
+    def record(self, call: CallMetrics):
+        with self._lock:
+            self.calls.append(call)
+
+    def totals(self) -> dict:
+        """Return the sums of the call metrics and the number of calls."""
+        with self._lock:
+            calls = list(self.calls)
+
+        totals = {name: sum(getattr(call, name) for call in calls) for name in _TOTALS}
+        totals["calls"] = len(calls)
+        totals["cached_calls"] = sum(call.cached for call in calls)
+        return totals
+
+    def as_dict(self) -> dict:
+        with self._lock:
+            calls = [asdict(call) for call in self.calls]
+        metrics = {"elapsed": self.elapsed, "totals": self.totals(), "calls": calls}
+        if self.ingestion is not None:
+            metrics["ingestion"] = self.ingestion
+        pre_extraction = self.pre_extraction.skip_rates()
+        if pre_extraction:
+            metrics["pre_extraction"] = pre_extraction
+        return metrics
@@ -0,0 +1,449 @@
+"""OCR of image-based PDF pages with a local tesseract binary."""
+
+import glob
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional, Union
+
+from pypdf.generic import ArrayObject
+
+from se.pdftools import PDFDocument
+from se.utils import is_tool_available
+
+logger = logging.getLogger(__name__)
+
+TESSERACT_COMMAND = "tesseract"
+
+# Filters whose decoded data is already an image file tesseract can read
+# (pypdf wraps CCITT data into a TIFF container).
+_ENCODED_IMAGE_FILTERS = frozenset(("/DCTDecode", "/JPXDecode", "/CCITTFaxDecode"))
+
+# Maximum nesting of form XObjects searched for images.
+_MAX_FORM_DEPTH = 3
+
+
+def _image_filter(xobject) -> Optional[str]:
+    """Return the last filter of an image, the one defining its format."""
+    filters = xobject.get("/Filter")
+    if isinstance(filters, ArrayObject):
+        return filters[-1] if filters else None
+    return filters
+
+
+def encode_image(xobject) -> Optional[bytes]:
+    """Return an image XObject as a file tesseract can read.
+
+    JPEG, JPEG 2000 and CCITT images are passed as is. Uncompressed 8-bit
+    gray and RGB samples and 1-bit masks are wrapped into a PNM header.
+
+    :param xobject: The image XObject stream.
+    :return: The image file content, None if the image format is not supported.
+    """
+    try:
+        data = xobject.get_data()
+    except Exception as e:
+        logger.debug(f"Unable to decode image: {e}")
+        return None
+
+    if _image_filter(xobject) in _ENCODED_IMAGE_FILTERS:
+        return data
+
+    width = int(xobject.get("/Width", 0))
+    height = int(xobject.get("/Height", 0))
+    colorspace = xobject.get("/ColorSpace")
+    if xobject.get("/ImageMask"):
+        bits, colorspace = 1, "/DeviceGray"
+    else:
+        bits = int(xobject.get("/BitsPerComponent", 8))
+
+    if bits == 8 and colorspace == "/DeviceGray":
+        magic, size = b"P5", width * height
+    elif bits == 8 and colorspace == "/DeviceRGB":
+        magic, size = b"P6", width * height * 3
+    elif bits == 1 and colorspace == "/DeviceGray":
+        magic, size = b"P4", (width + 7) // 8 * height
+        # In PBM 1 is black, in PDF gray and stencil masks 0 is black
+        data = bytes(byte ^ 0xFF for byte in data[:size])
+    else:
+        return None
+
+    if not width or not height or len(data) < size:
+        return None
+
+    header = magic + b"\n%d %d\n" % (width, height)
+    if magic != b"P4":
+        header += b"255\n"
+    return header + data[:size]
+
+
+def page_images(page) -> List[bytes]:
+    """Return the images painted on a page, encoded for tesseract.
+
+    Images of form XObjects are included. Images in unsupported formats
+    are skipped.
+    """
+    images = []
+    seen = set()
+
+    def collect(resources, depth):
+        if resources is None or depth > _MAX_FORM_DEPTH:
+            return
+        xobjects = resources.get_object().get("/XObject")
+        if xobjects is None:
+            return
+
+        xobjects = xobjects.get_object()
+        for name in sorted(xobjects):
+            reference = xobjects.raw_get(name)
+            key = getattr(reference, "idnum", None)
+            if key is not None:
+                if key in seen:
+                    continue
+                seen.add(key)
+
+            xobject = reference.get_object()
+            subtype = xobject.get("/Subtype")
+            if subtype == "/Image":
+                image = encode_image(xobject)
+                if image is not None:
+                    images.append(image)
+            elif subtype == "/Form":
+                collect(xobject.get("/Resources"), depth + 1)
+
+    collect(page.get("/Resources"), 0)
+    return images
+
+
+class OCRCache:
+    """On-disk cache of recognised page text, keyed by content hash.
+
+    Entries are stored as ``<directory>/<key[:2]>/<key>.txt`` and written
+    atomically, so concurrent uploads may share the cache.
+    """
+
+    def __init__(self, directory: Union[str, Path]):
+        self.directory = Path(directory)
+
+    def _path(self, key: str) -> Path:
+        return self.directory / key[:2] / f"{key}.txt"
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached text or None on a cache miss."""
+        try:
+            return self._path(key).read_text(encoding="utf-8")
+        except OSError:
+            return None
+
+    def set(self, key: str, text: str):
+        """Store the text for the given key."""
+        path = self._path(key)
+        try:
+            path.parent.mkdir(parents=True, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(text)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"Unable to write OCR cache entry {path}: {e}")
+
+
+@dataclass
+class OCRStats:
+    """Cumulative statistics of an OCR pool."""
+
+    pages: int = 0
+    cache_hits: int = 0
+    failures: int = 0
+    elapsed: float = 0.0
+    queue_depth: int = 0
+    max_queue_depth: int = 0
+
+    @property
+    def pages_per_second(self) -> float:
+        """Pages recognised by tesseract per second of OCR wall time."""
+        return self.pages / self.elapsed if self.elapsed else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "pages": self.pages,
+            "cache_hits": self.cache_hits,
+            "failures": self.failures,
+            "elapsed": round(self.elapsed, 3),
+            "pages_per_second": round(self.pages_per_second, 3),
+            "queue_depth": self.queue_depth,
+            "max_queue_depth": self.max_queue_depth,
+        }
+
+
+class OCRPool:
+    """A bounded pool of tesseract subprocesses.
+
+    At most ``workers`` tesseract processes run at a time, whatever the
+    number of concurrent callers. Each process is limited to a single
+    OpenMP thread, so the pool size is the number of cores used by OCR.
+
+    :param workers: Number of concurrent tesseract processes.
+    :param cache: Cache of recognised text, None disables caching.
+    :param language: Tesseract language(s), e.g. "eng" or "eng+deu".
+    :param timeout: Time budget per image in seconds.
+    :param command: Tesseract executable.
+    """
+
+    def __init__(
+        self,
+        workers: int = 1,
+        cache: Optional[OCRCache] = None,
+        language: str = "eng",
+        timeout: Optional[float] = None,
+        command: str = TESSERACT_COMMAND,
+    ):
+        self.workers = max(1, workers)
+        self.cache = cache
+        self.language = language
+        self.timeout = timeout
+        self.command = command
+        self.stats = OCRStats()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=self.workers, thread_name_prefix="ocr"
+        )
+
+    def shutdown(self):
+        """Wait for running jobs and stop the pool."""
+        self._executor.shutdown(wait=True)
+
+    def _cache_key(self, images: List[bytes]) -> str:
+        sha256_hash = hashlib.sha256(self.language.encode())
+        for image in images:
+            sha256_hash.update(b"\0")
+            sha256_hash.update(hashlib.sha256(image).digest())
+        return sha256_hash.hexdigest()
+
+    def _run_tesseract(self, image: bytes) -> str:
+        """Recognise a single image, raise on tesseract errors."""
+        completed = subprocess.run(
+            [self.command, "stdin", "stdout", "-l", self.language],
+            input=image,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+            timeout=self.timeout,
+            env=dict(os.environ, OMP_THREAD_LIMIT="1"),
+            check=True,
+        )
+        return completed.stdout.decode("utf-8", errors="replace").strip()
+
+    def _recognize(self, images: List[bytes]) -> Optional[str]:
+        """Recognise the images of a page, None if tesseract failed."""
+        with self._lock:
+            self.stats.queue_depth -= 1
+        try:
+            return "\n".join(self._run_tesseract(image) for image in images)
+        except (OSError, subprocess.SubprocessError) as e:
+            logger.warning(f"OCR failed: {e}")
+            return None
+
+    def recognize_pages(
+        self, pdf_path: Union[str, Path], indices: Iterable[int]
+    ) -> Dict[int, str]:
+        """Recognise the text of the given pages of a PDF file.
+
+        :param pdf_path: Path to the PDF file.
+        :param indices: 0-based indices of the pages to recognise.
+        :return: The recognised text by page index. Pages without supported
+                 images or on which tesseract failed are omitted.
+        """
+        indices = sorted(set(indices))
+        if not indices:
+            return {}
+
+        started = time.perf_counter()
+        texts, futures = {}, {}
+        hits = 0
+
+        with PDFDocument(pdf_path) as document:
+            wanted = set(indices)
+            for index, page in document.iter_pages(indices[0], indices[-1] + 1):
+                if index not in wanted:
+                    continue
+
+                images = page_images(page)
+                if not images:
+                    continue
+
+                key = self._cache_key(images)
+                text = self.cache.get(key) if self.cache else None
+                if text is not None:
+                    texts[index] = text
+                    hits += 1
+                    continue
+
+                with self._lock:
+                    self.stats.queue_depth += 1
+                    self.stats.max_queue_depth = max(
+                        self.stats.max_queue_depth, self.stats.queue_depth
+                    )
+                futures[index] = (key, self._executor.submit(self._recognize, images))
+
+        failures = 0
+        for index, (key, future) in futures.items():
+            text = future.result()
+            if text is None:
+                failures += 1
+                continue
+
+            texts[index] = text
+            if self.cache:
+                self.cache.set(key, text)
+
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            self.stats.pages += len(futures) - failures
+            self.stats.cache_hits += hits
+            self.stats.failures += failures
+            if futures:
+                self.stats.elapsed += elapsed
+
+        logger.info(
+            f"OCR of {pdf_path}: {len(futures)} pages in {elapsed:.2f}s, "
+            f"{hits} cached, {failures} failed "
+            f"(pool: {self.stats.pages_per_second:.2f} pages/s, "
+            f"max queue depth {self.stats.max_queue_depth})"
+        )
+        return texts
+
+
+_pool: Optional[OCRPool] = None
+_pool_lock = threading.Lock()
+_tesseract_available: Optional[bool] = None
+
+
+def get_ocr_pool(config) -> Optional[OCRPool]:
+    """Return the process-wide OCR pool.
+
+    The pool is created on first use from the application config.
+
+    :param config: The application config.
+    :return: The OCR pool, None if OCR is disabled or tesseract is missing.
+    """
+    global _pool, _tesseract_available
+
+    if not config.get("OCR_ENABLED", True):
+        return None
+
+    with _pool_lock:
+        if _pool is not None:
+            return _pool
+
+        if _tesseract_available is None:
+            _tesseract_available = is_tool_available(TESSERACT_COMMAND)
+            if not _tesseract_available:
+                logger.warning(
+                    "tesseract is not available, image-based pages won't be OCRed"
+                )
+        if not _tesseract_available:
+            return None
+
+        cache_dir = config.get("OCR_CACHE_DIR")
+        _pool = OCRPool(
+            workers=config.get("OCR_WORKERS", 1),
+            cache=OCRCache(cache_dir) if cache_dir else None,
+            language=config.get("OCR_LANGUAGE", "eng"),
+            timeout=config.get("OCR_TIMEOUT"),
+        )
+        return _pool
+
+
+# Statistics of the OCR pools exported for Prometheus: key in
+# OCRStats.as_dict, metric name, type and help.
+_EXPORTED_STATS = (
+    ("pages", "se_ocr_pages_total", "counter", "Pages recognised by tesseract."),
+    ("cache_hits", "se_ocr_cache_hits_total", "counter", "Pages read from the cache."),
+    ("failures", "se_ocr_failures_total", "counter", "Pages tesseract failed on."),
+    ("elapsed", "se_ocr_seconds_total", "counter", "Wall time of the OCR."),
+    (
+        "pages_per_second",
+        "se_ocr_pages_per_second",
+        "gauge",
+        "Pages recognised per second of OCR wall time.",
+    ),
+    ("queue_depth", "se_ocr_queue_depth", "gauge", "Pages waiting for tesseract."),
+    (
+        "max_queue_depth",
+        "se_ocr_max_queue_depth",
+        "gauge",
+        "Most pages waiting for tesseract at once.",
+    ),
+)
+
+
+def _stats_dir(config) -> str:
+    return os.path.join(config.get("STORAGE_DIR", "storage"), "ocr_stats")
+
+
+def save_ocr_stats(config, name: str):
+    """Store the statistics of the OCR pool of the process, if any.
+
+    The pages are OCRed by the workers, the statistics of their pools are
+    exported by the web processes (see export_ocr_stats).
+
+    :param config: The application config.
+    :param name: Name of the process, e.g. the name of the worker.
+    """
+    with _pool_lock:
+        pool = _pool
+    if pool is None:
+        return
+    with pool._lock:
+        stats = pool.stats.as_dict()
+
+    directory = _stats_dir(config)
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(
+        "w", dir=directory, suffix=".tmp", delete=False
+    ) as f:
+        json.dump(stats, f)
+    os.replace(f.name, os.path.join(directory, f"{name}.json"))
+
+
+def remove_ocr_stats(config, name: str):
+    """Remove the statistics stored by a process, e.g. a stopped worker."""
+    path = os.path.join(_stats_dir(config), f"{name}.json")
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def export_ocr_stats(config) -> str:
+    """Export the statistics of the OCR pools stored by the workers.
+
+    :param config: The application config.
+    :return: The metrics in the Prometheus text format, labelled by worker,
+             empty if no worker has an OCR pool.
+    """
+    pools = {}
+    for path in sorted(glob.glob(os.path.join(_stats_dir(config), "*.json"))):
+        try:
+            with open(path) as f:
+                pools[os.path.basename(path)[: -len(".json")]] = json.load(f)
+        except (OSError, ValueError):
+            # Removed by its worker meanwhile
+            continue
+    if not pools:
+        return ""
+
+    lines = []
+    for key, metric, kind, description in _EXPORTED_STATS:
+        lines += [f"# HELP {metric} {description}", f"# TYPE {metric} {kind}"]
+        lines += [
+            f'{metric}{{worker="{name}"}} {stats.get(key, 0)}'
+            for name, stats in pools.items()
+        ]
+    return "\n".join(lines) + "\n"
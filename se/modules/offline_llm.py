@@ -0,0 +1,380 @@
+"""Offline LLM backends for load tests, profiling and CI.
+
+Two backends stand in for the OpenAI LLM (see ``configure_ai``):
+
+- ``ReplayLLM`` answers with the responses recorded by the JSONLCollector
+  of LlamaAnalyzer (storage/data/llm_responses.jsonl), matched by prompt.
+- ``SyntheticLLM`` makes up schema-valid JSON for the analysis prompts.
+
+Both simulate the provider with a configurable latency distribution and
+injected errors.
+"""
+
+import asyncio
+import difflib
+import hashlib
+import json
+import logging
+import random
+import re
+import time
+from abc import abstractmethod
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple, Union
+
+from llama_index.core.llms import (
+    CompletionResponse,
+    CompletionResponseGen,
+    CustomLLM,
+    LLMMetadata,
+)
+from llama_index.core.llms.callbacks import llm_completion_callback
+from pydantic import PrivateAttr
+
+from se.modules.prompt_context import EXTRACTED_CONTEXT
+
+logger = logging.getLogger(__name__)
+
+# Query engine templates wrapping the prompts of LlamaAnalyzer.
+_QUERY_RES = (
+    re.compile(r"\nQuery: (?P<query>.*)\nAnswer: ?$", re.DOTALL),
+    re.compile(
+        r"^The original query is as follows: (?P<query>.*)\n"
+        r"We have provided an existing answer:",
+        re.DOTALL,
+    ),
+)
+
+
+class OfflineLLMError(RuntimeError):
+    """An error injected by an offline backend, mimicking a provider error."""
+
+
+def extract_query(prompt: str) -> str:
+    """Return the query wrapped by the query engine templates, if any."""
+    for query_re in _QUERY_RES:
+        match = query_re.search(prompt)
+        if match:
+            return match.group("query").strip()
+    return prompt.strip()
+
+
+def _prompt_hash(prompt: str) -> str:
+    return hashlib.sha256(prompt.strip().encode("utf-8")).hexdigest()
+
+
+def parse_latency(spec: str) -> Callable[[random.Random], float]:
+    """Parse a latency distribution, in seconds.
+
+    Supported specifications are "fixed:S", "uniform:MIN,MAX",
+    "normal:MEAN,STDDEV" and "lognormal:MU,SIGMA" (parameters of the
+    underlying normal distribution). An empty string means no latency.
+
+    :raise ValueError: If the specification is not valid.
+    """
+    if not spec or not spec.strip():
+        return lambda rng: 0.0
+
+    name, _, args = spec.strip().partition(":")
+    try:
+        params = [float(arg) for arg in args.split(",")] if args else []
+    except ValueError:
+        raise ValueError(f"Invalid latency parameters: {spec}") from None
+
+    distributions = {
+        "fixed": (1, lambda rng, s: s),
+        "uniform": (2, lambda rng, a, b: rng.uniform(a, b)),
+        "normal": (2, lambda rng, mu, sigma: rng.gauss(mu, sigma)),
+        "lognormal": (2, lambda rng, mu, sigma: rng.lognormvariate(mu, sigma)),
+    }
+    if name not in distributions or len(params) != distributions[name][0]:
+        raise ValueError(f"Invalid latency distribution: {spec}")
+
+    sample = distributions[name][1]
+    return lambda rng: max(0.0, sample(rng, *params))
+
+
+def _synthetic_value(key: str, kind: str, fields: List[str]) -> Any:
+    def field_value(field: str) -> str:
+        if "date" in field:
+            return "2025-01-01"
+        if field == "page":
+            return "1"
+        if field == "signed":
+            return "No"
+        return f"Synthetic {field.replace('_', ' ')}"
+
+    if kind == "table":
+        return [{field: field_value(field) for field in fields} for _ in range(2)]
+    if kind == "list":
+        return [f"Synthetic {key.replace('_', ' ')} {i}" for i in (1, 2)]
+    return field_value(key)
+
+
+def _template_schema(text: str) -> Optional[Tuple[str, str, List[str]]]:
+    """Find the JSON template of a prompt: its key, kind and table fields."""
+    match = re.search(r'\{\s*"(\w+)"\s*:\s*(\[\s*\{|\[|")', text)
+    if match is None:
+        return None
+
+    key, opening = match.group(1), match.group(2)
+    if opening == '"':
+        return key, "text", []
+    if not opening.endswith("{"):
+        return key, "list", []
+
+    row = text[match.end() : text.find("}", match.end())]
+    return key, "table", re.findall(r'"(\w+)"\s*:', row)
+
+
+def synthesize_response(query: str) -> dict:
+    """Make up a schema-valid response to an analysis prompt."""
+    query = query.split(EXTRACTED_CONTEXT)[0]
+
+    if '"analysis_steps"' in query and '"applicable"' in query:
+        return {
+            "document_type": "Purchase Agreement",
+            "analysis_steps": [
+                {
+                    "category": "obligations",
+                    "applicable": True,
+                    "type": "table",
+                    "columns": ["Party", "Obligation"],
+                    "reason": "Synthetic step.",
+                },
+                {
+                    "category": "risks",
+                    "applicable": True,
+                    "type": "list",
+                    "reason": "Synthetic step.",
+                },
+                {
+                    "category": "dates",
+                    "applicable": True,
+                    "type": "table",
+                    "columns": ["Date", "Details"],
+                    "reason": "Synthetic step.",
+                },
+                {
+                    "category": "signature_fields",
+                    "applicable": True,
+                    "type": "table",
+                    "columns": ["Field type", "Party", "Page", "Signed"],
+                    "reason": "Synthetic step.",
+                },
+            ],
+        }
+
+    if '"missing_data"' in query:
+        return {"categories": {}, "missing_data": {}}
+
+    # Several categories packed in a single prompt
+    batch = re.search(r"exactly these keys: ([\w, ]+)\.", query)
+    if batch:
+        result = {}
+        for key in (k.strip() for k in batch.group(1).split(",")):
+            section = re.search(rf"### {key}\n(.*?)(?=\n### |\Z)", query, re.DOTALL)
+            schema = _template_schema(section.group(1)) if section else None
+            kind, fields = (schema[1], schema[2]) if schema else ("text", [])
+            result[key] = _synthetic_value(key, kind, fields)
+        return result
+
+    schema = _template_schema(query)
+    if schema is None:
+        return {"result": "Synthetic response"}
+
+    key, kind, fields = schema
+    return {key: _synthetic_value(key, kind, fields)}
+
+
+class _OfflineLLM(CustomLLM):
+    """Base class simulating provider latency and errors.
+
+    Subclasses implement :meth:`_respond`.
+
+    :param latency: Latency distribution, see :func:`parse_latency`.
+    :param error_rate: Probability of raising an OfflineLLMError.
+    :param malformed_rate: Probability of returning truncated JSON.
+    :param seed: Seed of the random generator, for reproducible runs.
+    """
+
+    latency: str = ""
+    error_rate: float = 0.0
+    malformed_rate: float = 0.0
+    seed: Optional[int] = None
+    model_name: str = "offline"
+
+    _random: random.Random = PrivateAttr()
+    _sample_latency: Callable[[random.Random], float] = PrivateAttr()
+
+    def __init__(self, **kwargs: Any):
+        super().__init__(**kwargs)
+        self._random = random.Random(self.seed)
+        self._sample_latency = parse_latency(self.latency)
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata(model_name=self.model_name, is_chat_model=False)
+
+    @abstractmethod
+    def _respond(self, prompt: str) -> str:
+        """Return the response text to a prompt."""
+
+    def _draw(self) -> Tuple[float, bool, bool]:
+        """Draw the latency and whether to fail or to corrupt the response."""
+        rng = self._random
+        return (
+            self._sample_latency(rng),
+            rng.random() < self.error_rate,
+            rng.random() < self.malformed_rate,
+        )
+
+    def _finish(self, prompt: str, fail: bool, malformed: bool) -> CompletionResponse:
+        if fail:
+            raise OfflineLLMError(
+                self._random.choice(
+                    (
+                        "Rate limit reached (injected error)",
+                        "Request timed out (injected error)",
+                        "The server had an error (injected error)",
+                    )
+                )
+            )
+
+        text = self._respond(prompt)
+        if malformed:
+            text = text[: len(text) // 2]
+        return CompletionResponse(text=text)
+
+    @llm_completion_callback()
+    def complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        delay, fail, malformed = self._draw()
+        time.sleep(delay)
+        return self._finish(prompt, fail, malformed)
+
+    @llm_completion_callback()
+    async def acomplete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponse:
+        delay, fail, malformed = self._draw()
+        await asyncio.sleep(delay)
+        return self._finish(prompt, fail, malformed)
+
+    @llm_completion_callback()
+    def stream_complete(
+        self, prompt: str, formatted: bool = False, **kwargs: Any
+    ) -> CompletionResponseGen:
+        response = self.complete(prompt, formatted=formatted, **kwargs)
+        yield CompletionResponse(text=response.text, delta=response.text)
+
+
+class SyntheticLLM(_OfflineLLM):
+    """Answer the analysis prompts with made-up, schema-valid JSON."""
+
+    model_name: str = "synthetic"
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "synthetic_llm"
+
+    def _respond(self, prompt: str) -> str:
+        return json.dumps(synthesize_response(extract_query(prompt)))
+
+
+class ReplayLLM(_OfflineLLM):
+    """Replay responses recorded by the JSONLCollector of LlamaAnalyzer.
+
+    A prompt is matched by the hash of its query first, then by the most
+    similar recorded prompt with a similarity of at least
+    ``fuzzy_threshold``. Unmatched prompts get a synthetic response.
+
+    :param records_path: JSONL file written by the JSONLCollector.
+    :param fuzzy_threshold: Minimum similarity ratio of a fuzzy match.
+    """
+
+    records_path: str = ""
+    fuzzy_threshold: float = 0.6
+    model_name: str = "replay"
+
+    _responses: Dict[str, str] = PrivateAttr(default_factory=dict)
+    _prompts: Dict[str, str] = PrivateAttr(default_factory=dict)
+
+    def __init__(self, records_path: Union[str, Path], **kwargs: Any):
+        super().__init__(records_path=str(records_path), **kwargs)
+        self._load()
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "replay_llm"
+
+    def _load(self):
+        path = Path(self.records_path)
+        if not path.is_file():
+            logger.warning(f"No recorded LLM responses in {path}")
+            return
+
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    data = json.loads(line)["data"]
+                    prompt, response = data["prompt"], data["response"]
+                except (json.JSONDecodeError, KeyError, TypeError):
+                    continue
+                if not isinstance(prompt, str) or response is None:
+                    continue
+
+                # The last recording of a prompt wins
+                digest = _prompt_hash(prompt)
+                self._responses[digest] = json.dumps(response)
+                self._prompts[digest] = prompt
+
+        logger.info(f"Loaded {len(self._responses)} recorded LLM responses")
+
+    def match(self, query: str) -> Optional[str]:
+        """Return the recorded response for the query, None if not found."""
+        response = self._responses.get(_prompt_hash(query))
+        if response is not None:
+            return response
+
+        best, best_ratio = None, self.fuzzy_threshold
+        for digest, prompt in self._prompts.items():
+            matcher = difflib.SequenceMatcher(None, query, prompt, autojunk=False)
+            if matcher.real_quick_ratio() < best_ratio:
+                continue
+            if matcher.quick_ratio() < best_ratio:
+                continue
+            ratio = matcher.ratio()
+            if ratio >= best_ratio:
+                best, best_ratio = digest, ratio
+
+        return self._responses[best] if best else None
+
+    def _respond(self, prompt: str) -> str:
+        query = extract_query(prompt)
+        response = self.match(query)
+        if response is None:
+            logger.warning("No recorded response matches the prompt, synthesizing")
+            response = json.dumps(synthesize_response(query))
+        return response
+
+
+def create_offline_llm(backend: str, config) -> _OfflineLLM:
+    """Create the offline LLM backend selected in the application config.
+
+    :param backend: "replay" or "synthetic".
+    :param config: The application config.
+    :raise ValueError: If the backend is unknown.
+    """
+    options = {
+        "latency": config.get("LLM_OFFLINE_LATENCY", ""),
+        "error_rate": config.get("LLM_OFFLINE_ERROR_RATE", 0.0),
+        "malformed_rate": config.get("LLM_OFFLINE_MALFORMED_RATE", 0.0),
+        "seed": config.get("LLM_OFFLINE_SEED"),
+    }
+    if backend == "synthetic":
+        return SyntheticLLM(**options)
+    if backend == "replay":
+        return ReplayLLM(config.get("LLM_REPLAY_FILE"), **options)
+    raise ValueError(f"Unknown LLM backend: {backend}")
@@ -0,0 +1,164 @@
+"""Token accounting and compaction of the context of chained prompts."""
+
+import functools
+import json
+import logging
+import re
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Iterable, List
+
+from llama_index.core import Settings
+
+logger = logging.getLogger(__name__)
+
+# Introduces the responses of earlier steps in a prompt (the offline LLMs
+# rely on it to tell the prompt from its context).
+EXTRACTED_CONTEXT = "\nThe following information have been already extracted:\n"
+
+
+@functools.lru_cache(maxsize=None)
+def get_tokenizer(model: str = "") -> Callable[[str], List[int]]:
+    """Return the tokenizer of the model, the llama-index one if unknown."""
+    if model:
+        try:
+            import tiktoken
+
+            return tiktoken.encoding_for_model(model).encode
+        except Exception as e:
+            # Unknown model, or its encoding can't be downloaded
+            logger.debug(f"No tiktoken encoding for {model}: {e}")
+    # The encoding bundled with llama-index (cl100k_base)
+    return Settings.tokenizer
+
+
+def count_tokens(text: str, model: str = "") -> int:
+    """Count the tokens of a text with the tokenizer of the model."""
+    return len(get_tokenizer(model)(text)) if text else 0
+
+
+def normalize_prompt(prompt: str) -> str:
+    """Normalize the whitespace of a prompt.
+
+    Trailing whitespace, runs of spaces within lines and repeated blank
+    lines are removed. Indentation is kept, as it structures the JSON
+    templates.
+    """
+    lines = []
+    for line in prompt.splitlines():
+        indent = line[: len(line) - len(line.lstrip())]
+        lines.append(indent + re.sub(r"\s+", " ", line.strip()))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+
+def _fits(values: dict, cap: int, model: str) -> bool:
+    return count_tokens(dump_context(values), model) <= cap
+
+
+def dump_context(values: dict) -> str:
+    """Serialize context values as compact JSON."""
+    return json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+
+
+def compact_context(
+    responses: Dict[str, str], fields: Iterable[str], cap: int, model: str = ""
+) -> dict:
+    """Keep the fields of the responses needed by a prompt, within a token cap.
+
+    The responses are JSON objects by step. Fields are added in the given
+    order: a list is cut to the items that fit and a value that doesn't fit
+    at all is left out, so the context never exceeds ``cap`` tokens.
+
+    :param responses: JSON responses of the earlier steps.
+    :param fields: Fields needed by the prompt, in priority order.
+    :param cap: Maximum number of tokens of the serialized context.
+    :param model: Name of the LLM, selects the tokenizer.
+    """
+    available = {}
+    for response in responses.values():
+        try:
+            data = json.loads(response) if response else None
+        except json.JSONDecodeError:
+            continue
+        if isinstance(data, dict):
+            available.update(data)
+
+    context = {}
+    for name in fields:
+        value = available.get(name)
+        if value in (None, "", [], "Unknown"):
+            continue
+
+        if not isinstance(value, list):
+            if _fits({**context, name: value}, cap, model):
+                context[name] = value
+            continue
+
+        items = []
+        for item in value:
+            if not _fits({**context, name: items + [item]}, cap, model):
+                break
+            items.append(item)
+        if items:
+            context[name] = items
+
+    return context
+
+
+@dataclass
+class PromptTokens:
+    """Prompt tokens of a run, before and after compaction by prompt."""
+
+    before: Dict[str, int] = field(default_factory=dict)
+    after: Dict[str, int] = field(default_factory=dict)
+
+    def record(self, key: str, before: int, after: int):
+        self.before[key] = self.before.get(key, 0) + before
+        self.after[key] = self.after.get(key, 0) + after
+
+    @property
+    def total_before(self) -> int:
+        return sum(self.before.values())
+
+    @property
+    def total_after(self) -> int:
+        return sum(self.after.values())
+
+    @property
+    def saved_ratio(self) -> float:
+        before = self.total_before
+        return 1 - self.total_after / before if before else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            "before": self.total_before,
+            "after": self.total_after,
+            "saved_ratio": self.saved_ratio,
+            "prompts": {
+                key: {"before": self.before[key], "after": self.after[key]}
+                for key in self.before
+            },
+        }
+
+
+def legacy_context(responses: Dict[str, str]) -> str:
+    """Context formerly appended to a prompt: every earlier raw response."""
+    if not responses:
+        return ""
+    return EXTRACTED_CONTEXT + "".join(f"{r}\n" for r in responses.values())
+
+
+def context_prompt(
+    prompt: str,
+    responses: Dict[str, str],
+    fields: Iterable[str],
+    cap: int,
+    model: str = "",
+) -> str:
+    """Append the compacted context of the earlier responses to a prompt.
+
+    A cap of 0 appends no context.
+    """
+    context = compact_context(responses, fields, cap, model) if cap else {}
+    if not context:
+        return prompt
+    return f"{prompt}{EXTRACTED_CONTEXT}{dump_context(context)}\n"
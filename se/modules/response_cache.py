@@ -0,0 +1,207 @@
+"""Persistent cache of LLM responses."""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from pathlib import Path
+from typing import Optional, Union
+
+logger = logging.getLogger(__name__)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    response TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    accessed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS ix_responses_accessed_at ON responses (accessed_at);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+"""
+
+_COUNTERS = ("hits", "misses", "expired", "evictions")
+
+
+def cache_key(content_hash: str, prompt: str, model: str, retrieval: dict) -> str:
+    """Build the cache key of a query.
+
+    :param content_hash: SHA-256 of the document content.
+    :param prompt: The prompt sent to the query engine.
+    :param model: Name of the LLM.
+    :param retrieval: Retrieval settings of the query engine.
+    """
+    payload = json.dumps(
+        [
+            content_hash,
+            hashlib.sha256(prompt.encode("utf-8")).hexdigest(),
+            model,
+            retrieval,
+        ],
+        sort_keys=True,
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """LLM responses stored in an SQLite file.
+
+    Entries expire ``ttl`` seconds after they are stored. When the responses
+    exceed ``max_bytes``, the least recently used ones are evicted. Hit and
+    miss counters are stored in the same file, so they add up across
+    processes and restarts.
+
+    :param path: Path to the SQLite file.
+    :param ttl: Time to live of the entries in seconds, 0 never expires.
+    :param max_bytes: Maximum total size of the responses in bytes.
+    """
+
+    def __init__(
+        self,
+        path: Union[str, Path],
+        ttl: float = 30 * 24 * 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        self.path = Path(path)
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, isolation_level=None
+        )
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
+
+    def _count(self, name: str):
+        self._connection.execute(
+            "INSERT INTO counters (name, value) VALUES (?, 1) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + 1",
+            (name,),
+        )
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached response, None on a miss or an expired entry."""
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is not None and self.ttl and row[1] + self.ttl < now:
+                self._connection.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._count("expired")
+                row = None
+
+            if row is None:
+                self._count("misses")
+                return None
+
+            self._connection.execute(
+                "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+            self._count("hits")
+            return row[0]
+
+    def set(self, key: str, response: str):
+        """Store the response and evict entries over the size budget."""
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+
+    def _evict(self, now: float):
+        if self.ttl:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (now - self.ttl,)
+            )
+
+        (total,) = self._connection.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM responses"
+        ).fetchone()
+        if total <= self.max_bytes:
+            return
+
+        rows = self._connection.execute(
+            "SELECT key, size FROM responses ORDER BY accessed_at"
+        ).fetchall()
+        evicted = []
+        for key, size in rows:
+            if total <= self.max_bytes:
+                break
+            evicted.append((key,))
+            total -= size
+
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        self._connection.execute(
+            "INSERT INTO counters (name, value) VALUES ('evictions', ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            (len(evicted),),
+        )
+        logger.debug(f"Evicted {len(evicted)} cached LLM responses")
+
+    def clear(self):
+        """Remove all the entries and reset the counters."""
+        with self._lock:
+            self._connection.execute("DELETE FROM responses")
+            self._connection.execute("DELETE FROM counters")
+
+    def stats(self) -> dict:
+        """Return the number and size of the entries and the counters."""
+        with self._lock:
+            entries, size = self._connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+            counters = dict(
+                self._connection.execute("SELECT name, value FROM counters")
+            )
+
+        stats = {"entries": entries, "size": size}
+        stats.update({name: counters.get(name, 0) for name in _COUNTERS})
+        # An expired entry is also counted as a miss
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_ratio"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def get_response_cache(config) -> Optional[ResponseCache]:
+    """Return the process-wide response cache configured for the application.
+
+    :param config: The application config.
+    :return: The cache, None if it is disabled.
+    """
+    if not config.get("LLM_CACHE_ENABLED", True):
+        return None
+
+    path = config.get("LLM_CACHE_PATH") or os.path.join(
+        config.get("STORAGE_DIR") or "storage", "llm_cache.sqlite3"
+    )
+    with _caches_lock:
+        if path not in _caches:
+            _caches[path] = ResponseCache(
+                path,
+                ttl=config.get("LLM_CACHE_TTL", 30 * 24 * 3600),
+                max_bytes=config.get("LLM_CACHE_MAX_BYTES", 64 * 1024 * 1024),
+            )
+        return _caches[path]
@@ -1,10 +1,21 @@
 import hashlib
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
 from dataclasses import dataclass
-from datetime import datetime
+from typing import BinaryIO, Callable, Iterator, Optional, Tuple
 
 from werkzeug.datastructures.file_storage import FileStorage
 
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+# Serializes the stores and the deletes of the threads, flock the processes
+_store_lock = threading.Lock()
+
 
 @dataclass
 class UploadFileInfo:
@@ -13,39 +24,231 @@ class UploadFileInfo:
     content_length: int
     filename: str
     sha256_content: str
+    # False if the content was already stored by an earlier upload
+    created: bool = True
+    # Copy of a content already stored, kept until the upload holds a
+    # reference to the content, see UploadManager.settle
+    copy_path: Optional[str] = None
+
+
+def content_filename(sha256_content: str, extension: str = "") -> str:
+    """Return the path of a content relative to the upload folder.
+
+    Contents are sharded by the first two bytes of their hash, e.g.
+    ab/cd/abcd...ef.pdf, to keep the directories small.
+    """
+    return os.path.join(
+        sha256_content[:2], sha256_content[2:4], f"{sha256_content}{extension}"
+    )
+
+
+class UploadError(Exception):
+    """The uploaded file can't be stored, e.g. it is too large."""
 
 
 class UploadManager:
-    def __init__(self, upload_folder):
+    """Stores the uploaded files by content.
+
+    A content is stored once, whatever the number of uploads and the names of
+    the uploaded files, which are only kept in the database. The stored file
+    name is also the name of the document index, so the index is shared too.
+
+    :param upload_folder: Directory of the stored files.
+    :param min_size: Minimum size of a file in bytes.
+    :param max_size: Maximum size of a file in bytes, no limit if None.
+    :param chunk_size: Size of the chunks read from the upload stream.
+    """
+
+    def __init__(
+        self,
+        upload_folder,
+        min_size: int = 0,
+        max_size: Optional[int] = None,
+        chunk_size: int = 64 * 1024,
+    ):
         self.upload_folder = upload_folder
+        self.min_size = min_size
+        self.max_size = max_size
+        self.chunk_size = chunk_size
+
+    def get_path(self, filename: str) -> str:
+        return os.path.join(self.upload_folder, filename)
+
+    @contextmanager
+    def locked(self) -> Iterator[None]:
+        """Serialize the stores and the deletes, across threads and processes.
+
+        Otherwise a content found stored by an upload could be deleted by the
+        release of its last reference, or a shard directory created for a
+        content removed as empty before the content is moved in.
+        """
+        os.makedirs(self.upload_folder, exist_ok=True)
+        with _store_lock:
+            if fcntl is None:
+                yield
+                return
+            fd = os.open(self.upload_folder, os.O_RDONLY)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                yield
+            finally:
+                os.close(fd)
 
     def save_file(self, file: FileStorage) -> UploadFileInfo:
-        if not os.path.exists(self.upload_folder):
-            os.makedirs(self.upload_folder)
+        """Store an uploaded file, reading its stream once.
 
-        # TODO: Sanitize file.filename?
-        filename = datetime.now().strftime("%Y%m%d_%H%M%S_") + file.filename
+        Each chunk is hashed, counted and written to a temporary file, which
+        is moved to the path of its content once complete, so a partially
+        written file is never found at that path.
 
-        sha256_hash = hashlib.sha256()
-        file_size = 0
-        file.stream.seek(0)
+        :raise UploadError: If the file is too small or too large.
+        """
+        os.makedirs(self.upload_folder, exist_ok=True)
+        # In the upload folder to be on the same file system as the final path
+        fd, tmp_path = tempfile.mkstemp(
+            dir=self.upload_folder, prefix=".upload-", suffix=".tmp"
+        )
+        try:
+            with os.fdopen(fd, "wb") as tmp:
+                sha256_content, file_size = self._write(file, tmp)
+                tmp.flush()
+                os.fsync(tmp.fileno())
 
-        while chunk := file.stream.read(8192):
-            sha256_hash.update(chunk)
-            file_size += len(chunk)
-        file.stream.seek(0)
+            file_info = self.store_file(
+                tmp_path,
+                sha256_content,
+                file_size,
+                orig_filename=file.filename,
+                content_type=file.content_type,
+            )
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.unlink(tmp_path)
+            raise
+
+        return file_info
+
+    def store_file(
+        self,
+        path: str,
+        sha256_content: str,
+        file_size: int,
+        orig_filename: str,
+        content_type: str,
+    ) -> UploadFileInfo:
+        """Move a complete file, hashed and fsynced, to its content path.
 
+        The file must be on the file system of the upload folder. If the
+        content is already stored, the file is kept as the ``copy_path`` of
+        the upload until :meth:`settle`, as the stored content may still be
+        deleted by the release of its last reference.
+
+        :raise UploadError: If the file is too small.
+        """
+        if file_size < self.min_size:
+            raise UploadError(
+                f"File is too small. Minimum size is {self.min_size} bytes."
+            )
+
+        extension = os.path.splitext(orig_filename or "")[1].lower()
+        filename = content_filename(sha256_content, extension)
         file_info = UploadFileInfo(
-            orig_filename=file.filename,
-            content_type=file.content_type,
+            orig_filename=orig_filename,
+            content_type=content_type,
             content_length=file_size,
             filename=filename,
-            sha256_content=sha256_hash.hexdigest(),
+            sha256_content=sha256_content,
         )
 
-        # TODO: Check sha256_content to not upload the same content twice?
-        filepath = os.path.join(self.upload_folder, filename)
-        file.save(filepath)
-        assert os.path.exists(filepath), f"Failed to upload file {file.filename}"
+        filepath = self.get_path(filename)
+        with self.locked():
+            if os.path.exists(filepath):
+                file_info.created = False
+                file_info.copy_path = path
+            else:
+                self._move(path, filepath)
 
         return file_info
+
+    def settle(self, file_info: UploadFileInfo) -> bool:
+        """Drop the copy of an upload once it holds a reference to the content.
+
+        The copy is stored again if the content was deleted in the meantime.
+
+        :return: True if the copy was stored.
+        """
+        if file_info.copy_path is None:
+            return False
+
+        filepath = self.get_path(file_info.filename)
+        with self.locked():
+            restored = not os.path.exists(filepath)
+            if restored:
+                self._move(file_info.copy_path, filepath)
+            elif os.path.exists(file_info.copy_path):
+                os.unlink(file_info.copy_path)
+        file_info.copy_path = None
+        return restored
+
+    def _move(self, path: str, filepath: str):
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        os.replace(path, filepath)
+        _fsync_dir(os.path.dirname(filepath))
+
+    def _write(self, file: FileStorage, tmp: BinaryIO) -> Tuple[str, int]:
+        """Copy the stream to the file, return its hash and size."""
+        sha256_hash = hashlib.sha256()
+        file_size = 0
+
+        while chunk := file.stream.read(self.chunk_size):
+            file_size += len(chunk)
+            if self.max_size is not None and file_size > self.max_size:
+                raise UploadError(
+                    "File size exceeds the maximum limit of "
+                    f"{self.max_size / (1024 * 1024)} MB."
+                )
+            sha256_hash.update(chunk)
+            tmp.write(chunk)
+
+        return sha256_hash.hexdigest(), file_size
+
+    def delete_file(
+        self, filename: str, unused: Optional[Callable[[], bool]] = None
+    ) -> bool:
+        """Delete a stored file and the shard directories left empty.
+
+        :param unused: Checked before the delete, under the lock of the stores,
+                       e.g. that no document references the content anymore.
+        :return: True unless ``unused`` returned False.
+        """
+        filepath = self.get_path(filename)
+        with self.locked():
+            if unused is not None and not unused():
+                return False
+
+            if os.path.exists(filepath):
+                os.remove(filepath)
+
+            directory = os.path.dirname(filepath)
+            upload_folder = os.path.abspath(self.upload_folder)
+            while os.path.abspath(directory) != upload_folder:
+                try:
+                    os.rmdir(directory)
+                except OSError:
+                    # Not empty
+                    break
+                directory = os.path.dirname(directory)
+
+        return True
+
+
+def _fsync_dir(directory: str):
+    """Persist the entries of a directory, e.g. after a file was moved in."""
+    if not hasattr(os, "O_DIRECTORY"):
+        # Windows
+        return
+    fd = os.open(directory, os.O_RDONLY | os.O_DIRECTORY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
@@ -4,13 +4,33 @@ Utilities for analyzing and extracting information from PDF files:
 - Determine if pages contain searchable text or images
 - Analyze PDF structure and content
 - Count pages
+- Locate signature fields
 """
 
 import logging
+import math
+import mmap
+import multiprocessing
+import random
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import List, TypedDict
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    TypedDict,
+)
 
-from pypdf import PdfReader
+from pypdf import PageObject, PdfReader
+from pypdf._page_labels import index2label
+from pypdf.generic import ArrayObject, IndirectObject, NameObject
 
 logger = logging.getLogger(__name__)
 
@@ -24,6 +44,19 @@ class PDFTypeInfo(TypedDict):
     overall_type: str
 
 
+class PDFSampleInfo(PDFTypeInfo):
+    """Type definition for PDF type detection result in sampling mode.
+
+    Pages which were not inspected are reported as "unknown" in page_types.
+    """
+
+    # 1-based numbers of the pages actually inspected
+    inspected_pages: List[int]
+    # Whether overall_type is certain: all pages were inspected, or both
+    # text-based and image-based pages were found
+    exact: bool
+
+
 def _is_image_based(page) -> bool:
     """Check if a PDF page is predominantly image-based."""
     resources = page.get("/Resources")
@@ -106,15 +139,1216 @@ def detect_pdf_type(pdf_path: str | Path) -> PDFTypeInfo:
             result["is_pdf"] = True
             result["page_types"] = page_types
             result["total_pages"] = len(reader.pages)
+            result["overall_type"] = _overall_type(page_types)
+    except Exception as e:
+        logger.warning(f"Error while analyzing {pdf_path} with pdfimages: {e}")
+        result["is_pdf"] = False
+
+    return result
+
+
+def _overall_type(page_types: List[str]) -> str:
+    """Collapse per-page types into a document-level classification.
+
+    Pages of "unknown" type (e.g. exceeded the time budget) are ignored.
+    """
+    unique_types = set(page_types) - {"unknown"}
+    if not unique_types:
+        return "Unknown"
+    if len(unique_types) == 1:
+        return unique_types.pop()
+    return "mixed"
+
+
+# Extra time for a child process to start, on top of the budget of its first
+# page.
+PROCESS_STARTUP_GRACE = 5.0
+
+# Whitespace and delimiter bytes as defined by the PDF specification
+# (ISO 32000-1, 7.2.2 and 7.2.3).
+_WHITESPACE = b"\x00\t\n\x0c\r "
+
+# Operators that paint text: Tj, TJ, ' (move and show) and " (set spacing,
+# move and show).
+_TEXT_OPERATORS = frozenset((b"Tj", b"TJ", b"'", b'"'))
+
+_TOKEN_RE = re.compile(
+    rb"[\x00\t\n\x0c\r ]+"  # whitespace
+    rb"|%[^\r\n]*"  # comment
+    rb"|<<|>>"  # dictionary delimiters
+    rb"|<[0-9A-Fa-f\x00\t\n\x0c\r ]*>"  # hex string
+    rb"|/[^\x00\t\n\x0c\r ()<>\[\]{}/%]*"  # name
+    rb"|[\[\]{}]"  # array and procedure delimiters
+    rb"|[^\x00\t\n\x0c\r ()<>\[\]{}/%]+"  # operator, number or keyword
+)
+
+# A literal string without nested parentheses. Nested ones are rare enough
+# to be handled by the slow path in _skip_literal_string().
+_LITERAL_RE = re.compile(rb"\((?:[^()\\]|\\.)*\)", re.DOTALL)
+
+# End of an inline image: "EI" preceded by whitespace and followed by
+# whitespace or the end of the stream.
+_INLINE_IMAGE_END_RE = re.compile(rb"[\x00\t\n\x0c\r ]EI(?=[\x00\t\n\x0c\r ]|$)")
+
+
+def _skip_literal_string(data: bytes, pos: int) -> Tuple[int, bool]:
+    """Skip a literal string starting at ``pos``.
+
+    Returns the position right after the closing parenthesis and whether the
+    string contains anything but whitespace.
+    """
+    match = _LITERAL_RE.match(data, pos)
+    if match:
+        return match.end(), bool(match.group()[1:-1].strip(_WHITESPACE))
+
+    depth = 0
+    non_empty = False
+    i = pos
+    size = len(data)
+    while i < size:
+        char = data[i]
+        if char == 0x5C:  # backslash escapes the next byte
+            non_empty = True
+            i += 2
+            continue
+        if char == 0x28:
+            depth += 1
+            if depth > 1:
+                non_empty = True
+        elif char == 0x29:
+            depth -= 1
+            if depth == 0:
+                return i + 1, non_empty
+            non_empty = True
+        elif char not in _WHITESPACE:
+            non_empty = True
+        i += 1
+
+    return size, non_empty
+
+
+def _hex_string_is_empty(token: bytes) -> bool:
+    """Check if a hex string token decodes to whitespace only."""
+    digits = bytes(c for c in token[1:-1] if c not in _WHITESPACE)
+    if len(digits) % 2:
+        digits += b"0"
+    try:
+        return not bytes.fromhex(digits.decode("ascii")).strip(_WHITESPACE)
+    except ValueError:
+        return False
+
+
+class ContentScan:
+    """What a content stream paints, as far as page classification cares."""
+
+    __slots__ = ("has_text", "has_image", "xobjects")
+
+    def __init__(self):
+        self.has_text = False
+        self.has_image = False
+        # Names of XObjects painted with the Do operator, in stream order
+        self.xobjects: List[str] = []
+
+
+def scan_content_stream(data: bytes, stop_at_text: bool = True) -> ContentScan:
+    """Scan raw content stream bytes for text-showing and painting operators.
+
+    This is a minimal tokenizer which only tracks what is needed to classify a
+    page: whether a text-showing operator (``Tj``, ``TJ``, ``'``, ``"``) paints
+    a non-blank string, which XObjects are painted with ``Do`` and whether the
+    stream contains inline images (``BI`` ... ``ID`` ... ``EI``). Unlike
+    ``PageObject.extract_text()``, it neither decodes fonts nor tracks the text
+    matrix.
+
+    Args:
+        data (bytes): Decoded content stream
+        stop_at_text (bool): Stop scanning at the first painted text
+
+    Returns:
+        ContentScan: The scan result
+    """
+    scan = ContentScan()
+    pending_text = False
+    last_name: Optional[bytes] = None
+    pos = 0
+    size = len(data)
+
+    while pos < size:
+        if data[pos] == 0x28:  # "("
+            pos, non_empty = _skip_literal_string(data, pos)
+            pending_text = pending_text or non_empty
+            continue
+
+        match = _TOKEN_RE.match(data, pos)
+        if not match:
+            # Unbalanced ")" or another stray delimiter, skip it
+            pos += 1
+            continue
+
+        token = match.group()
+        pos = match.end()
+        first = token[0]
+
+        if first in _WHITESPACE or first == 0x25:  # whitespace or "%"
+            continue
+        if first == 0x3C and token != b"<<":  # hex string
+            pending_text = pending_text or not _hex_string_is_empty(token)
+            continue
+        if first == 0x2F:  # "/"
+            last_name = token[1:]
+            continue
+        if token in (b"<<", b">>", b"[", b"]", b"{", b"}"):
+            continue
+        if first in b"+-.0123456789":
+            continue
+
+        # Anything else is an operator
+        if token in _TEXT_OPERATORS:
+            if pending_text:
+                scan.has_text = True
+                if stop_at_text:
+                    return scan
+        elif token == b"Do":
+            if last_name is not None:
+                scan.xobjects.append(last_name.decode("latin-1"))
+        elif token == b"ID":
+            scan.has_image = True
+            end = _INLINE_IMAGE_END_RE.search(data, pos)
+            pos = end.end() if end else size
+
+        pending_text = False
+        last_name = None
+
+    return scan
+
+
+def _read_stream_data(contents) -> bytes:
+    """Return decoded data of a /Contents entry (a stream or array of streams)."""
+    if contents is None:
+        return b""
+
+    contents = contents.get_object()
+    if isinstance(contents, ArrayObject):
+        return b"\n".join(_read_stream_data(item) for item in contents)
+
+    get_data = getattr(contents, "get_data", None)
+    return get_data() if get_data else b""
+
+
+def _page_count(reader: PdfReader) -> int:
+    """Read the page count from the /Count entry of the page tree root.
+
+    Falls back to flattening the page tree if /Count is missing or invalid.
+    """
+    try:
+        count = reader.trailer["/Root"]["/Pages"]["/Count"]
+        if isinstance(count, IndirectObject):
+            count = count.get_object()
+        count = int(count)
+        if count >= 0:
+            return count
+    except (KeyError, TypeError, ValueError, AttributeError):
+        pass
+
+    return len(reader.pages)
+
+
+# Page attributes inherited from ancestor nodes of the page tree
+# (ISO 32000-1, 7.7.3.4).
+_INHERITABLE_ATTRIBUTES = ("/Resources", "/MediaBox", "/CropBox", "/Rotate")
+
+
+class PDFDocument:
+    """Read-only, memory-mapped access to a PDF file.
+
+    The file is mapped into memory instead of being read into a buffer, so
+    every reader of the same file (including readers in other processes)
+    shares a single copy held by the OS page cache. Objects are resolved
+    lazily by pypdf when accessed, and :meth:`iter_pages` walks the page tree
+    using the /Count of intermediate nodes to skip subtrees outside of the
+    requested range, so callers only pay for the pages they touch.
+
+    Example:
+        >>> with PDFDocument("contract.pdf") as pdf:
+        ...     for number, text in pdf.extract_text(0, 5):  # pages 1-5
+        ...         print(number, len(text))
+    """
+
+    def __init__(self, pdf_path: str | Path):
+        self.path = Path(pdf_path)
+        if not self.path.is_file():
+            raise FileNotFoundError(f"File not found: {self.path}")
+
+        self._file = open(self.path, "rb")
+        try:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.reader = PdfReader(self._mmap)
+        except Exception:
+            self.close()
+            raise
+
+        self._page_count: Optional[int] = None
+
+    def __enter__(self) -> "PDFDocument":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        """Release the reader, the memory map and the file handle."""
+        self.reader = None
+        mapped = getattr(self, "_mmap", None)
+        if mapped is not None:
+            try:
+                mapped.close()
+            except BufferError:
+                # Objects still reference the buffer, let the GC unmap it.
+                pass
+            self._mmap = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    @property
+    def page_count(self) -> int:
+        """Number of pages, read from the /Count of the page tree root."""
+        if self._page_count is None:
+            self._page_count = _page_count(self.reader)
+        return self._page_count
+
+    def iter_pages(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Tuple[int, PageObject]]:
+        """Iterate over pages ``start`` to ``stop`` (exclusive, 0-based).
+
+        Yields:
+            Tuple[int, PageObject]: The 0-based page index and the page
+        """
+        stop = self.page_count if stop is None else min(stop, self.page_count)
+        if start >= stop:
+            return
+
+        try:
+            root = self.reader.trailer.raw_get("/Root").get_object().raw_get("/Pages")
+            _, found = self._walk_page_tree(root, start, stop, 0, {})
+        except (KeyError, TypeError, AttributeError, RecursionError) as e:
+            logger.debug(f"Unable to walk the page tree of {self.path}: {e}")
+        else:
+            yield from found
+            return
+
+        # Malformed page tree: fall back to the flattened list of pages
+        pages = self.reader.pages
+        for index in range(start, min(stop, len(pages))):
+            yield index, pages[index]
+
+    def _walk_page_tree(self, node_ref, start, stop, offset, inherited):
+        """Collect pages within [start, stop) of the (sub)tree at ``node_ref``.
+
+        Returns a tuple with the page offset after the subtree and the list
+        of (index, page) tuples found in range.
+        """
+        node = node_ref.get_object()
+        if "/Kids" not in node:
+            if not start <= offset < stop:
+                return offset + 1, []
+
+            reference = node_ref if isinstance(node_ref, IndirectObject) else None
+            page = PageObject(self.reader, reference)
+            page.update(node)
+            for name, value in inherited.items():
+                if name not in page:
+                    page[NameObject(name)] = value
+            return offset + 1, [(offset, page)]
+
+        inherited = dict(inherited)
+        for name in _INHERITABLE_ATTRIBUTES:
+            if name in node:
+                inherited[name] = node.raw_get(name)
+
+        found = []
+        for kid_ref in node.raw_get("/Kids").get_object():
+            if offset >= stop:
+                break
+
+            kid = kid_ref.get_object()
+            count = kid.get("/Count") if "/Kids" in kid else 1
+            if isinstance(count, int) and offset + count <= start:
+                # The whole subtree is before the requested range
+                offset += count
+                continue
+
+            offset, pages = self._walk_page_tree(
+                kid_ref, start, stop, offset, inherited
+            )
+            found += pages
+
+        return offset, found
+
+    def page_label(self, index: int) -> str:
+        """Return the label of the page at ``index`` (e.g. "iv" or "A-3")."""
+        try:
+            return index2label(self.reader, index)
+        except Exception:
+            return str(index + 1)
+
+    def extract_text(
+        self, start: int = 0, stop: Optional[int] = None
+    ) -> Iterator[Tuple[int, str]]:
+        """Extract text of pages ``start`` to ``stop`` (exclusive, 0-based).
+
+        Yields:
+            Tuple[int, str]: The 0-based page index and the page text
+        """
+        for index, page in self.iter_pages(start, stop):
+            yield index, page.extract_text()
+
+
+class PDFProfiler:
+    """Classify pages of a single PDF document without extracting text.
+
+    The profiler scans each page's content stream for text-showing operators
+    and painted image XObjects (see :func:`scan_content_stream`). Form
+    XObjects are scanned recursively, and the verdict for every XObject is
+    cached by its indirect reference, so resources shared between pages (logos,
+    letterheads, scanned backgrounds) are resolved only once per document.
+
+    A profiler instance is bound to a single document, create a new one for
+    each reader.
+    """
+
+    def __init__(self):
+        # (idnum, generation, stop_at_text) -> (has_text, has_image)
+        self._xobject_cache: Dict[Tuple[int, int, bool], Tuple[bool, bool]] = {}
+
+    def classify_page(self, page, text: Optional[str] = None) -> str:
+        """Classify the page as "text-based" or "image-based".
+
+        Follows the semantics of :func:`detect_pdf_type`: a page painting
+        any text is text-based, a page with no text but with images is
+        image-based, and an empty page is considered text-based.
+
+        When the extracted ``text`` of the page is already known, it decides
+        whether the page has text and the content stream is only scanned for
+        images.
+        """
+        if text is not None and text.strip():
+            return "text-based"
+
+        resources = page.get("/Resources")
+        resources = resources.get_object() if resources is not None else None
+        data = _read_stream_data(page.get("/Contents"))
+
+        if not data:
+            # Nothing is painted, fall back to the resource declarations
+            return "image-based" if _is_image_based(page) else "text-based"
+
+        stop_at_text = text is None
+        has_text, has_image = self._scan(data, resources, stop_at_text)
+        if has_text and stop_at_text:
+            return "text-based"
+        return "image-based" if has_image else "text-based"
+
+    def _scan(
+        self, data: bytes, resources, stop_at_text: bool = True
+    ) -> Tuple[bool, bool]:
+        """Scan a content stream and the XObjects it paints.
+
+        With ``stop_at_text`` the scan stops at the first painted text, so
+        has_image may be incomplete when has_text is True.
+        """
+        scan = scan_content_stream(data, stop_at_text)
+        if scan.has_text and stop_at_text:
+            return True, scan.has_image
+
+        has_text = scan.has_text
+        has_image = scan.has_image
+        xobjects = resources.get("/XObject") if resources else None
+        xobjects = xobjects.get_object() if xobjects is not None else None
+        if not xobjects:
+            return has_text, has_image
+
+        for name in scan.xobjects:
+            ref = xobjects.raw_get(f"/{name}") if f"/{name}" in xobjects else None
+            if ref is None:
+                continue
+
+            xobj_text, xobj_image = self._scan_xobject(ref, resources, stop_at_text)
+            if xobj_text and stop_at_text:
+                return True, has_image or xobj_image
+            has_text = has_text or xobj_text
+            has_image = has_image or xobj_image
+
+        return has_text, has_image
+
+    def _scan_xobject(
+        self, ref, parent_resources, stop_at_text: bool = True
+    ) -> Tuple[bool, bool]:
+        """Return (has_text, has_image) for an XObject, using the cache."""
+        key = None
+        if isinstance(ref, IndirectObject):
+            key = (ref.idnum, ref.generation, stop_at_text)
+            if key in self._xobject_cache:
+                return self._xobject_cache[key]
+            # Mark as in progress to break reference cycles between forms
+            self._xobject_cache[key] = (False, False)
+
+        xobj = ref.get_object()
+        subtype = xobj.get("/Subtype")
+        if subtype == "/Image":
+            verdict = (False, True)
+        elif subtype == "/Form":
+            resources = xobj.get("/Resources")
+            resources = (
+                resources.get_object() if resources is not None else parent_resources
+            )
+            verdict = self._scan(xobj.get_data(), resources, stop_at_text)
+        else:
+            verdict = (False, False)
+
+        if key is not None:
+            self._xobject_cache[key] = verdict
+        return verdict
+
+
+# A page job runs on each page of a document, e.g. to classify the page.
+# Module-level functions only, as they are sent to child processes.
+PageJob = Callable[["PDFDocument", PDFProfiler, int, PageObject], Any]
+
+
+def _classify_page(
+    document: PDFDocument, profiler: PDFProfiler, index: int, page: PageObject
+) -> str:
+    return profiler.classify_page(page)
+
+
+def _consecutive_ranges(indices: Iterable[int]) -> Iterator[Tuple[int, int]]:
+    """Group page indices into (start, stop) ranges of consecutive pages."""
+    start = stop = None
+    for index in indices:
+        if index == stop:
+            stop += 1
+            continue
+        if start is not None:
+            yield start, stop
+        start, stop = index, index + 1
+    if start is not None:
+        yield start, stop
+
+
+def _iter_page_results(
+    document: PDFDocument,
+    indices: Iterable[int],
+    page_job: PageJob,
+    page_timeout: Optional[float] = None,
+) -> Iterator[Tuple[int, Any]]:
+    """Run a page job on the pages of the given indices, in order.
+
+    When ``page_timeout`` is set, every page gets its own time budget and
+    the job runs in a child process (see :func:`_iter_isolated`). The result
+    of a page exceeding the budget is None.
+
+    Yields:
+        Tuple[int, Any]: The 0-based page index and the result of the job
+    """
+    if page_timeout:
+        yield from _iter_isolated(document.path, indices, page_job, page_timeout)
+        return
+
+    profiler = PDFProfiler()
+    for start, stop in _consecutive_ranges(indices):
+        for index, page in document.iter_pages(start, stop):
+            yield index, page_job(document, profiler, index, page)
+
+
+def _page_worker(pdf_path: str, indices: List[int], page_job: PageJob, connection):
+    """Child process of :func:`_iter_isolated`, sends (index, result) by page.
+
+    An error is sent as (None, exception) and ends the pages.
+    """
+    try:
+        with PDFDocument(pdf_path) as document:
+            for result in _iter_page_results(document, indices, page_job):
+                connection.send(result)
+    except Exception as e:
+        connection.send((None, e))
+    finally:
+        connection.close()
+
+
+def _process_context():
+    """Return a context starting processes safely from any thread.
+
+    Forking a process running other threads can deadlock the child, so
+    processes are forked from a single-threaded server instead.
+    """
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        # Windows
+        return multiprocessing.get_context("spawn")
+    context = multiprocessing.get_context("forkserver")
+    context.set_forkserver_preload([__name__])
+    return context
+
+
+def _iter_isolated(
+    pdf_path: str | Path,
+    indices: Iterable[int],
+    page_job: PageJob,
+    page_timeout: Optional[float] = None,
+) -> Iterator[Tuple[int, Any]]:
+    """Run a page job in a child process, with a time budget per page.
+
+    A child process taking more than ``page_timeout`` seconds on a page is
+    killed, even when stuck in native code, the result of the page is None
+    and a new process resumes with the next page. Unlike signals, this works
+    from any thread, e.g. the threads of the job workers.
+
+    Yields:
+        Tuple[int, Any]: The 0-based page index and the result of the job,
+            in the order of the indices
+    """
+    pending = deque(indices)
+    context = _process_context()
+
+    while pending:
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(
+            target=_page_worker,
+            args=(str(pdf_path), list(pending), page_job, sender),
+            daemon=True,
+        )
+        process.start()
+        sender.close()
+
+        try:
+            # The first page also waits for the process to start
+            timeout = page_timeout and page_timeout + PROCESS_STARTUP_GRACE
+            while pending:
+                failure = None
+                if not receiver.poll(timeout):
+                    failure = f"exceeded the time budget of {page_timeout}s"
+                else:
+                    try:
+                        index, result = receiver.recv()
+                    except EOFError:
+                        failure = "crashed the worker process"
+
+                if failure is not None:
+                    logger.warning(f"Page {pending[0] + 1} of {pdf_path} {failure}")
+                    yield pending.popleft(), None
+                    break
+
+                if index is None:
+                    raise result
+                pending.popleft()
+                yield index, result
+                timeout = page_timeout
+        finally:
+            process.kill()
+            process.join()
+            receiver.close()
+
+
+def sample_page_indices(total_pages: int, sample_size: int, seed: int = 0) -> List[int]:
+    """Choose pages to inspect when sampling a document.
+
+    The first and the last pages are always inspected, as cover pages and
+    signature pages often differ from the body. The remaining pages are split
+    into equal strata with one random page picked from each, so the sample
+    covers the whole document. The choice is deterministic for a given seed.
+
+    Args:
+        total_pages (int): Number of pages in the document
+        sample_size (int): Number of pages to inspect, at least 2
+        seed (int): Seed of the random generator
+
+    Returns:
+        List[int]: 0-based page indices in inspection order
+    """
+    if sample_size >= total_pages:
+        return list(range(total_pages))
+
+    indices = [0, total_pages - 1][: max(sample_size, 1)]
+    strata = sample_size - len(indices)
+    if strata <= 0:
+        return indices
+
+    rng = random.Random(seed)
+    body = total_pages - 2
+    for stratum in range(strata):
+        low = 1 + stratum * body // strata
+        high = 1 + (stratum + 1) * body // strata
+        indices.append(rng.randrange(low, high))
+
+    return indices
 
-            # Determine the overall type
-            unique_types = set(page_types)
-            if len(unique_types) == 1:
-                result["overall_type"] = unique_types.pop()
+
+def _profile_sample(
+    document: PDFDocument,
+    total_pages: int,
+    sample_size: int,
+    page_timeout: Optional[float] = None,
+    seed: int = 0,
+) -> PDFSampleInfo:
+    """Classify a sample of pages, stopping once the document is mixed."""
+    page_types = ["unknown"] * total_pages
+    inspected = []
+    seen = set()
+
+    types = _iter_page_results(
+        document,
+        sample_page_indices(total_pages, sample_size, seed),
+        _classify_page,
+        page_timeout,
+    )
+    try:
+        for index, page_type in types:
+            page_types[index] = page_type or "unknown"
+            inspected.append(index + 1)
+            seen.add(page_type)
+            if {"text-based", "image-based"} <= seen:
+                # The verdict can't change anymore
+                break
+    finally:
+        types.close()
+
+    overall_type = _overall_type(page_types)
+    return {
+        "is_pdf": True,
+        "total_pages": total_pages,
+        "page_types": page_types,
+        "overall_type": overall_type,
+        "inspected_pages": sorted(inspected),
+        "exact": overall_type == "mixed" or "unknown" not in page_types,
+    }
+
+
+def _profile_parallel(
+    pdf_path: Path,
+    total_pages: int,
+    workers: int,
+    page_timeout: Optional[float] = None,
+) -> List[str]:
+    """Classify pages in child processes, preserving the page order.
+
+    The document is split into page ranges, several per worker to even out
+    the load, each classified by a child process (see :func:`_iter_isolated`)
+    driven by a thread of a pool of ``workers`` threads.
+    """
+    chunk_size = max(1, math.ceil(total_pages / (workers * 4)))
+    ranges = [
+        (start, min(start + chunk_size, total_pages))
+        for start in range(0, total_pages, chunk_size)
+    ]
+
+    def classify(page_range: Tuple[int, int]) -> List[str]:
+        results = _iter_isolated(
+            pdf_path, range(*page_range), _classify_page, page_timeout
+        )
+        return [page_type or "unknown" for _, page_type in results]
+
+    with ThreadPoolExecutor(max_workers=min(workers, len(ranges))) as executor:
+        return [
+            page_type
+            for page_types in executor.map(classify, ranges)
+            for page_type in page_types
+        ]
+
+
+def profile_pdf(
+    pdf_path: str | Path,
+    workers: int = 1,
+    page_timeout: Optional[float] = None,
+    min_parallel_pages: int = 100,
+    sample_size: Optional[int] = None,
+    seed: int = 0,
+) -> PDFTypeInfo:
+    """Determine the type of a PDF file in a single pass over content streams.
+
+    A faster alternative to :func:`detect_pdf_type` which returns the same
+    :class:`PDFTypeInfo` structure. Instead of extracting the text of every
+    page, it tokenizes the content streams looking for text-showing operators
+    and painted images (see :class:`PDFProfiler`), and reads the page count
+    from the /Count entry of the page tree.
+
+    Documents with at least ``min_parallel_pages`` pages are split into page
+    ranges classified by ``workers`` child processes at a time, each with its
+    own reader. The page order of the result is always the page order of
+    the document.
+
+    Args:
+        pdf_path (str | Path): Path to the PDF file to analyze
+        workers (int): Number of worker processes, 1 disables the process pool
+        page_timeout (float, optional): Time budget per page in seconds. A
+            page exceeding it is reported as "unknown" instead of blocking
+            the caller. The pages are then classified in a child process,
+            killed on a page over budget.
+        min_parallel_pages (int): Minimal number of pages to use the pool
+        sample_size (int, optional): Opt into sampling mode: inspect at most
+            this many pages (see :func:`sample_page_indices`) and stop as
+            soon as the document is known to be mixed. Bounds the latency on
+            very large documents at the cost of exactness.
+        seed (int): Seed for choosing the sampled pages
+
+    Returns:
+        PDFTypeInfo: Dictionary containing PDF analysis results. In sampling
+            mode it is a :class:`PDFSampleInfo` which also reports the
+            inspected pages and whether the overall type is exact.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist
+    """
+    pdf_path = Path(pdf_path)
+    if not pdf_path.is_file():
+        raise FileNotFoundError(f"File not found: {pdf_path}")
+
+    result: PDFTypeInfo = {
+        "is_pdf": False,
+        "total_pages": 0,
+        "page_types": [],
+        "overall_type": "Unknown",
+    }
+
+    try:
+        with PDFDocument(pdf_path) as document:
+            total_pages = document.page_count
+            if sample_size:
+                return _profile_sample(
+                    document, total_pages, sample_size, page_timeout, seed
+                )
+
+            if workers > 1 and total_pages >= min_parallel_pages:
+                page_types = _profile_parallel(
+                    pdf_path, total_pages, workers, page_timeout
+                )
             else:
-                result["overall_type"] = "mixed"
+                results = _iter_page_results(
+                    document, range(total_pages), _classify_page, page_timeout
+                )
+                page_types = [page_type or "unknown" for _, page_type in results]
+
+            result["is_pdf"] = True
+            result["page_types"] = page_types
+            result["total_pages"] = total_pages
+            result["overall_type"] = _overall_type(page_types)
     except Exception as e:
-        logger.warning(f"Error while analyzing {pdf_path} with pdfimages: {e}")
+        logger.warning(f"Error while profiling {pdf_path}: {e}")
         result["is_pdf"] = False
 
     return result
+
+
+class PageText(TypedDict):
+    """Type definition for the extracted text of a page."""
+
+    page_number: int
+    page_label: str
+    page_content: str
+
+
+def _extract_page(
+    document: PDFDocument, profiler: PDFProfiler, index: int, page: PageObject
+) -> Tuple[PageText, str]:
+    text = page.extract_text()
+    return {
+        "page_number": index + 1,
+        "page_label": document.page_label(index),
+        "page_content": text,
+    }, profiler.classify_page(page, text)
+
+
+def stream_pdf(
+    pdf_path: str | Path, info: PDFTypeInfo, page_timeout: Optional[float] = None
+) -> Iterator[Tuple[PageText, str]]:
+    """Extract the text of the pages one by one and profile the PDF.
+
+    The extracted text decides whether a page is text-based. Only pages
+    without text have their content streams scanned, to tell image-based
+    pages from empty ones (see :meth:`PDFProfiler.classify_page`).
+
+    Args:
+        pdf_path (str | Path): Path to the PDF file to analyze
+        info (PDFTypeInfo): Set to the PDF profile once every page is
+            extracted. An error is logged and ends the pages, with "is_pdf"
+            set to False.
+        page_timeout (float, optional): Time budget per page in seconds. The
+            pages are then extracted in a child process, a page exceeding
+            the budget has no text and is reported as "unknown".
+
+    Yields:
+        Tuple[PageText, str]: The text of the page, numbered from 1, and its
+            type
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist
+    """
+    pdf_path = Path(pdf_path)
+    if not pdf_path.is_file():
+        raise FileNotFoundError(f"File not found: {pdf_path}")
+
+    try:
+        with PDFDocument(pdf_path) as document:
+            page_types = []
+            results = _iter_page_results(
+                document, range(document.page_count), _extract_page, page_timeout
+            )
+            for index, result in results:
+                if result is None:
+                    result = {
+                        "page_number": index + 1,
+                        "page_label": document.page_label(index),
+                        "page_content": "",
+                    }, "unknown"
+                page_types.append(result[1])
+                yield result
+
+            info["is_pdf"] = True
+            info["page_types"] = page_types
+            info["total_pages"] = document.page_count
+            info["overall_type"] = _overall_type(page_types)
+    except Exception as e:
+        logger.warning(f"Error while extracting {pdf_path}: {e}")
+        info["is_pdf"] = False
+
+
+def extract_pdf(
+    pdf_path: str | Path, page_timeout: Optional[float] = None
+) -> Tuple[PDFTypeInfo, List[PageText]]:
+    """Extract the text of every page and profile the PDF in a single pass.
+
+    See :func:`stream_pdf`.
+
+    Args:
+        pdf_path (str | Path): Path to the PDF file to analyze
+        page_timeout (float, optional): Time budget per page in seconds
+
+    Returns:
+        Tuple[PDFTypeInfo, List[PageText]]: The PDF profile and the text of
+            every page. Pages are numbered from 1.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist
+    """
+    result: PDFTypeInfo = {
+        "is_pdf": False,
+        "total_pages": 0,
+        "page_types": [],
+        "overall_type": "Unknown",
+    }
+    pages = [page for page, _ in stream_pdf(pdf_path, result, page_timeout)]
+    if not result["is_pdf"]:
+        pages = []
+
+    return result, pages
+
+
+class SignatureField(TypedDict):
+    """Type definition for a located signature field.
+
+    The bounding box is ``[x0, y0, x1, y1]`` in PDF points, with the origin
+    in the bottom-left corner of the page.
+    """
+
+    field_type: str
+    party: str
+    page: int
+    bbox: List[float]
+    signed: str
+    source: str
+
+
+# Labels of the fields to sign, e.g. "By: ______" or "Signature:".
+_SIGNATURE_LABEL_RE = re.compile(
+    r"\b(signature|signed|by|initials?|date)\s*:?\s*$", re.IGNORECASE
+)
+_SIGNATURE_ANCHOR_RE = re.compile(r"\b(signature|initials?)\s*:", re.IGNORECASE)
+_UNDERSCORE_RUN_RE = re.compile(r"_{5,}")
+_OTHER_LABEL_RE = re.compile(r"\b[A-Za-z][A-Za-z ]{0,30}:\s*$")
+# Lines naming a signing party, e.g. "ACME Inc., Seller" or "Name: J. Smith"
+_PARTY_ROLE_RE = re.compile(
+    r"\b(buyers?|sellers?|purchasers?|vendors?|landlords?|tenants?|lessors?|"
+    r"lessees?|licensors?|licensees?|employers?|employees?|contractors?|"
+    r"consultants?|clients?|customers?|suppliers?|company|borrowers?|lenders?|"
+    r"guarantors?|owners?|party|witness(es)?|notary|agents?|signatory|"
+    r"trustees?|partners?|directors?|officers?|president|secretary)\b",
+    re.IGNORECASE,
+)
+_NAME_LABEL_RE = re.compile(r"(?i)name\s*:")
+# Longest line naming a party, longer lines are prose
+_PARTY_LINE_WORDS = 6
+# Shortest line of prose, the trailing signature block follows the last one
+_PROSE_LINE_WORDS = 8
+
+# Average glyph width as a fraction of the font size, used to estimate the
+# position of characters within a text fragment.
+_CHAR_WIDTH = 0.5
+
+# Width of a signature field following a label without an underscore run.
+_DEFAULT_FIELD_WIDTH = 150.0
+
+
+def _mult(m: List[float], n: List[float]) -> List[float]:
+    """Multiply two PDF transformation matrices."""
+    return [
+        m[0] * n[0] + m[1] * n[2],
+        m[0] * n[1] + m[1] * n[3],
+        m[2] * n[0] + m[3] * n[2],
+        m[2] * n[1] + m[3] * n[3],
+        m[4] * n[0] + m[5] * n[2] + n[4],
+        m[4] * n[1] + m[5] * n[3] + n[5],
+    ]
+
+
+class _TextLine:
+    """Text fragments sharing a baseline, with estimated character positions."""
+
+    def __init__(self, y: float):
+        self.y = y
+        self.size = 0.0
+        self.fragments: List[Tuple[float, str, float]] = []
+
+    def add(self, x: float, text: str, size: float):
+        self.fragments.append((x, text, size))
+        self.size = max(self.size, size)
+
+    def layout(self) -> Tuple[str, List[float], List[float]]:
+        """Return the text of the line and the left/right x of each character."""
+        text, lefts, rights = "", [], []
+        for x, fragment, size in sorted(self.fragments, key=lambda f: f[0]):
+            width = size * _CHAR_WIDTH
+            if text and lefts and x > rights[-1] + width:
+                text += " "
+                lefts.append(rights[-1])
+                rights.append(x)
+            for i, char in enumerate(fragment):
+                text += char
+                lefts.append(x + i * width)
+                rights.append(x + (i + 1) * width)
+        return text, lefts, rights
+
+
+def _collect_text_lines(page: PageObject) -> List[_TextLine]:
+    """Extract the text lines of a page with pypdf's text visitor."""
+    lines: Dict[int, _TextLine] = {}
+
+    def visitor(text, cm, tm, font_dict, font_size):
+        if not text or not text.strip():
+            return
+        matrix = _mult(tm, cm)
+        size = (font_size or 1.0) * (math.hypot(matrix[2], matrix[3]) or 1.0)
+        x, y = matrix[4], matrix[5]
+        for offset, part in enumerate(text.split("\n")):
+            if part.strip():
+                baseline = y - offset * size
+                key = round(baseline)
+                lines.setdefault(key, _TextLine(baseline)).add(x, part, size)
+
+    page.extract_text(visitor_text=visitor)
+    return [lines[key] for key in sorted(lines, reverse=True)]
+
+
+def _party_near(lines: List[_TextLine], index: int) -> str:
+    """Guess the party of a signature field from the surrounding lines.
+
+    The line right below the field (e.g. "John Smith, Buyer" or
+    "Name: John Smith") is preferred, then the closest line above which is
+    not a field itself (e.g. "SELLER:").
+    """
+    line = lines[index]
+    limit = 3 * max(line.size, 1.0)
+
+    if index + 1 < len(lines) and line.y - lines[index + 1].y <= limit:
+        text = lines[index + 1].layout()[0].strip()
+        name = re.match(r"(?i)name\s*:\s*(.+)", text)
+        if name:
+            return name.group(1).strip()
+        if text and not _UNDERSCORE_RUN_RE.search(text) and ":" not in text:
+            return text
+
+    for above in reversed(lines[max(0, index - 3) : index]):
+        text = above.layout()[0].strip()
+        if _UNDERSCORE_RUN_RE.search(text) or _SIGNATURE_ANCHOR_RE.search(text):
+            continue
+        if text and above.y - line.y <= 2 * limit:
+            return text.rstrip(":").strip()
+
+    return ""
+
+
+def _names_party(text: str) -> bool:
+    """Check if a line names a signing party or its role."""
+    if _UNDERSCORE_RUN_RE.search(text) or _SIGNATURE_ANCHOR_RE.search(text):
+        # A field itself
+        return False
+    if _NAME_LABEL_RE.match(text):
+        return True
+    return len(text.split()) <= _PARTY_LINE_WORDS and bool(_PARTY_ROLE_RE.search(text))
+
+
+def _party_role_near(lines: List[_TextLine], index: int) -> bool:
+    """Check if a line close to a field names a party, see :func:`_party_near`."""
+    line = lines[index]
+    limit = 3 * max(line.size, 1.0)
+
+    if index + 1 < len(lines) and line.y - lines[index + 1].y <= limit:
+        if _names_party(lines[index + 1].layout()[0].strip()):
+            return True
+
+    return any(
+        above.y - line.y <= 2 * limit and _names_party(above.layout()[0].strip())
+        for above in lines[max(0, index - 3) : index]
+    )
+
+
+def _signature_block_start(lines: List[_TextLine]) -> int:
+    """Return the index of the first line after the last line of prose.
+
+    On the last page, these lines are the trailing signature block.
+    """
+    for index in range(len(lines) - 1, -1, -1):
+        text = _UNDERSCORE_RUN_RE.sub(" ", lines[index].layout()[0])
+        if len(text.split()) >= _PROSE_LINE_WORDS:
+            return index + 1
+    return 0
+
+
+def _field_type(label: str) -> str:
+    label = label.lower()
+    if label.startswith("initial"):
+        return "Initials"
+    if label == "date":
+        return "Date"
+    return "Signature"
+
+
+def _text_signature_fields(
+    page: PageObject, number: int, last_page: bool = False
+) -> List[SignatureField]:
+    """Locate signature fields from text anchors of a page.
+
+    A line to sign on without a label, e.g. over "Seller", must be alone on
+    its line and either close to a line naming a party, or in the trailing
+    signature block of the last page. Fill-in blanks of the text, e.g. "the
+    sum of ______ dollars", are not signature fields.
+    """
+    fields: List[SignatureField] = []
+    lines = _collect_text_lines(page)
+    block_start = _signature_block_start(lines) if last_page else len(lines)
+
+    for index, line in enumerate(lines):
+        text, lefts, rights = line.layout()
+        bottom, top = line.y - 0.25 * line.size, line.y + line.size
+        runs = list(_UNDERSCORE_RUN_RE.finditer(text))
+
+        def add(label, x0, x1):
+            fields.append(
+                {
+                    "field_type": _field_type(label),
+                    "party": _party_near(lines, index),
+                    "page": number,
+                    "bbox": [round(v, 1) for v in (x0, bottom, x1, top)],
+                    "signed": "No",
+                    "source": "text",
+                }
+            )
+
+        previous_end = 0
+        for run in runs:
+            before = text[previous_end : run.start()]
+            previous_end = run.end()
+            label = _SIGNATURE_LABEL_RE.search(before)
+            if label:
+                add(label.group(1), lefts[run.start()], rights[run.end() - 1])
+            elif not _UNDERSCORE_RUN_RE.sub("", text).strip() and (
+                index >= block_start or _party_role_near(lines, index)
+            ):
+                # An unlabelled line near a party name, e.g. over "Seller"
+                add("signature", lefts[run.start()], rights[run.end() - 1])
+
+        # "Signature:" without a line to sign on
+        for anchor in _SIGNATURE_ANCHOR_RE.finditer(text):
+            if text[anchor.end() :].strip():
+                # Followed by a line to sign on (see above) or already filled
+                continue
+            x0 = rights[anchor.end() - 1]
+            add(anchor.group(1), x0, x0 + _DEFAULT_FIELD_WIDTH)
+
+    return fields
+
+
+def _widget_signature_fields(page: PageObject, number: int) -> List[SignatureField]:
+    """Locate signature form fields (AcroForm /Sig widgets) of a page."""
+    fields: List[SignatureField] = []
+    for annotation in page.get("/Annots") or []:
+        widget = annotation.get_object()
+        if widget.get("/Subtype") != "/Widget" or "/Rect" not in widget:
+            continue
+
+        field = widget
+        if "/FT" not in field and "/Parent" in field:
+            field = field["/Parent"].get_object()
+        if field.get("/FT") != "/Sig":
+            continue
+
+        x0, y0, x1, y1 = (float(v) for v in widget["/Rect"])
+        fields.append(
+            {
+                "field_type": "Signature",
+                "party": str(field.get("/TU") or field.get("/T") or ""),
+                "page": number,
+                "bbox": [
+                    round(v, 1)
+                    for v in (min(x0, x1), min(y0, y1), max(x0, x1), max(y0, y1))
+                ],
+                "signed": "Yes" if field.get("/V") is not None else "No",
+                "source": "acroform",
+            }
+        )
+    return fields
+
+
+def _overlaps(a: List[float], b: List[float]) -> bool:
+    return a[0] < b[2] and b[0] < a[2] and a[1] < b[3] and b[1] < a[3]
+
+
+def locate_signature_fields(pdf_path: str | Path) -> List[SignatureField]:
+    """Locate the places to sign in a PDF document.
+
+    Signature form fields (AcroForm /Sig widgets) are read from the page
+    annotations. Text anchors are found with pypdf's text extraction visitor:
+    "Signature:", "By:", "Initials:" and "Date:" labels, and underscore runs
+    alone on their line near party names or in the trailing signature block.
+    Text anchors overlapping a form field are dropped.
+
+    Args:
+        pdf_path (str | Path): Path to the PDF file
+
+    Returns:
+        List[SignatureField]: The fields, ordered by page and from the top of
+            the page. Pages are numbered from 1.
+
+    Raises:
+        FileNotFoundError: If the specified file does not exist
+    """
+    fields: List[SignatureField] = []
+
+    with PDFDocument(pdf_path) as document:
+        try:
+            last_index = document.page_count - 1
+            for index, page in document.iter_pages():
+                widgets = _widget_signature_fields(page, index + 1)
+                anchors = [
+                    field
+                    for field in _text_signature_fields(
+                        page, index + 1, last_page=index == last_index
+                    )
+                    if not any(_overlaps(field["bbox"], w["bbox"]) for w in widgets)
+                ]
+                page_fields = widgets + anchors
+                page_fields.sort(key=lambda f: (-f["bbox"][3], f["bbox"][0]))
+                fields += page_fields
+        except Exception as e:
+            logger.warning(f"Error while locating signature fields in {pdf_path}: {e}")
+
+    return fields
@@ -0,0 +1,159 @@
+"""Tests for the admission control of the uploads."""
+
+import pytest
+
+from se.app import create_app, db
+from se.config import TestingConfig
+from se.models import Document, File, Job
+from se.modules.admission import (
+    CLIENT_LIMIT,
+    QUEUE_FULL,
+    AdmissionController,
+    get_admission_controller,
+)
+from se.modules.jobs import claim_job, count_jobs, enqueue_analysis
+
+
+@pytest.fixture
+def db_app(tmp_path):
+    """Create an application with an empty in-memory database."""
+    app = create_app("testing")
+    app.config["UPLOADS_DIR"] = str(tmp_path)
+    app.config["SECRET_KEY"] = "test_secret_key"
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def document(db_app):
+    model_file = File.create(
+        sha256_content="abc",
+        filename="a.pdf",
+        orig_filename="a.pdf",
+        file_type="application/pdf",
+        file_size=1024,
+    )
+    return Document.create(file=model_file, type="Unknown")
+
+
+def test_admit_until_queue_full(document):
+    controller = AdmissionController(queue_limit=2, client_limit=0, retry_after=10)
+    assert isinstance(controller.admit("10.0.0.1"), Job)
+
+    enqueue_analysis(document)
+    rejection = controller.admit("10.0.0.1")
+    assert (rejection.reason, rejection.status_code) == (QUEUE_FULL, 503)
+    assert rejection.retry_after == 10
+
+    # A running job leaves room in the queue
+    claim_job("worker-1", 60)
+    assert isinstance(controller.admit("10.0.0.1"), Job)
+    assert controller.rejected == {QUEUE_FULL: 1, CLIENT_LIMIT: 0}
+
+
+def test_admit_until_client_limit(document):
+    controller = AdmissionController(queue_limit=0, client_limit=2)
+    enqueue_analysis(document, client="10.0.0.1")
+    enqueue_analysis(document, client="10.0.0.1")
+    # Running jobs count too
+    claim_job("worker-1", 60)
+
+    rejection = controller.admit("10.0.0.1")
+    assert (rejection.reason, rejection.status_code) == (CLIENT_LIMIT, 429)
+    assert isinstance(controller.admit("10.0.0.2"), Job)
+
+
+def test_admitted_uploads_reserve_their_place(document):
+    controller = AdmissionController(queue_limit=2, client_limit=0)
+    # Uploads still being read, no job queued yet
+    first = controller.admit("10.0.0.1")
+    second = controller.admit("10.0.0.2")
+    assert controller.admit("10.0.0.3").reason == QUEUE_FULL
+    assert count_jobs()[Job.RESERVED] == 2
+
+    # The first upload queues its job, the second has a known content
+    job = enqueue_analysis(document, client="10.0.0.1", reservation=first)
+    assert (job.id, job.status, job.document) == (first.id, Job.QUEUED, document)
+    controller.release(first)
+    controller.release(second)
+    assert Job.query.count() == 1
+    assert controller.admitted == 1
+
+    # An abandoned upload frees its place once expired
+    controller.admit("10.0.0.2", hold=-1)
+    assert isinstance(controller.admit("10.0.0.3"), Job)
+
+
+def test_uploads_rejected_when_busy(db_app, document):
+    db_app.config["UPLOAD_QUEUE_LIMIT"] = 1
+    db_app.config["UPLOAD_RETRY_AFTER"] = 12
+    client = db_app.test_client()
+    enqueue_analysis(document)
+
+    with open("tests/resources/agreement-10.pdf", "rb") as f:
+        response = client.post("/upload", data={"file": (f, "Contract.pdf")})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+    assert "Too many documents" in response.get_data(as_text=True)
+
+    response = client.post("/uploads", json={"filename": "a.pdf", "size": 1024})
+    assert response.status_code == 503
+    assert response.headers["Retry-After"] == "12"
+    assert response.json["reason"] == QUEUE_FULL
+    assert Job.query.count() == 1
+
+
+def test_metrics_endpoint(db_app, document):
+    db_app.config["UPLOAD_QUEUE_LIMIT"] = 3
+    db_app.config["UPLOAD_CLIENT_LIMIT"] = 1
+    controller = get_admission_controller(db_app.config)
+    enqueue_analysis(document, client="10.0.0.1")
+    controller.admit("10.0.0.1")
+
+    response = db_app.test_client().get("/metrics")
+    assert response.mimetype == "text/plain"
+    metrics = response.get_data(as_text=True)
+    assert 'se_jobs{status="queued"} 1' in metrics
+    assert 'se_jobs{status="processing"} 0' in metrics
+    assert (
+        f'se_uploads_rejected_total{{reason="client_limit"}} '
+        f"{controller.rejected[CLIENT_LIMIT]}" in metrics
+    )
+    assert controller.rejected[CLIENT_LIMIT] >= 1
+
+
+def test_clients_told_apart_behind_proxy(tmp_path, monkeypatch):
+    monkeypatch.setattr(TestingConfig, "PROXY_FIX_X_FOR", 1)
+    app = create_app("testing")
+    app.config["UPLOADS_DIR"] = str(tmp_path)
+    app.config["UPLOAD_CLIENT_LIMIT"] = 1
+
+    with app.app_context():
+        db.create_all()
+        model_file = File.create(
+            sha256_content="abc",
+            filename="a.pdf",
+            orig_filename="a.pdf",
+            file_type="application/pdf",
+            file_size=1024,
+        )
+        document = Document.create(file=model_file, type="Unknown")
+        enqueue_analysis(document, client="203.0.113.1")
+        client = app.test_client()
+
+        def create_upload(forwarded_for):
+            return client.post(
+                "/uploads",
+                json={"filename": "a.pdf", "size": 1024},
+                headers={"X-Forwarded-For": forwarded_for},
+            )
+
+        # Both requests come from the proxy, only the first sender is busy
+        assert create_upload("203.0.113.1").status_code == 429
+        assert create_upload("203.0.113.2").status_code == 201
+        db.session.remove()
+        db.drop_all()
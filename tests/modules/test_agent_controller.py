@@ -77,3 +77,56 @@ def test_validate_purchase_agreement_invalid_columns(persist_dir: Path) -> None:
         ],
     }
     assert agent._validate_analysis_steps(data) is False
+
+
+def test_run_locates_signature_fields_without_llm(persist_dir: Path, mocker) -> None:
+    events = []
+    agent = AgentController(
+        persist_dir=persist_dir, on_event=lambda *event: events.append(event)
+    )
+    steps = {
+        "document_type": "Lease",
+        "analysis_steps": [
+            {
+                "category": "risks",
+                "applicable": True,
+                "type": "list",
+                "reason": "Leases carry risks.",
+            },
+            {
+                "category": "signature_fields",
+                "applicable": True,
+                "type": "table",
+                "columns": ["Field type", "Party", "Page"],
+                "reason": "Leases must be signed.",
+            },
+        ],
+    }
+    fields = [
+        {
+            "field_type": "Signature",
+            "party": "Tenant",
+            "page": 2,
+            "bbox": [72.0, 100.0, 200.0, 115.0],
+            "signed": "No",
+            "source": "text",
+        }
+    ]
+    mocker.patch.object(agent.analyzer, "determine_analysis_steps", return_value=steps)
+    analyze = mocker.patch.object(
+        agent.analyzer,
+        "analyze_text",
+        return_value={"document_type": "Lease", "risks": ["Late rent"]},
+    )
+    mocker.patch(
+        "se.modules.agent_controller.locate_signature_fields", return_value=fields
+    )
+
+    result, result_steps = agent.run("tests/resources/blank.pdf")
+
+    assert result["signature_fields"] == fields
+    assert result_steps == steps
+    sent_steps = analyze.call_args.kwargs["steps"]
+    assert [s["category"] for s in sent_steps["analysis_steps"]] == ["risks"]
+    assert events[:2] == [("planning", {}), ("steps", steps)]
+    assert ("category", {"category": "signature_fields", "result": fields}) in events
@@ -0,0 +1,78 @@
+import io
+import json
+import shutil
+from pathlib import Path
+
+import pytest
+
+from se.modules.batch_profiler import (
+    ProfileSummary,
+    open_output,
+    profile_directory,
+    read_processed_paths,
+)
+
+
+@pytest.fixture
+def pdf_dir(tmp_path: Path) -> Path:
+    directory = tmp_path / "pdfs"
+    (directory / "nested").mkdir(parents=True)
+    shutil.copy("tests/resources/blank.pdf", directory / "blank.pdf")
+    shutil.copy("tests/resources/agreement-10.pdf", directory / "nested" / "a.pdf")
+    (directory / "notes.txt").write_text("not a pdf")
+    return directory
+
+
+def test_profile_directory_writes_ndjson(pdf_dir: Path) -> None:
+    output = io.StringIO()
+    summary = profile_directory(pdf_dir, output)
+
+    records = [json.loads(line) for line in output.getvalue().splitlines()]
+    assert [Path(r["path"]).name for r in records] == ["blank.pdf", "a.pdf"]
+    assert records[1]["pages"] == 2
+    assert records[1]["page_types"] == ["image-based", "image-based"]
+    assert records[1]["overall_type"] == "image-based"
+    assert len(records[1]["sha256"]) == 64
+    assert records[1]["elapsed_ms"] >= 0
+
+    assert summary.files == 2
+    assert summary.pages == 3
+    assert summary.errors == 0
+
+
+def test_profile_directory_with_workers(pdf_dir: Path) -> None:
+    output = io.StringIO()
+    summary = profile_directory(pdf_dir, output, workers=2)
+
+    paths = sorted(json.loads(line)["path"] for line in output.getvalue().splitlines())
+    assert [Path(p).name for p in paths] == ["blank.pdf", "a.pdf"]
+    assert summary.files == 2
+
+
+def test_profile_directory_resume(pdf_dir: Path, tmp_path: Path) -> None:
+    output_file = tmp_path / "out.ndjson"
+    blank = str(pdf_dir / "blank.pdf")
+    # A previous run processed one file and was interrupted mid-line
+    output_file.write_text(json.dumps({"path": blank}) + '\n{"path": "trunc')
+
+    skip = read_processed_paths(output_file)
+    assert skip == {blank}
+
+    with open_output(output_file, resume=True) as stream:
+        summary = profile_directory(pdf_dir, stream, skip=skip)
+
+    assert summary.skipped == 1
+    assert summary.files == 1
+
+    lines = output_file.read_text().splitlines()
+    assert json.loads(lines[-1])["path"] == str(pdf_dir / "nested" / "a.pdf")
+    assert read_processed_paths(output_file) == {
+        blank,
+        str(pdf_dir / "nested" / "a.pdf"),
+    }
+
+
+def test_summary_p95_latency() -> None:
+    summary = ProfileSummary(latencies_ms=[float(i) for i in range(1, 101)])
+    assert summary.p95_latency_ms == 95.0
+    assert ProfileSummary().p95_latency_ms == 0.0
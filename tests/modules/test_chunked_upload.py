@@ -0,0 +1,125 @@
+import hashlib
+import io
+import os
+
+import pytest
+
+from se.modules.chunked_upload import ChunkedUploads, OffsetMismatch, UploadNotFound
+from se.modules.upload_manager import UploadError, UploadManager
+
+DATA = os.urandom(300 * 1024)
+SHA256 = hashlib.sha256(DATA).hexdigest()
+
+
+def test_upload_in_chunks(tmp_path, mocker) -> None:
+    uploads = ChunkedUploads(str(tmp_path / ".chunks"))
+    upload = uploads.create("Bundle.pdf", "application/pdf", len(DATA))
+    sha256 = mocker.spy(hashlib, "sha256")
+
+    for offset in range(0, len(DATA), 100 * 1024):
+        chunk = DATA[offset : offset + 100 * 1024]
+        state = uploads.write_chunk(upload.upload_id, offset, io.BytesIO(chunk))
+        assert state.offset == offset + len(chunk)
+    assert uploads.get(upload.upload_id).is_complete()
+
+    info = uploads.finalize(upload.upload_id, UploadManager(str(tmp_path)))
+    assert info.sha256_content == SHA256
+    assert (tmp_path / info.filename).read_bytes() == DATA
+    assert info.orig_filename == "Bundle.pdf"
+    assert list((tmp_path / ".chunks").iterdir()) == []
+    # Hashed as the chunks arrived, not read again
+    assert sha256.call_count == 0
+
+    # The part of a known content is kept until the upload is settled
+    again = uploads.create("Bundle.pdf", "application/pdf", len(DATA))
+    uploads.write_chunk(again.upload_id, 0, io.BytesIO(DATA))
+    manager = UploadManager(str(tmp_path))
+    copy = uploads.finalize(again.upload_id, manager)
+    assert not copy.created and os.path.exists(copy.copy_path)
+    manager.settle(copy)
+    assert list((tmp_path / ".chunks").iterdir()) == []
+
+
+class Dropped(io.BytesIO):
+    """A request body cut by a dropped connection after 70 KB."""
+
+    def read(self, size=-1):
+        if self.tell() >= 70 * 1024:
+            raise ConnectionError("Client disconnected")
+        return super().read(size)
+
+
+def test_resume_after_dropped_connection(tmp_path) -> None:
+    uploads = ChunkedUploads(str(tmp_path / ".chunks"))
+    upload = uploads.create("Bundle.pdf", "application/pdf", len(DATA))
+
+    with pytest.raises(ConnectionError):
+        uploads.write_chunk(upload.upload_id, 0, Dropped(DATA))
+    offset = uploads.get(upload.upload_id).offset
+    assert 0 < offset < len(DATA)
+
+    with pytest.raises(OffsetMismatch) as e:
+        uploads.write_chunk(upload.upload_id, 0, io.BytesIO(DATA))
+    assert e.value.offset == offset
+
+    # Resumed by another process, which hashes the received bytes again
+    other = ChunkedUploads(str(tmp_path / ".chunks"))
+    other.write_chunk(upload.upload_id, offset, io.BytesIO(DATA[offset:]))
+    info = other.finalize(upload.upload_id, UploadManager(str(tmp_path)))
+    assert info.sha256_content == SHA256
+
+
+def test_resume_within_a_chunk(tmp_path) -> None:
+    chunk_size = 150 * 1024
+    uploads = ChunkedUploads(str(tmp_path / ".chunks"))
+    upload = uploads.create("Bundle.pdf", "application/pdf", len(DATA))
+    uploads.write_chunk(upload.upload_id, 0, io.BytesIO(DATA[:chunk_size]))
+
+    second = DATA[chunk_size : 2 * chunk_size]
+    with pytest.raises(ConnectionError):
+        uploads.write_chunk(upload.upload_id, chunk_size, Dropped(second))
+    offset = uploads.get(upload.upload_id).offset
+    assert chunk_size < offset < 2 * chunk_size
+
+    # The whole chunk sent again at the stored offset goes past the upload
+    with pytest.raises(UploadError, match="exceeds the size"):
+        uploads.write_chunk(upload.upload_id, offset, io.BytesIO(second))
+    assert uploads.get(upload.upload_id).offset == offset
+
+    # The rest of the chunk, sliced again from the stored offset as the
+    # upload form does
+    uploads.write_chunk(
+        upload.upload_id, offset, io.BytesIO(DATA[offset : 2 * chunk_size])
+    )
+
+    info = uploads.finalize(upload.upload_id, UploadManager(str(tmp_path)))
+    assert (tmp_path / info.filename).read_bytes() == DATA
+
+
+def test_upload_errors(tmp_path) -> None:
+    uploads = ChunkedUploads(str(tmp_path / ".chunks"), max_size=len(DATA))
+    with pytest.raises(UploadError, match="maximum limit"):
+        uploads.create("Bundle.pdf", "application/pdf", len(DATA) + 1)
+
+    upload = uploads.create("Bundle.pdf", "application/pdf", 10)
+    with pytest.raises(UploadError, match="exceeds the size"):
+        uploads.write_chunk(upload.upload_id, 0, io.BytesIO(DATA[:11]))
+    with pytest.raises(UploadError, match="incomplete"):
+        uploads.finalize(upload.upload_id, UploadManager(str(tmp_path)))
+
+    for upload_id in ("0" * 32, "../../etc/passwd"):
+        assert uploads.get(upload_id) is None
+        with pytest.raises(UploadNotFound):
+            uploads.write_chunk(upload_id, 0, io.BytesIO(b"x"))
+
+
+def test_cleanup_deletes_expired_uploads(tmp_path) -> None:
+    uploads = ChunkedUploads(str(tmp_path), expiry=60)
+    expired = uploads.create("old.pdf", "application/pdf", 10)
+    for name in os.listdir(tmp_path):
+        os.utime(tmp_path / name, (0, 0))
+    active = uploads.create("new.pdf", "application/pdf", 10)
+
+    assert uploads.get(expired.upload_id) is None
+    assert uploads.get(active.upload_id) is not None
+    assert uploads.cleanup() == 0
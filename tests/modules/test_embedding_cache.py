@@ -0,0 +1,54 @@
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.schema import TextNode
+
+from se.modules.embedding_cache import (
+    EmbeddingCache,
+    embed_nodes_cached,
+    get_embedding_cache,
+    text_hash,
+)
+
+
+def test_text_hash_ignores_whitespace() -> None:
+    assert text_hash("Payment  terms\n apply") == text_hash("Payment terms apply")
+    assert text_hash("Payment terms apply") != text_hash("Payment terms")
+
+
+def test_get_and_put_many(tmp_path) -> None:
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3")
+    cache.put_many("model", {"a": [0.5, 1.0], "b": [2.0, 0.25]})
+
+    assert cache.get_many("model", ["a", "b", "c"]) == {
+        "a": [0.5, 1.0],
+        "b": [2.0, 0.25],
+    }
+    assert cache.get_many("other", ["a"]) == {}
+
+    # Persistent across instances
+    assert EmbeddingCache(tmp_path / "embeddings.sqlite3").count() == 2
+
+
+def test_embed_nodes_cached_only_embeds_unseen_chunks(tmp_path, mocker) -> None:
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3")
+    model = MockEmbedding(embed_dim=4)
+    embed = mocker.spy(MockEmbedding, "_get_text_embeddings")
+
+    stats = embed_nodes_cached(
+        [TextNode(text="Clause one"), TextNode(text="Clause two")], model, cache
+    )
+    assert (stats.hits, stats.misses) == (0, 2)
+
+    nodes = [TextNode(text="Clause  two"), TextNode(text="Clause three")]
+    stats = embed_nodes_cached(nodes, model, cache)
+
+    assert (stats.hits, stats.misses) == (1, 1)
+    assert stats.hit_ratio == 0.5
+    assert embed.call_args.args[1] == ["Clause three"]
+    assert all(node.embedding is not None for node in nodes)
+
+
+def test_get_embedding_cache(tmp_path) -> None:
+    config = {"EMBEDDING_CACHE_PATH": str(tmp_path / "embeddings.sqlite3")}
+
+    assert get_embedding_cache(config) is get_embedding_cache(config)
+    assert get_embedding_cache({"EMBEDDING_CACHE_ENABLED": False}) is None
@@ -0,0 +1,112 @@
+from se.modules.extractors import (
+    QUERIED,
+    SKIPPED,
+    AmountExtractor,
+    DateExtractor,
+    ExtractionStats,
+    PartyExtractor,
+    default_extractors,
+    pre_extract,
+)
+
+CONTRACT = """PURCHASE AGREEMENT
+This Purchase Agreement is made between ACME Holdings Inc., a Delaware
+corporation ("Seller") and John Smith (hereinafter referred to as the "Buyer").
+Effective Date: January 5th, 2025
+The purchase price is $125,000.50 payable in full.
+A deposit of 5,000 USD is due on 2025-02-01.
+"""
+
+
+def test_dates_are_normalized():
+    """Test that dates in different formats are normalized and labelled."""
+    records, unambiguous = DateExtractor().find(CONTRACT)
+
+    assert records == [
+        {"date": "2025-01-05", "details": "Effective date"},
+        {"date": "2025-02-01", "details": "Due"},
+    ]
+    assert unambiguous is True
+
+
+def test_numeric_dates_are_ambiguous():
+    """Test that numeric dates with day and month up to 12 are ambiguous."""
+    records, unambiguous = DateExtractor().find("Signed on 03/04/2025")
+    assert records == [{"date": "2025-03-04", "details": "Signed"}]
+    assert unambiguous is False
+
+    records, unambiguous = DateExtractor().find("Signed on 25/04/2025")
+    assert records == [{"date": "2025-04-25", "details": "Signed"}]
+    assert unambiguous is True
+
+
+def test_amounts_are_normalized():
+    """Test that amounts get a decimal value and a currency code."""
+    records, unambiguous = AmountExtractor().find(CONTRACT)
+
+    assert records == [
+        {"amount": "125000.50", "currency": "USD", "details": "Purchase price"},
+        {"amount": "5000.00", "currency": "USD", "details": "Deposit"},
+    ]
+    assert unambiguous is True
+
+
+def test_parties_are_extracted_by_role():
+    """Test that parties are found from their defined roles."""
+    records, unambiguous = PartyExtractor().find(CONTRACT)
+
+    assert records == [
+        {"name": "ACME Holdings Inc.", "role": "Seller"},
+        {"name": "John Smith", "role": "Buyer"},
+    ]
+    assert unambiguous is True
+
+
+def test_unknown_defined_terms_are_not_parties():
+    """Test that defined terms other than party roles are ignored."""
+    records, _ = PartyExtractor().find('This Lease (the "Agreement") is signed.')
+    assert records == []
+
+
+def test_pre_extract_formats_by_step_type():
+    """Test that extractions follow the format of the analysis steps."""
+    steps = [
+        {"category": "dates", "type": "table", "columns": ["Date", "Details"]},
+        {"category": "parties", "type": "list"},
+        {"category": "amounts", "type": "table", "columns": ["Amount", "Payer"]},
+        {"category": "risks", "type": "list"},
+    ]
+
+    extractions = pre_extract(CONTRACT, steps, default_extractors())
+
+    assert set(extractions) == {"dates", "parties", "amounts"}
+    assert extractions["dates"].confident is True
+    assert extractions["dates"].value[0] == {
+        "date": "2025-01-05",
+        "details": "Effective date",
+    }
+    assert extractions["parties"].value == [
+        "ACME Holdings Inc. - Seller",
+        "John Smith - Buyer",
+    ]
+    # The "Payer" column can't be filled by rules
+    assert extractions["amounts"].confident is False
+    assert extractions["amounts"].value[0] == {"amount": "125000.50", "payer": ""}
+
+
+def test_extraction_stats_skip_rates():
+    """Test the skip rates computed from recorded outcomes."""
+    stats = ExtractionStats()
+    stats.record("dates", SKIPPED)
+    stats.record("dates", SKIPPED)
+    stats.record("dates", QUERIED)
+    stats.record("risks", QUERIED)
+
+    rates = stats.skip_rates()
+    assert rates["dates"]["skip_rate"] == 2 / 3
+    assert rates["risks"] == {
+        "skipped": 0,
+        "verified": 0,
+        "queried": 1,
+        "skip_rate": 0.0,
+    }
@@ -0,0 +1,83 @@
+import threading
+import time
+from types import SimpleNamespace
+
+from se.modules.index_cache import IndexCache, estimate_index_size
+
+
+def _cache(max_bytes: int) -> IndexCache:
+    return IndexCache(max_bytes=max_bytes, sizeof=len)
+
+
+def test_get_or_load_counts_hits_and_misses() -> None:
+    cache = _cache(100)
+    calls = []
+
+    def load():
+        calls.append(1)
+        return "index"
+
+    assert cache.get_or_load("a", load) == "index"
+    assert cache.get_or_load("a", load) == "index"
+
+    assert len(calls) == 1
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 5)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_lru_eviction_by_size() -> None:
+    cache = _cache(10)
+    cache.get_or_load("a", lambda: "aaaa")
+    cache.get_or_load("b", lambda: "bbbb")
+    cache.get_or_load("a", lambda: "xxxx")  # "a" is now the most recent
+    cache.get_or_load("c", lambda: "cccc")
+
+    assert cache.get_or_load("a", lambda: "new") == "aaaa"
+    assert cache.get_or_load("b", lambda: "new") == "new"
+    assert cache.stats()["evictions"] >= 1
+    assert cache.stats()["size"] <= 10
+
+
+def test_value_larger_than_budget_is_not_cached() -> None:
+    cache = _cache(3)
+
+    assert cache.get_or_load("a", lambda: "aaaa") == "aaaa"
+    assert cache.stats()["entries"] == 0
+    assert cache.get_or_load("a", lambda: "new") == "new"
+
+
+def test_concurrent_requests_load_once() -> None:
+    cache = _cache(100)
+    calls = []
+
+    def load():
+        calls.append(1)
+        time.sleep(0.05)
+        return "index"
+
+    results = []
+    threads = [
+        threading.Thread(target=lambda: results.append(cache.get_or_load("a", load)))
+        for _ in range(8)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert results == ["index"] * 8
+    assert len(calls) == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_estimate_index_size() -> None:
+    node = SimpleNamespace(get_content=lambda: "hello", metadata={"page_label": "1"})
+    index = SimpleNamespace(
+        docstore=SimpleNamespace(docs={"n1": node}),
+        vector_store=SimpleNamespace(
+            data=SimpleNamespace(embedding_dict={"n1": [0.1, 0.2]})
+        ),
+    )
+
+    assert estimate_index_size(index) > len("hello") + 2 * 8
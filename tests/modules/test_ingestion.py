@@ -0,0 +1,78 @@
+import threading
+import time
+
+import pytest
+
+from se.modules.ingestion import Pipeline, batched
+
+
+def test_pipeline_runs_stages_in_order() -> None:
+    pipeline = (
+        Pipeline(queue_size=2)
+        .add_stage("split", lambda items: (c for item in items for c in item))
+        .add_stage("batch", lambda items: batched(items, 3))
+    )
+
+    assert pipeline.run("source", ["ab", "cde", "f", "gh"]) == [
+        ["a", "b", "c"],
+        ["d", "e", "f"],
+        ["g", "h"],
+    ]
+    names = [stage.name for stage in pipeline.metrics.stages]
+    assert names == ["source", "split", "batch"]
+    split = pipeline.metrics.stages[1]
+    assert (split.items_in, split.items_out) == (4, 8)
+
+
+def test_pipeline_overlaps_stages() -> None:
+    consumed = threading.Event()
+
+    def source():
+        yield 1
+        # The next stage takes the first item while the source still runs
+        assert consumed.wait(timeout=5)
+        yield 2
+
+    def consume(items):
+        for item in items:
+            consumed.set()
+            yield item
+
+    pipeline = Pipeline().add_stage("consume", consume)
+    assert pipeline.run("source", source()) == [1, 2]
+
+
+def test_pipeline_applies_backpressure() -> None:
+    produced = []
+
+    def source():
+        for i in range(20):
+            produced.append(i)
+            yield i
+
+    def slow(items):
+        for item in items:
+            # The source can't run ahead of the queues
+            assert len(produced) - item <= 2 * 2 + 3
+            time.sleep(0.005)
+            yield item
+
+    pipeline = Pipeline(queue_size=2).add_stage("slow", slow)
+    assert pipeline.run("source", source()) == list(range(20))
+
+    metrics = pipeline.metrics
+    assert metrics.bottleneck().name == "slow"
+    assert metrics.stages[0].blocked_time > 0
+    assert metrics.as_dict()["bottleneck"] == "slow"
+
+
+def test_pipeline_raises_stage_errors() -> None:
+    def fail(items):
+        for item in items:
+            if item == 3:
+                raise ValueError("Bad item")
+            yield item
+
+    pipeline = Pipeline(queue_size=1).add_stage("fail", fail)
+    with pytest.raises(ValueError, match="Bad item"):
+        pipeline.run("source", iter(range(1000)))
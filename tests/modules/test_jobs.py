@@ -0,0 +1,403 @@
+"""Tests for the analysis job queue."""
+
+import hashlib
+import io
+import os
+import shutil
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from se.app import create_app, db
+from se.models import AnalysisResult, Document, File, Job, JobEvent
+from se.modules.jobs import (
+    AnalysisError,
+    Worker,
+    claim_job,
+    enqueue_analysis,
+    extend_lock,
+    finish_job,
+    format_event,
+    stream_job_events,
+)
+from se.modules.upload_manager import UploadManager
+
+
+@pytest.fixture
+def db_app(tmp_path):
+    """Create an application with an empty in-memory database."""
+    app = create_app("testing")
+    app.config["UPLOADS_DIR"] = str(tmp_path)
+    app.config["OCR_ENABLED"] = False
+    app.config["SECRET_KEY"] = "test_secret_key"
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+@pytest.fixture
+def document(db_app, tmp_path):
+    shutil.copy("tests/resources/agreement-10.pdf", tmp_path / "a.pdf")
+    model_file = File.create(
+        sha256_content="abc",
+        filename="a.pdf",
+        orig_filename="a.pdf",
+        file_type="application/pdf",
+        file_size=(tmp_path / "a.pdf").stat().st_size,
+    )
+    return Document.create(file=model_file, type="Unknown")
+
+
+def _expire(job: Job):
+    job.locked_until = datetime.utcnow() - timedelta(seconds=1)
+    job.save()
+
+
+def test_claim_job_once(document):
+    job = enqueue_analysis(document, refresh=True)
+
+    claimed = claim_job("worker-1", 60)
+    assert claimed.id == job.id
+    assert (claimed.status, claimed.attempts) == (Job.PROCESSING, 1)
+    assert claimed.locked_by == "worker-1"
+    assert claimed.payload == {"refresh": True}
+
+    assert claim_job("worker-2", 60) is None
+
+
+def test_expired_job_is_claimed_again(document):
+    job = enqueue_analysis(document, max_attempts=2)
+    claim_job("worker-1", 60)
+    _expire(job)
+
+    claimed = claim_job("worker-2", 60)
+    assert (claimed.locked_by, claimed.attempts) == ("worker-2", 2)
+
+    # The crashed worker lost the job
+    assert extend_lock(job.id, "worker-1", 60) is False
+    assert extend_lock(job.id, "worker-2", 60) is True
+
+    # No attempts left
+    _expire(job)
+    assert claim_job("worker-3", 60) is None
+    db.session.refresh(job)
+    assert job.status == Job.FAILED
+
+
+def test_claim_job_shares_workers_between_clients(document):
+    first = enqueue_analysis(document, client="10.0.0.1")
+    second = enqueue_analysis(document, client="10.0.0.1")
+    other = enqueue_analysis(document, client="10.0.0.2")
+
+    assert claim_job("worker-1", 60).id == first.id
+    # The other client has no running job, it goes before the older job
+    assert claim_job("worker-2", 60).id == other.id
+    assert claim_job("worker-3", 60).id == second.id
+
+
+def test_claim_job_max_in_flight(document):
+    first = enqueue_analysis(document)
+    second = enqueue_analysis(document)
+
+    assert claim_job("worker-1", 60, max_in_flight=1).id == first.id
+    assert claim_job("worker-2", 60, max_in_flight=1) is None
+
+    finish_job(first, "worker-1")
+    assert claim_job("worker-2", 60, max_in_flight=1).id == second.id
+
+
+def test_finish_job(document):
+    job = enqueue_analysis(document, max_attempts=2)
+    claim_job("worker-1", 60)
+
+    finish_job(job, "worker-1", error="Rate limit", retry=True)
+    assert (job.status, job.locked_by) == (Job.QUEUED, None)
+
+    claim_job("worker-1", 60)
+    finish_job(job, "worker-2", error="Not the owner")
+    assert job.status == Job.PROCESSING
+
+    finish_job(job, "worker-1", error="Rate limit", retry=True)
+    assert (job.status, job.error) == (Job.FAILED, "Rate limit")
+
+    # The worker that lost the lock recorded no event
+    events = JobEvent.query.filter_by(job_id=job.id).order_by(JobEvent.id).all()
+    assert [event.event for event in events] == [Job.QUEUED, Job.FAILED]
+
+
+def test_format_event():
+    assert format_event("category", {"category": "parties"}, 3) == (
+        'id: 3\nevent: category\ndata: {"category": "parties"}\n\n'
+    )
+    assert format_event("done", {}) == "event: done\ndata: {}\n\n"
+
+
+def test_stream_job_events(document):
+    job = enqueue_analysis(document)
+    claim_job("worker-1", 60)
+    first = JobEvent.create(job_id=job.id, event="planning", data={})
+    JobEvent.create(job_id=job.id, event="category", data={"category": "parties"})
+    finish_job(job, "worker-1", error="Boom")
+
+    messages = list(stream_job_events(job.id, poll_interval=0))
+    assert messages[0].startswith("retry: ")
+    assert [message.split("\n")[1] for message in messages[1:]] == [
+        "event: planning",
+        "event: category",
+        "event: failed",
+    ]
+
+    # Resumed after the last event received by the browser
+    messages = list(stream_job_events(job.id, last_event_id=first.id, poll_interval=0))
+    assert len(messages) == 3
+
+
+def test_stream_finished_job_without_events(document):
+    job = enqueue_analysis(document)
+    job.status = Job.FAILED
+    job.save()
+
+    messages = list(stream_job_events(job.id, poll_interval=0))
+    assert messages[-1].startswith("event: failed\n")
+    assert list(stream_job_events(999, poll_interval=0)) == [messages[0]]
+
+
+def test_stream_job_events_ends_after_max_duration(document):
+    job = enqueue_analysis(document)
+
+    messages = list(stream_job_events(job.id, poll_interval=0.01, max_duration=0.05))
+    # The browser reconnects to get the next events
+    assert len(messages) == 1 and messages[0].startswith("retry: ")
+
+
+def test_worker_runs_jobs(db_app, document, mocker):
+    def analyze(document, refresh=False, on_event=None):
+        on_event("category", {"category": "parties", "result": ["A", "B"]})
+        return AnalysisResult.create(
+            document=document, analysis_result="{}", analysis_steps="{}"
+        )
+
+    mocker.patch("se.modules.jobs.analyze_document", side_effect=analyze)
+    done = enqueue_analysis(document)
+
+    Worker(db_app, visibility_timeout=60).run(burst=True)
+
+    db.session.refresh(done)
+    assert done.status == Job.DONE
+    assert done.analysis_result_id is not None
+    events = JobEvent.query.filter_by(job_id=done.id).order_by(JobEvent.id).all()
+    assert [event.event for event in events] == ["category", Job.DONE]
+    assert events[-1].data == {
+        "error": None,
+        "analysis_result_id": done.analysis_result_id,
+    }
+
+
+def test_worker_retries_failed_jobs(db_app, document, mocker):
+    analyze = mocker.patch(
+        "se.modules.jobs.analyze_document", side_effect=RuntimeError("Timeout")
+    )
+    job = enqueue_analysis(document, max_attempts=2)
+
+    Worker(db_app, visibility_timeout=60).run(burst=True)
+
+    db.session.refresh(job)
+    assert analyze.call_count == 2
+    assert (job.status, job.attempts, job.error) == (Job.FAILED, 2, "Timeout")
+
+
+def test_worker_does_not_retry_analysis_errors(db_app, document, mocker):
+    analyze = mocker.patch(
+        "se.modules.jobs.analyze_document",
+        side_effect=AnalysisError("SA1001", "No analysis steps."),
+    )
+    job = enqueue_analysis(document)
+
+    Worker(db_app, visibility_timeout=60).run(burst=True)
+
+    db.session.refresh(job)
+    assert analyze.call_count == 1
+    assert job.status == Job.FAILED
+    assert "SA1001" in job.error
+
+
+def test_analysis_page_waits_for_job(db_app, document):
+    job = enqueue_analysis(document)
+    client = db_app.test_client()
+
+    html = client.get(f"/analysis?job={job.id}").get_data(as_text=True)
+    assert f"/jobs/{job.id}" in html
+    assert client.get(f"/jobs/{job.id}").get_json()["status"] == Job.QUEUED
+
+    result = AnalysisResult.create(
+        document=document, analysis_result="{}", analysis_steps="{}"
+    )
+    job.status, job.analysis_result = Job.DONE, result
+    job.save()
+
+    status = client.get(f"/jobs/{job.id}").get_json()
+    assert status["analysis_url"] == f"/analysis?a={result.id}"
+    assert client.get("/jobs/999").status_code == 404
+
+
+def test_job_events_endpoint(db_app, document):
+    job = enqueue_analysis(document)
+    claim_job("worker-1", 60)
+    finish_job(job, "worker-1")
+    client = db_app.test_client()
+
+    response = client.get(f"/jobs/{job.id}/events")
+    assert response.mimetype == "text/event-stream"
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert "event: done" in response.get_data(as_text=True)
+
+    # Reconnected after the last event: only the status of the job is sent
+    response = client.get(f"/jobs/{job.id}/events", headers={"Last-Event-ID": "999"})
+    data = response.get_data(as_text=True)
+    assert "event: done" in data and "id: " not in data
+    assert client.get("/jobs/999/events").status_code == 404
+
+    # The stream of a running job is closed after JOB_EVENTS_MAX_DURATION
+    db_app.config["JOB_EVENTS_MAX_DURATION"] = 0
+    running = enqueue_analysis(document)
+    data = client.get(f"/jobs/{running.id}/events").get_data(as_text=True)
+    assert data.startswith("retry: ") and "event: " not in data
+
+
+def test_upload_reuses_known_content(db_app, document):
+    client = db_app.test_client()
+
+    def upload(query=""):
+        with open("tests/resources/agreement-10.pdf", "rb") as f:
+            return client.post(f"/upload{query}", data={"file": (f, "Contract.pdf")})
+
+    response = upload()
+    first = Job.query.order_by(Job.id.desc()).first()
+    assert response.location == f"/analysis?job={first.id}"
+    model_file = first.document.file
+    assert model_file.filename.endswith(f"/{model_file.sha256_content}.pdf")
+
+    # Still being analyzed
+    assert upload().location == f"/analysis?job={first.id}"
+
+    result = AnalysisResult.create(
+        document=first.document, analysis_result="{}", analysis_steps="{}"
+    )
+    assert upload().location == f"/analysis?a={result.id}"
+    assert Job.query.count() == 1
+    assert File.query.filter(File.id != document.file_id).count() == 1
+    # Reused analyses don't add documents of the file
+    db.session.refresh(model_file)
+    assert model_file.ref_count == 1
+
+    # A refresh analyzes the known content again
+    upload("?refresh=1")
+    assert Job.query.count() == 2
+    assert Job.query.order_by(Job.id.desc()).first().document.file == model_file
+    db.session.refresh(model_file)
+    assert model_file.ref_count == 2
+
+
+def test_upload_restores_content_released_meanwhile(db_app, document, mocker):
+    client = db_app.test_client()
+
+    def upload():
+        with open("tests/resources/agreement-10.pdf", "rb") as f:
+            client.post("/upload?refresh=1", data={"file": (f, "Contract.pdf")})
+
+    upload()
+    model_file = Job.query.order_by(Job.id.desc()).first().document.file
+    store_file = UploadManager.store_file
+
+    def released_after_store(*args, **kwargs):
+        # The last document expires once the upload found the content
+        file_info = store_file(*args, **kwargs)
+        assert not file_info.created
+        assert model_file.release() is True
+        return file_info
+
+    mocker.patch.object(UploadManager, "store_file", released_after_store)
+    upload()
+
+    db.session.refresh(model_file)
+    assert model_file.ref_count == 1
+    assert os.path.exists(model_file.get_path())
+    uploads_dir = Path(db_app.config["UPLOADS_DIR"])
+    assert not list(uploads_dir.glob(".upload-*"))
+
+
+def test_upload_keeps_content_of_missing_legacy_file(db_app, document, tmp_path):
+    document.file.sha256_content = hashlib.sha256(
+        Path("tests/resources/agreement-10.pdf").read_bytes()
+    ).hexdigest()
+    document.file.save()
+    (tmp_path / "a.pdf").unlink()
+    client = db_app.test_client()
+
+    with open("tests/resources/agreement-10.pdf", "rb") as f:
+        client.post("/upload", data={"file": (f, "Contract.pdf")})
+
+    # The new copy is kept and used by the file
+    db.session.refresh(document.file)
+    assert document.file.filename != "a.pdf"
+    assert os.path.exists(document.file.get_path())
+
+
+def test_upload_rejects_large_file(db_app, document):
+    db_app.config["MAX_FILE_SIZE"] = 1024
+    client = db_app.test_client()
+
+    with open("tests/resources/agreement-10.pdf", "rb") as f:
+        response = client.post("/upload", data={"file": (f, "Contract.pdf")})
+
+    assert response.location == "/sender"
+    assert File.query.count() == 1
+    assert Job.query.count() == 0
+
+
+def test_upload_cuts_off_oversized_body(db_app, document, mocker):
+    db_app.config["MAX_FILE_SIZE"] = 1024
+    save_file = mocker.spy(UploadManager, "save_file")
+    client = db_app.test_client()
+
+    data = {"file": (io.BytesIO(b"%PDF" + bytes(1024 * 1024)), "Contract.pdf")}
+    response = client.post("/upload", data=data, follow_redirects=True)
+
+    assert "exceeds the maximum limit" in response.get_data(as_text=True)
+    save_file.assert_not_called()
+    assert Job.query.count() == 0
+
+
+def test_chunked_upload_endpoints(db_app, document):
+    db_app.config["MAX_FILE_SIZE"] = 1024
+    client = db_app.test_client()
+    with open("tests/resources/agreement-10.pdf", "rb") as f:
+        data = f.read()
+
+    response = client.post(
+        "/uploads", json={"filename": "Contract.pdf", "size": len(data)}
+    )
+    assert response.status_code == 201
+    url = response.json["url"]
+    assert response.headers["Location"] == url
+
+    half = len(data) // 2
+    assert client.put(f"{url}?offset=0", data=data[:half]).json["offset"] == half
+    # The chunk was sent again, after a lost response
+    response = client.put(f"{url}?offset=0", data=data[:half])
+    assert (response.status_code, response.json["offset"]) == (409, half)
+    assert client.get(url).json["offset"] == half
+
+    assert client.post(f"{url}/finalize").status_code == 400
+    client.put(f"{url}?offset={half}", data=data[half:])
+    redirect_to = client.post(f"{url}/finalize").json["redirect"]
+
+    job = Job.query.order_by(Job.id.desc()).first()
+    assert redirect_to == f"/analysis?job={job.id}"
+    assert job.document.file.file_size == len(data)
+    assert client.get(url).status_code == 404
+    assert client.post("/uploads", json={"filename": "a.exe"}).status_code == 400
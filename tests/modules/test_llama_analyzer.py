@@ -0,0 +1,375 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+
+from llama_index.core import Settings, VectorStoreIndex
+from llama_index.core.embeddings import MockEmbedding
+from llama_index.core.llms import CompletionResponse, CustomLLM, LLMMetadata
+from llama_index.core.llms.callbacks import llm_completion_callback
+from llama_index.core.schema import NodeWithScore, TextNode
+
+from se.modules.embedding_cache import EmbeddingCache
+from se.modules.index_cache import index_cache
+from se.modules.llama_analyzer import LlamaAnalyzer, load_documents
+from se.modules.prompt_context import count_tokens
+from se.modules.response_cache import ResponseCache
+
+
+def test_load_documents_from_pages() -> None:
+    pages = [
+        {"page_number": 2, "page_content": "Second page"},
+        {"page_number": 1, "page_content": "First page"},
+    ]
+
+    docs = load_documents("tests/resources/blank.pdf", pages)
+
+    assert [doc.text for doc in docs] == ["First page", "Second page"]
+    assert [doc.metadata["page_label"] for doc in docs] == ["1", "2"]
+    assert docs[0].metadata["file_name"] == "blank.pdf"
+    assert "file_name" in docs[0].excluded_llm_metadata_keys
+
+
+def test_load_documents_from_pdf() -> None:
+    docs = load_documents("tests/resources/agreement-10.pdf")
+
+    assert len(docs) == 2
+    assert [doc.metadata["page_label"] for doc in docs] == ["1", "2"]
+
+
+def test_analyze_text_skips_queries_answered_by_rules(tmp_path, mocker) -> None:
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path)
+    mocker.patch.object(analyzer, "_load_index")
+    query = mocker.patch.object(
+        analyzer, "query", return_value='{"risks": ["Late payment"]}'
+    )
+    stats = mocker.patch("se.modules.llama_analyzer.extraction_stats")
+    pages = [
+        {
+            "page_number": 1,
+            "page_content": "Effective Date: 2025-01-05\nTermination date: 2026-01-05",
+        }
+    ]
+    steps = {
+        "document_type": "Lease",
+        "analysis_steps": [
+            {"category": "dates", "type": "table", "columns": ["Date", "Details"]},
+            {"category": "risks", "type": "list"},
+        ],
+    }
+
+    result = analyzer.analyze_text("tests/resources/blank.pdf", steps, pages=pages)
+
+    assert query.call_count == 1
+    assert query.call_args.args[1] == "risks"
+    assert result["dates"] == [
+        {"date": "2025-01-05", "details": "Effective date"},
+        {"date": "2026-01-05", "details": "Termination date"},
+    ]
+    assert result["risks"] == ["Late payment"]
+    stats.record.assert_any_call("dates", "skipped")
+    stats.record.assert_any_call("risks", "queried")
+    # Stored with the metrics of the analysis
+    assert analyzer.metrics.as_dict()["pre_extraction"]["dates"]["skipped"] == 1
+    assert analyzer.metrics.as_dict()["pre_extraction"]["risks"]["skip_rate"] == 0
+
+
+def test_load_index_uses_process_wide_cache(tmp_path, mocker) -> None:
+    mocker.patch.object(index_cache, "_entries", OrderedDict())
+    mocker.patch.object(index_cache, "max_bytes", 1024)
+    (tmp_path / "index" / "blank.pdf").mkdir(parents=True)
+    mocker.patch("se.modules.llama_analyzer.StorageContext")
+    index = mocker.Mock()
+    index.docstore.docs = {}
+    index.vector_store.data.embedding_dict = {}
+    load = mocker.patch(
+        "se.modules.llama_analyzer.load_index_from_storage", return_value=index
+    )
+
+    for _ in range(3):
+        LlamaAnalyzer(persist_dir=tmp_path)._load_index("tests/resources/blank.pdf")
+
+    assert load.call_count == 1
+
+
+def test_analyze_text_queries_categories_concurrently(tmp_path, mocker) -> None:
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, query_concurrency=4)
+    mocker.patch.object(analyzer, "_load_index")
+    prompts = {}
+
+    async def aretrieve(query_bundle):
+        return []
+
+    async def asynthesize(query_bundle, nodes):
+        await asyncio.sleep(0.1)
+        prompt = query_bundle.query_str
+        key = next(k for k in ("alpha", "beta", "gamma", "delta") if k in prompt)
+        prompts[key] = prompt
+        return json.dumps({key: [key.upper()]})
+
+    analyzer.query_engine = mocker.Mock()
+    analyzer.query_engine.aretrieve = aretrieve
+    analyzer.query_engine.asynthesize = asynthesize
+    events = []
+    analyzer.on_event = lambda event, data: events.append((event, data))
+    steps = {
+        "document_type": "Lease",
+        "analysis_steps": [
+            {"category": category, "type": "list", "reason": f"Find {category}."}
+            for category in ("alpha", "beta", "gamma", "delta")
+        ],
+    }
+
+    started = time.perf_counter()
+    result = analyzer.analyze_text("tests/resources/blank.pdf", steps)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 0.3
+    assert list(result) == ["document_type", "alpha", "beta", "gamma", "delta"]
+    assert result["gamma"] == ["GAMMA"]
+    # Only the document type is shared between the concurrent queries
+    for key, prompt in prompts.items():
+        assert prompt.endswith('{"document_type":"Lease"}')
+        assert all(other.upper() not in prompt for other in prompts)
+    # Each category is sent as soon as its query is done
+    assert sorted(data["category"] for _, data in events) == sorted(prompts)
+    assert ("category", {"category": "beta", "result": ["BETA"]}) in events
+
+
+def test_analyze_text_batches_small_categories(tmp_path, mocker) -> None:
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, batch_token_budget=2000)
+    mocker.patch.object(analyzer, "_load_index")
+    responses = {
+        "batch:notes+risks+terms": '{"notes": "None", "risks": "not a list"}',
+        "risks": '{"risks": ["Late payment"]}',
+        "terms": '{"terms": ["Net 30"]}',
+    }
+    query = mocker.patch.object(
+        analyzer, "query", side_effect=lambda prompt, key: responses[key]
+    )
+    steps = {
+        "analysis_steps": [
+            {"category": "notes", "type": "text", "reason": "Notes."},
+            {"category": "risks", "type": "list", "reason": "Risks."},
+            {"category": "terms", "type": "list", "reason": "Terms."},
+            {
+                "category": "obligations",
+                "type": "table",
+                "columns": ["Party", "Obligation"],
+                "reason": "Obligations.",
+            },
+        ],
+    }
+    responses["obligations"] = '{"obligations": []}'
+
+    result = analyzer.analyze_text("tests/resources/blank.pdf", steps)
+
+    keys = [call.args[1] for call in query.call_args_list]
+    assert keys == ["obligations", "batch:notes+risks+terms", "risks", "terms"]
+    batch_prompt = query.call_args_list[1].args[0]
+    assert "### notes" in batch_prompt and "### terms" in batch_prompt
+    assert result == {
+        "notes": "None",
+        "risks": ["Late payment"],
+        "terms": ["Net 30"],
+        "obligations": [],
+    }
+
+
+def test_group_steps_by_token_budget(tmp_path) -> None:
+    steps = [
+        {"category": f"category_{i}", "type": "list", "reason": "x" * 400}
+        for i in range(5)
+    ]
+
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, batch_token_budget=400)
+    groups = analyzer._group_steps(steps)
+
+    assert [len(group) for group in groups] == [2, 2]
+    assert groups[0][0]["category"] == "category_0"
+
+
+def test_query_uses_response_cache(tmp_path, mocker) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, response_cache=cache, model="m")
+    analyzer.content_hash = "abc"
+    analyzer.query_engine = mocker.Mock()
+    analyzer.query_engine.retrieve.return_value = []
+    analyzer.query_engine.synthesize.return_value = '{"risks": []}'
+
+    assert analyzer.query("List the risks", "risks") == '{"risks": []}'
+    assert analyzer.query("List the risks", "risks") == '{"risks": []}'
+    assert analyzer.query_engine.synthesize.call_count == 1
+
+    analyzer.refresh_cache = True
+    analyzer.query("List the risks", "risks")
+    assert analyzer.query_engine.synthesize.call_count == 2
+
+    analyzer.refresh_cache = False
+    analyzer.content_hash = "other"
+    analyzer.query("List the risks", "risks")
+    assert analyzer.query_engine.synthesize.call_count == 3
+
+
+def test_build_index_reuses_cached_embeddings(tmp_path, mocker) -> None:
+    model = MockEmbedding(embed_dim=8)
+    mocker.patch.object(Settings, "_embed_model", model)
+    embed = mocker.spy(MockEmbedding, "_get_text_embeddings")
+    cache = EmbeddingCache(tmp_path / "embeddings.sqlite3")
+    pages = [{"page_number": 1, "page_content": "The buyer pays the price."}]
+
+    for name in ("first.pdf", "second.pdf"):
+        file = tmp_path / name
+        file.write_bytes(b"%PDF-1.4")
+        analyzer = LlamaAnalyzer(persist_dir=tmp_path, embedding_cache=cache)
+        analyzer._build_index(str(file), load_documents(str(file), pages))
+
+    # The second upload has the same text under another path
+    assert embed.call_count == 1
+    assert analyzer.embedding_stats.hit_ratio == 1.0
+
+
+def test_analyze_text_compacts_context(tmp_path, mocker) -> None:
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, context_token_cap=200)
+    mocker.patch.object(analyzer, "_load_index")
+    responses = {
+        "obligations": '{"obligations": [{"party": "Tenant", "obligation": "Pay"}]}',
+        "dates": '{"dates": [{"date": "2025-01-05", "details": "Start"}]}',
+        "risks": '{"risks": ["Late payment"]}',
+    }
+    query = mocker.patch.object(
+        analyzer, "query", side_effect=lambda prompt, key: responses[key]
+    )
+    steps = {
+        "document_type": "Lease",
+        "analysis_steps": [
+            {"category": "obligations", "type": "table", "columns": ["Party"]},
+            {"category": "dates", "type": "table", "columns": ["Date", "Details"]},
+            {"category": "risks", "type": "list"},
+        ],
+    }
+
+    analyzer.analyze_text("tests/resources/blank.pdf", steps)
+
+    prompts = {call.args[1]: call.args[0] for call in query.call_args_list}
+    assert prompts["dates"].endswith('{"document_type":"Lease"}')
+    assert prompts["risks"].endswith(
+        '{"document_type":"Lease","obligations":'
+        '[{"party":"Tenant","obligation":"Pay"}]}'
+    )
+    # The dates are not needed by the risks
+    assert "2025-01-05" not in prompts["risks"]
+    tokens = analyzer.prompt_tokens
+    assert tokens.after["risks"] < tokens.before["risks"]
+
+
+def test_query_records_metrics(tmp_path, mocker) -> None:
+    analyzer = LlamaAnalyzer(
+        persist_dir=tmp_path,
+        model="gpt-4o-mini",
+        embedding_model="text-embedding-3-small",
+    )
+    analyzer.query_engine = mocker.Mock()
+    analyzer.query_engine.retrieve.return_value = [
+        NodeWithScore(node=TextNode(text="The tenant pays the rent late."))
+    ]
+    analyzer.query_engine.synthesize.return_value = '{"risks": ["Late payment"]}'
+
+    analyzer.query("List the risks", "risks")
+
+    [call] = analyzer.metrics.calls
+    assert call.name == "risks" and not call.cached
+    assert call.embedding_tokens == count_tokens("List the risks")
+    assert call.prompt_tokens > call.embedding_tokens
+    assert call.completion_tokens > 0
+    assert 0 < call.retrieval_time <= call.wall_time
+    assert call.cost > 0
+
+
+class _UsageLLM(CustomLLM):
+    """Answers every prompt, reporting its usage as the OpenAI API does."""
+
+    @property
+    def metadata(self) -> LLMMetadata:
+        return LLMMetadata()
+
+    @llm_completion_callback()
+    def complete(self, prompt, formatted=False, **kwargs) -> CompletionResponse:
+        return CompletionResponse(
+            text='{"risks": ["Late payment"]}',
+            raw={"usage": {"prompt_tokens": 100, "completion_tokens": 10}},
+        )
+
+    @llm_completion_callback()
+    def stream_complete(self, prompt, formatted=False, **kwargs):
+        raise NotImplementedError
+
+
+def test_query_records_reported_usage(tmp_path, mocker) -> None:
+    mocker.patch.object(Settings, "_callback_manager", None)
+    mocker.patch.object(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    mocker.patch.object(Settings, "_llm", _UsageLLM())
+    analyzer = LlamaAnalyzer(
+        persist_dir=tmp_path,
+        model="gpt-4o-mini",
+        embedding_model="text-embedding-3-small",
+    )
+    index = VectorStoreIndex(
+        nodes=[
+            TextNode(text="The tenant pays the rent late."),
+            TextNode(text="The landlord keeps the deposit."),
+        ]
+    )
+    # Refining over both chunks makes two LLM calls
+    analyzer.query_engine = index.as_query_engine(
+        response_mode="refine", similarity_top_k=2
+    )
+
+    analyzer.query("List the risks", "risks")
+
+    [call] = analyzer.metrics.calls
+    assert (call.prompt_tokens, call.completion_tokens) == (200, 20)
+    assert call.embedding_tokens == count_tokens(
+        "List the risks", "text-embedding-3-small"
+    )
+
+
+def test_ingest_indexes_pages_in_batches(tmp_path, mocker) -> None:
+    mocker.patch.object(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    embed = mocker.spy(MockEmbedding, "_get_text_embeddings")
+    file = tmp_path / "a.pdf"
+    file.write_bytes(b"%PDF-1.4")
+    pages = [
+        {"page_number": i, "page_content": f"Clause {i}: the buyer pays {i} EUR."}
+        for i in range(1, 6)
+    ]
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, ingest_batch_size=2)
+
+    metrics = analyzer.ingest(str(file), iter(pages))
+
+    assert [call.args[1] for call in embed.call_args_list] == [
+        [mocker.ANY] * 2,
+        [mocker.ANY] * 2,
+        [mocker.ANY],
+    ]
+    assert [stage.name for stage in metrics.stages] == [
+        "extract",
+        "chunk",
+        "embed",
+        "insert",
+    ]
+    assert analyzer.metrics.as_dict()["ingestion"]["stages"][2]["items_in"] == 5
+    assert analyzer.metrics.calls[0].kind == "index"
+    assert (tmp_path / "index" / "a.pdf").is_dir()
+
+    # The analysis uses the ingested index, without loading it again
+    load = mocker.Mock()
+    index = index_cache.get_or_load(str((tmp_path / "index" / "a.pdf").resolve()), load)
+    assert len(index.docstore.docs) == 5
+    load.assert_not_called()
+
+    # Already indexed: the pages are consumed, nothing is embedded
+    consumed = iter(pages)
+    assert LlamaAnalyzer(persist_dir=tmp_path).ingest(str(file), consumed) is None
+    assert list(consumed) == []
+    assert embed.call_count == 3
@@ -0,0 +1,37 @@
+import pytest
+
+from se.modules.llm_metrics import (
+    QUERY,
+    CallMetrics,
+    RunMetrics,
+    estimate_cost,
+    model_price,
+)
+
+
+def test_model_price() -> None:
+    assert model_price("gpt-4o-mini") == (0.15, 0.60)
+    assert model_price("gpt-4o-mini-2024-07-18") == (0.15, 0.60)
+    assert model_price("gpt-4o-2024-08-06") == (2.50, 10.00)
+    assert model_price("synthetic") is None
+
+
+def test_estimate_cost() -> None:
+    assert estimate_cost("gpt-4o-mini", 1_000_000, 1_000_000) == pytest.approx(0.75)
+    assert estimate_cost("text-embedding-3-small", 500_000) == pytest.approx(0.01)
+    assert estimate_cost("unknown", 1000, 1000) == 0.0
+
+
+def test_run_metrics_totals() -> None:
+    metrics = RunMetrics()
+    metrics.record(
+        CallMetrics("risks", QUERY, wall_time=1.0, prompt_tokens=100, cost=0.5)
+    )
+    metrics.record(CallMetrics("dates", QUERY, wall_time=0.5, cached=True))
+
+    totals = metrics.totals()
+    assert totals["calls"] == 2
+    assert totals["cached_calls"] == 1
+    assert totals["wall_time"] == 1.5
+    assert totals["prompt_tokens"] == 100
+    assert metrics.as_dict()["calls"][1]["name"] == "dates"
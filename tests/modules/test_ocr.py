@@ -0,0 +1,147 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+from pypdf.generic import DecodedStreamObject, NameObject, NumberObject
+
+from se.modules import ocr
+from se.modules.ocr import OCRCache, OCRPool, encode_image, get_ocr_pool
+
+AGREEMENT_PDF = Path("tests/resources/agreement-10.pdf")
+
+
+def _image(data: bytes, **attributes) -> DecodedStreamObject:
+    xobject = DecodedStreamObject()
+    xobject.set_data(data)
+    xobject[NameObject("/Subtype")] = NameObject("/Image")
+    for name, value in attributes.items():
+        if isinstance(value, int):
+            value = NumberObject(value)
+        else:
+            value = NameObject(value)
+        xobject[NameObject(f"/{name}")] = value
+    return xobject
+
+
+def test_encode_gray_image():
+    """Test that 8-bit gray samples are wrapped into a PGM file."""
+    xobject = _image(
+        b"\x00\xff\x80\x10",
+        Width=2,
+        Height=2,
+        ColorSpace="/DeviceGray",
+        BitsPerComponent=8,
+    )
+
+    assert encode_image(xobject) == b"P5\n2 2\n255\n\x00\xff\x80\x10"
+
+
+def test_encode_bilevel_image_inverts_samples():
+    """Test that 1-bit samples are converted to PBM polarity."""
+    xobject = _image(
+        b"\x0f\xf0", Width=4, Height=2, ColorSpace="/DeviceGray", BitsPerComponent=1
+    )
+
+    assert encode_image(xobject) == b"P4\n4 2\n\xf0\x0f"
+
+
+def test_encode_unsupported_image():
+    """Test that images in unsupported formats are skipped."""
+    xobject = _image(
+        b"\x00" * 4, Width=1, Height=1, ColorSpace="/DeviceCMYK", BitsPerComponent=8
+    )
+
+    assert encode_image(xobject) is None
+
+
+def test_ocr_cache_roundtrip(tmp_path):
+    """Test storing and reading cached text."""
+    cache = OCRCache(tmp_path)
+    key = "ab" + "0" * 62
+
+    assert cache.get(key) is None
+    cache.set(key, "Hello")
+    assert cache.get(key) == "Hello"
+    assert (tmp_path / "ab" / f"{key}.txt").is_file()
+
+
+@pytest.fixture
+def tesseract(mocker):
+    """Mock tesseract runs, echoing the size of the recognised image."""
+
+    def run(cmd, input, **kwargs):
+        return subprocess.CompletedProcess(cmd, 0, f"{len(input)} bytes\n".encode())
+
+    return mocker.patch("se.modules.ocr.subprocess.run", side_effect=run)
+
+
+def test_recognize_pages(tmp_path, tesseract):
+    """Test that pages are recognised and served from the cache afterwards."""
+    pool = OCRPool(workers=2, cache=OCRCache(tmp_path))
+    try:
+        texts = pool.recognize_pages(AGREEMENT_PDF, [1, 0])
+        assert sorted(texts) == [0, 1]
+        assert all(text.endswith("bytes") for text in texts.values())
+        # Two JPEG images per page
+        assert tesseract.call_count == 4
+        cmd = tesseract.call_args.args[0]
+        assert cmd == ["tesseract", "stdin", "stdout", "-l", "eng"]
+        assert tesseract.call_args.kwargs["env"]["OMP_THREAD_LIMIT"] == "1"
+
+        assert pool.recognize_pages(AGREEMENT_PDF, [0, 1]) == texts
+        assert tesseract.call_count == 4
+    finally:
+        pool.shutdown()
+
+    stats = pool.stats.as_dict()
+    assert stats["pages"] == 2
+    assert stats["cache_hits"] == 2
+    assert stats["queue_depth"] == 0
+    assert 1 <= stats["max_queue_depth"] <= 2
+
+
+def test_recognize_pages_failure_is_not_cached(tmp_path, mocker):
+    """Test that pages on which tesseract fails are omitted."""
+    mocker.patch(
+        "se.modules.ocr.subprocess.run",
+        side_effect=subprocess.CalledProcessError(1, "tesseract"),
+    )
+    pool = OCRPool(cache=OCRCache(tmp_path))
+    try:
+        assert pool.recognize_pages(AGREEMENT_PDF, [0]) == {}
+    finally:
+        pool.shutdown()
+
+    assert pool.stats.failures == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_get_ocr_pool_without_tesseract(mocker):
+    """Test that OCR is disabled when tesseract is not installed."""
+    mocker.patch.object(ocr, "_pool", None)
+    mocker.patch.object(ocr, "_tesseract_available", None)
+    mocker.patch("se.modules.ocr.is_tool_available", return_value=False)
+
+    assert get_ocr_pool({"OCR_ENABLED": True}) is None
+    assert get_ocr_pool({"OCR_ENABLED": False}) is None
+
+
+def test_export_ocr_stats_of_workers(tmp_path, mocker):
+    """Test that the pool statistics saved by the workers are exported."""
+    config = {"STORAGE_DIR": str(tmp_path)}
+    pool = OCRPool(workers=2)
+    pool.stats.pages, pool.stats.elapsed, pool.stats.max_queue_depth = 6, 3.0, 4
+    mocker.patch.object(ocr, "_pool", pool)
+    try:
+        assert ocr.export_ocr_stats(config) == ""
+        ocr.save_ocr_stats(config, "host:1")
+
+        metrics = ocr.export_ocr_stats(config)
+        assert 'se_ocr_pages_total{worker="host:1"} 6' in metrics
+        assert 'se_ocr_pages_per_second{worker="host:1"} 2.0' in metrics
+        assert 'se_ocr_max_queue_depth{worker="host:1"} 4' in metrics
+
+        ocr.remove_ocr_stats(config, "host:1")
+        assert ocr.export_ocr_stats(config) == ""
+    finally:
+        pool.shutdown()
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import random
+
+import pytest
+
+from se.modules.data_collector import JSONLCollector
+from se.modules.offline_llm import (
+    OfflineLLMError,
+    ReplayLLM,
+    SyntheticLLM,
+    _OfflineLLM,
+    extract_query,
+    parse_latency,
+    synthesize_response,
+)
+from se.utils import load_prompt
+
+QA_PROMPT = (
+    "Context information is below.\n---------------------\n{context}\n"
+    "---------------------\nGiven the context information and not prior "
+    "knowledge, answer the query.\nQuery: {query}\nAnswer: "
+)
+
+
+def test_offline_llm_base_is_abstract() -> None:
+    with pytest.raises(TypeError):
+        _OfflineLLM()
+
+
+def test_extract_query() -> None:
+    prompt = QA_PROMPT.format(context="Some text", query="List the dates.")
+
+    assert extract_query(prompt) == "List the dates."
+    assert extract_query("List the dates.") == "List the dates."
+
+
+@pytest.mark.parametrize(
+    "spec,low,high",
+    (
+        ("", 0.0, 0.0),
+        ("fixed:0.5", 0.5, 0.5),
+        ("uniform:0.1,0.2", 0.1, 0.2),
+        ("lognormal:0,0.5", 0.0, float("inf")),
+    ),
+)
+def test_parse_latency(spec, low, high) -> None:
+    sample = parse_latency(spec)
+    rng = random.Random(0)
+
+    assert all(low <= sample(rng) <= high for _ in range(100))
+
+
+@pytest.mark.parametrize("spec", ("gamma:1,2", "fixed", "uniform:1", "fixed:x"))
+def test_parse_latency_invalid(spec) -> None:
+    with pytest.raises(ValueError):
+        parse_latency(spec)
+
+
+def test_synthesize_initial_analysis() -> None:
+    response = synthesize_response(load_prompt("initial_analysis"))
+
+    assert response["document_type"]
+    categories = [step["category"] for step in response["analysis_steps"]]
+    assert "signature_fields" in categories
+
+
+def test_synthesize_category_prompts() -> None:
+    dates = synthesize_response(load_prompt("dates"))
+    assert dates["dates"][0] == {"date": "2025-01-01", "details": "Synthetic details"}
+
+    text = synthesize_response('Format the result in JSON:\n{\n  "notes": "..."\n}')
+    assert text == {"notes": "Synthetic notes"}
+
+    batch = synthesize_response(
+        load_prompt(
+            "batch_analysis",
+            sections=[
+                {"category": "risks", "prompt": '{"risks": ["description 1"]}'},
+                {"category": "notes", "prompt": '{"notes": "Description"}'},
+            ],
+            categories=["risks", "notes"],
+        )
+    )
+    assert isinstance(batch["risks"], list)
+    assert batch["notes"] == "Synthetic notes"
+
+
+def test_synthetic_llm_injects_errors() -> None:
+    with pytest.raises(OfflineLLMError):
+        SyntheticLLM(error_rate=1.0).complete(load_prompt("dates"))
+
+    text = SyntheticLLM(malformed_rate=1.0).complete(load_prompt("dates")).text
+    with pytest.raises(json.JSONDecodeError):
+        json.loads(text)
+
+
+def test_synthetic_llm_async_latency() -> None:
+    llm = SyntheticLLM(latency="fixed:0.1")
+
+    async def run():
+        return await asyncio.gather(*(llm.acomplete("List") for _ in range(5)))
+
+    loop = asyncio.new_event_loop()
+    try:
+        started = loop.time()
+        loop.run_until_complete(run())
+        elapsed = loop.time() - started
+    finally:
+        loop.close()
+
+    # Concurrent completions overlap instead of blocking the event loop
+    assert 0.1 <= elapsed < 0.3
+
+
+@pytest.fixture
+def records(tmp_path):
+    path = tmp_path / "llm_responses.jsonl"
+    collector = JSONLCollector(path)
+    collector.store(
+        {"prompt": "List the key dates of the contract.", "response": {"dates": []}},
+        "dates",
+    )
+    collector.store({"prompt": None, "response": {"parties": []}, "rules": True})
+    return path
+
+
+def test_replay_exact_and_fuzzy_match(records) -> None:
+    llm = ReplayLLM(records)
+
+    prompt = QA_PROMPT.format(
+        context="...", query="List the key dates of the contract."
+    )
+    assert json.loads(llm.complete(prompt).text) == {"dates": []}
+
+    fuzzy = QA_PROMPT.format(context="...", query="List the key dates of this contract")
+    assert json.loads(llm.complete(fuzzy).text) == {"dates": []}
+
+
+def test_replay_falls_back_to_synthetic(records) -> None:
+    llm = ReplayLLM(records)
+
+    assert llm.match("Something else entirely") is None
+    response = json.loads(llm.complete('{\n  "notes": "Description"\n}').text)
+    assert response == {"notes": "Synthetic notes"}
@@ -0,0 +1,75 @@
+import json
+
+from se.modules.prompt_context import (
+    PromptTokens,
+    compact_context,
+    context_prompt,
+    count_tokens,
+    dump_context,
+    normalize_prompt,
+)
+
+
+def test_count_tokens() -> None:
+    assert count_tokens("") == 0
+    assert 0 < count_tokens("The buyer pays the price.") < 10
+    # Unknown models fall back to the bundled encoding
+    assert count_tokens("hello", "no-such-model") == count_tokens("hello")
+
+
+def test_normalize_prompt() -> None:
+    prompt = 'List   the dates:  \n{\n  "dates": []\n}\n\n\n\nReturn JSON.\n'
+
+    assert (
+        normalize_prompt(prompt)
+        == 'List the dates:\n{\n  "dates": []\n}\n\nReturn JSON.'
+    )
+
+
+def test_compact_context_keeps_needed_fields() -> None:
+    responses = {
+        "document_type": '{"document_type": "Lease"}',
+        "obligations": '{"obligations": [{"party": "Tenant"}]}',
+        "dates": '{"dates": [{"date": "2025-01-05"}]}',
+        "broken": "not json",
+    }
+
+    context = compact_context(responses, ["document_type", "obligations"], 100)
+
+    assert context == {"document_type": "Lease", "obligations": [{"party": "Tenant"}]}
+
+
+def test_compact_context_respects_token_cap() -> None:
+    items = [f"Obligation number {i} of the tenant" for i in range(50)]
+    responses = {
+        "document_type": '{"document_type": "Lease"}',
+        "obligations": json.dumps({"obligations": items}),
+    }
+
+    context = compact_context(responses, ["document_type", "obligations"], 60)
+
+    assert count_tokens(dump_context(context)) <= 60
+    assert context["document_type"] == "Lease"
+    assert 0 < len(context["obligations"]) < 50
+    assert context["obligations"] == items[: len(context["obligations"])]
+
+
+def test_context_prompt() -> None:
+    responses = {"document_type": '{"document_type": "Lease"}'}
+
+    assert context_prompt("Find dates.", responses, ["document_type"], 0) == (
+        "Find dates."
+    )
+    assert context_prompt("Find dates.", responses, ["document_type"], 50).endswith(
+        '\n{"document_type":"Lease"}\n'
+    )
+
+
+def test_prompt_tokens() -> None:
+    tokens = PromptTokens()
+    tokens.record("risks", 400, 100)
+    tokens.record("dates", 100, 100)
+
+    assert (tokens.total_before, tokens.total_after) == (500, 200)
+    assert tokens.saved_ratio == 0.6
+    assert tokens.as_dict()["prompts"]["risks"] == {"before": 400, "after": 100}
@@ -0,0 +1,58 @@
+import time
+
+from se.modules.response_cache import ResponseCache, cache_key
+
+
+def test_cache_key_depends_on_every_part() -> None:
+    key = cache_key("abc", "prompt", "gpt-4o-mini", {"similarity_top_k": 2})
+
+    assert key == cache_key("abc", "prompt", "gpt-4o-mini", {"similarity_top_k": 2})
+    assert key != cache_key("abd", "prompt", "gpt-4o-mini", {"similarity_top_k": 2})
+    assert key != cache_key("abc", "prompt!", "gpt-4o-mini", {"similarity_top_k": 2})
+    assert key != cache_key("abc", "prompt", "gpt-4o", {"similarity_top_k": 2})
+    assert key != cache_key("abc", "prompt", "gpt-4o-mini", {"similarity_top_k": 3})
+
+
+def test_get_and_set(tmp_path) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+
+    assert cache.get("a") is None
+    cache.set("a", '{"dates": []}')
+    assert cache.get("a") == '{"dates": []}'
+
+    stats = cache.stats()
+    assert (stats["entries"], stats["hits"], stats["misses"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == 0.5
+
+
+def test_entries_are_persistent(tmp_path) -> None:
+    ResponseCache(tmp_path / "cache.sqlite3").set("a", "response")
+
+    cache = ResponseCache(tmp_path / "cache.sqlite3")
+    assert cache.get("a") == "response"
+
+
+def test_expired_entries_are_misses(tmp_path) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite3", ttl=0.05)
+    cache.set("a", "response")
+    assert cache.get("a") == "response"
+    time.sleep(0.1)
+
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["expired"]) == (1, 1, 1)
+    assert stats["hit_ratio"] == 0.5
+    assert stats["entries"] == 0
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path) -> None:
+    cache = ResponseCache(tmp_path / "cache.sqlite3", max_bytes=20)
+    cache.set("a", "x" * 8)
+    cache.set("b", "x" * 8)
+    assert cache.get("a") is not None  # "b" is now the least recently used
+    cache.set("c", "x" * 8)
+
+    assert cache.get("b") is None
+    assert cache.get("a") is not None
+    assert cache.get("c") is not None
+    assert cache.stats()["evictions"] == 1
@@ -0,0 +1,91 @@
+import hashlib
+import io
+import os
+
+import pytest
+from werkzeug.datastructures import FileStorage
+
+from se.modules.upload_manager import UploadError, UploadManager, content_filename
+
+
+def _upload(data: bytes, name: str = "Contract.PDF") -> FileStorage:
+    return FileStorage(
+        stream=io.BytesIO(data), filename=name, content_type="application/pdf"
+    )
+
+
+def test_content_filename() -> None:
+    sha = "abcdef" + "0" * 58
+    assert content_filename(sha, ".pdf") == f"ab/cd/{sha}.pdf"
+
+
+def test_save_file_stores_content_once(tmp_path) -> None:
+    manager = UploadManager(tmp_path)
+    data = b"%PDF-1.4 content"
+    sha = hashlib.sha256(data).hexdigest()
+
+    first = manager.save_file(_upload(data))
+    assert first.filename == f"{sha[:2]}/{sha[2:4]}/{sha}.pdf"
+    assert (first.sha256_content, first.content_length) == (sha, len(data))
+    assert first.orig_filename == "Contract.PDF"
+    assert first.created
+    assert (tmp_path / first.filename).read_bytes() == data
+
+    second = manager.save_file(_upload(data, "copy.pdf"))
+    assert second.filename == first.filename
+    assert not second.created
+    # The copy is kept until the upload holds a reference to the content
+    assert open(second.copy_path, "rb").read() == data
+    assert manager.settle(second) is False
+    assert second.copy_path is None
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [f"{sha}.pdf"]
+
+
+def test_settle_stores_copy_of_deleted_content(tmp_path) -> None:
+    manager = UploadManager(tmp_path)
+    first = manager.save_file(_upload(b"content"))
+    second = manager.save_file(_upload(b"content"))
+
+    # The last reference released between the store and the reference
+    manager.delete_file(first.filename)
+    assert manager.settle(second) is True
+    assert (tmp_path / second.filename).read_bytes() == b"content"
+    assert [p.name for p in tmp_path.rglob("*") if p.is_file()] == [
+        os.path.basename(second.filename)
+    ]
+
+
+def test_delete_file_removes_empty_shards(tmp_path) -> None:
+    manager = UploadManager(tmp_path)
+    info = manager.save_file(_upload(b"content"))
+
+    # Still referenced
+    assert manager.delete_file(info.filename, unused=lambda: False) is False
+    assert (tmp_path / info.filename).exists()
+
+    assert manager.delete_file(info.filename) is True
+    assert list(tmp_path.iterdir()) == []
+    # Already deleted
+    manager.delete_file(info.filename)
+
+
+def test_save_file_rejects_sizes(tmp_path) -> None:
+    manager = UploadManager(tmp_path, min_size=4, max_size=10, chunk_size=4)
+
+    with pytest.raises(UploadError, match="maximum limit"):
+        manager.save_file(_upload(b"x" * 11))
+    with pytest.raises(UploadError, match="too small"):
+        manager.save_file(_upload(b"xyz"))
+
+    # No partial or temporary file is left
+    assert list(tmp_path.iterdir()) == []
+    assert manager.save_file(_upload(b"x" * 10)).content_length == 10
+
+
+def test_save_file_reads_stream_once(tmp_path, mocker) -> None:
+    upload = _upload(b"x" * 100)
+    read = mocker.spy(upload.stream, "read")
+
+    UploadManager(tmp_path, chunk_size=64).save_file(upload)
+    # Two chunks and the end of the stream
+    assert read.call_count == 3
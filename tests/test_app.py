@@ -1,3 +1,8 @@
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
 from flask import current_app
 
 from se.app import create_app
@@ -17,3 +22,123 @@ class TestApp:
 
     def test_app_is_testing(self):
         assert current_app.config["TESTING"]
+
+
+def test_configure_ai_offline_backend(mocker):
+    from llama_index.core import MockEmbedding, Settings
+
+    from se.app import configure_ai
+    from se.modules.index_cache import index_cache
+    from se.modules.offline_llm import SyntheticLLM
+
+    mocker.patch.object(Settings, "_llm", None)
+    mocker.patch.object(Settings, "_embed_model", None)
+    app = mocker.Mock()
+    app.config = {
+        "LLM_BACKEND": "synthetic",
+        "INDEX_CACHE_BYTES": index_cache.max_bytes,
+    }
+
+    configure_ai(app)
+
+    assert isinstance(Settings.llm, SyntheticLLM)
+    assert isinstance(Settings.embed_model, MockEmbedding)
+
+
+class _ChatCompletions(BaseHTTPRequestHandler):
+    """A keep-alive OpenAI API answering every chat completion alike."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        content = json.dumps({"alpha": ["ALPHA"], "beta": ["BETA"]})
+        body = json.dumps(
+            {
+                "id": "chatcmpl-1",
+                "object": "chat.completion",
+                "created": 0,
+                "model": "gpt-4o-mini",
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": content},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": 10,
+                    "completion_tokens": 5,
+                    "total_tokens": 15,
+                },
+            }
+        ).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@pytest.fixture
+def openai_server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _ChatCompletions)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}/v1"
+    server.shutdown()
+    server.server_close()
+
+
+def test_configure_ai_openai_client_across_event_loops(
+    tmp_path, mocker, monkeypatch, openai_server
+):
+    """Test that concurrent analyses in a row don't reuse a closed loop."""
+    import openai
+    from llama_index.core import Settings
+
+    from se.app import configure_ai
+    from se.modules.index_cache import index_cache
+    from se.modules.llama_analyzer import LlamaAnalyzer
+
+    mocker.patch.object(Settings, "_llm", None)
+    mocker.patch.object(Settings, "_embed_model", None)
+    mocker.patch.object(openai, "api_key", None)
+    monkeypatch.setenv("OPENAI_API_BASE", openai_server)
+    app = mocker.Mock()
+    app.config = {
+        "LLM_BACKEND": "openai",
+        "OPENAI_API_KEY": "test",
+        "OPENAI_MODEL": "gpt-4o-mini",
+        "INDEX_CACHE_BYTES": index_cache.max_bytes,
+    }
+    configure_ai(app)
+    # Retries would hide the connections left to a closed event loop
+    Settings.llm.max_retries = 0
+
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path, query_concurrency=4)
+    mocker.patch.object(analyzer, "_load_index")
+
+    async def aretrieve(query_bundle):
+        return []
+
+    async def asynthesize(query_bundle, nodes):
+        return (await Settings.llm.acomplete(query_bundle.query_str)).text
+
+    analyzer.query_engine = mocker.Mock()
+    analyzer.query_engine.aretrieve = aretrieve
+    analyzer.query_engine.asynthesize = asynthesize
+    steps = {
+        "document_type": "Lease",
+        "analysis_steps": [
+            {"category": category, "type": "list"} for category in ("alpha", "beta")
+        ],
+    }
+
+    # Each analysis runs its queries in a new event loop
+    for _ in range(2):
+        result = analyzer.analyze_text("tests/resources/blank.pdf", steps)
+        assert (result["alpha"], result["beta"]) == (["ALPHA"], ["BETA"])
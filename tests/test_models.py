@@ -0,0 +1,328 @@
+"""Tests for the ORM models."""
+
+import json
+import os
+import shutil
+from datetime import datetime, timedelta
+from functools import partial
+from pathlib import Path
+
+import pytest
+from llama_index.core import Settings
+from llama_index.core.embeddings import MockEmbedding
+
+from se.app import create_app, db
+from se.models import AnalysisResult, Document, File, Job, JobEvent
+from se.modules.llama_analyzer import LlamaAnalyzer
+
+
+@pytest.fixture
+def db_app(tmp_path):
+    """Create an application with an empty in-memory database."""
+    app = create_app("testing")
+    app.config["UPLOADS_DIR"] = str(tmp_path)
+    app.config["OCR_ENABLED"] = False
+
+    with app.app_context():
+        db.create_all()
+        yield app
+        db.session.remove()
+        db.drop_all()
+
+
+def _create_file(uploads_dir: Path, name: str, sha256_content: str) -> File:
+    shutil.copy("tests/resources/agreement-10.pdf", uploads_dir / name)
+    return File.create(
+        sha256_content=sha256_content,
+        filename=name,
+        orig_filename=name,
+        file_type="application/pdf",
+        file_size=(uploads_dir / name).stat().st_size,
+    )
+
+
+def test_get_pdf_info_backfills_profile(db_app, tmp_path):
+    """Test that a file without a stored profile is profiled on first access."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    assert model_file.has_pdf_info() is False
+
+    info = model_file.get_pdf_info()
+    assert info == {
+        "is_pdf": True,
+        "total_pages": 2,
+        "page_types": ["image-based", "image-based"],
+        "overall_type": "image-based",
+        "exact": True,
+    }
+
+    db.session.expire_all()
+    stored = File.get(model_file.id)
+    assert stored.has_pdf_info() is True
+    assert stored.overall_type == "image-based"
+
+
+def test_get_pdf_info_reads_stored_profile(db_app, tmp_path, mocker):
+    """Test that a stored profile is returned without reading the file."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_file.update_pdf_info()
+    model_file.save()
+
+    profile = mocker.patch("se.models.profile_pdf")
+    assert model_file.get_pdf_info()["total_pages"] == 2
+    profile.assert_not_called()
+
+
+def test_update_pdf_info_reuses_same_content(db_app, tmp_path, mocker):
+    """Test that the profile is copied from a file with the same content."""
+    first = _create_file(tmp_path, "a.pdf", "abc")
+    first.update_pdf_info()
+    first.save()
+
+    profile = mocker.patch("se.models.profile_pdf")
+    second = _create_file(tmp_path, "b.pdf", "abc")
+    second.update_pdf_info()
+
+    profile.assert_not_called()
+    assert second.page_types == ["image-based", "image-based"]
+    assert second.total_pages == 2
+
+
+def test_sampled_profile_is_refreshed_when_exact_needed(db_app, tmp_path):
+    """Test that a sampled profile is flagged and profiled fully on demand."""
+    db_app.config["PDF_SAMPLE_SIZE"] = 1
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Lease")
+    result = AnalysisResult.create(
+        document=model_document,
+        analysis_result=json.dumps({"document_type": "Lease"}),
+        analysis_steps=json.dumps({"analysis_steps": []}),
+    )
+
+    file_info = result.get_combined_analysis()["file_info"]
+    assert file_info["exact"] is False
+    assert file_info["inspected_pages"] == [1]
+    assert file_info["page_types"] == ["image-based", "unknown"]
+
+    db.session.expire_all()
+    stored = File.get(model_file.id)
+    assert (stored.profile_exact, stored.inspected_pages) == (False, [1])
+
+    info = stored.get_pdf_info(exact=True)
+    assert info["exact"] is True and "inspected_pages" not in info
+    assert info["page_types"] == ["image-based", "image-based"]
+    assert stored.is_pdf_info_exact() is True
+
+
+def test_get_pdf_info_not_a_pdf(db_app, tmp_path):
+    """Test that non-PDF files have no profile."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_file.file_type = "text/plain"
+
+    assert model_file.get_pdf_info() is None
+
+
+def test_extract_pages_fills_pages_and_profile(db_app, tmp_path):
+    """Test that a single extraction stores pages and the PDF profile."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Unknown")
+
+    model_document.extract_pages()
+
+    assert model_file.has_pdf_info() is True
+    assert model_file.total_pages == 2
+    assert model_document.get_num_pages() == 2
+    assert model_document.get_pages_summary() == [
+        {"page_number": 1, "page_label": "1", "page_content": ""},
+        {"page_number": 2, "page_label": "2", "page_content": ""},
+    ]
+
+
+def test_extract_pages_merges_ocr_text(db_app, tmp_path, mocker):
+    """Test that image-based pages get the text recognised by OCR."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Unknown")
+
+    pool = mocker.Mock()
+    pool.recognize_pages.return_value = {1: "Scanned text"}
+    mocker.patch("se.modules.ocr.get_ocr_pool", return_value=pool)
+
+    model_document.extract_pages()
+
+    pool.recognize_pages.assert_called_once_with(model_file.get_path(), [0, 1])
+    assert model_document.get_pages_summary() == [
+        {"page_number": 1, "page_label": "1", "page_content": ""},
+        {"page_number": 2, "page_label": "2", "page_content": "Scanned text"},
+    ]
+
+
+def test_extract_pages_streams_pages_to_ingest(db_app, tmp_path, mocker):
+    """Test that the pages are ingested while extracted, OCRed pages last."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Unknown")
+
+    pool = mocker.Mock()
+    pool.recognize_pages.return_value = {1: "Scanned text"}
+    mocker.patch("se.modules.ocr.get_ocr_pool", return_value=pool)
+    ingested = []
+
+    model_document.extract_pages(ingest=ingested.extend)
+
+    pool.recognize_pages.assert_called_once()
+    assert [page["page_content"] for page in ingested] == ["", "Scanned text"]
+    assert model_file.total_pages == 2
+    assert model_file.page_types == ["image-based", "image-based"]
+    assert model_document.get_pages_summary() == [
+        {"page_number": 1, "page_label": "1", "page_content": ""},
+        {"page_number": 2, "page_label": "2", "page_content": "Scanned text"},
+    ]
+
+
+def test_extract_pages_drops_pages_of_unreadable_file(db_app, tmp_path, mocker):
+    """Test that a file failing mid-stream is neither indexed nor paged."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Unknown")
+
+    def stream_pdf(path, info, page_timeout=None):
+        yield {"page_number": 1, "page_label": "1", "page_content": "Lease"}, "text"
+        # Fails on the second page, as se.pdftools.stream_pdf
+        info["is_pdf"] = False
+
+    mocker.patch("se.models.stream_pdf", stream_pdf)
+    mocker.patch.object(Settings, "_embed_model", MockEmbedding(embed_dim=8))
+    analyzer = LlamaAnalyzer(persist_dir=tmp_path)
+
+    model_document.extract_pages(
+        ingest=partial(analyzer.ingest, str(tmp_path / "a.pdf"))
+    )
+
+    assert not os.path.exists(analyzer._index_persist_dir("a.pdf"))
+    assert model_document.get_pages_summary() == []
+    assert model_file.is_pdf is False
+
+
+def test_pages_summary_keeps_page_labels(db_app, tmp_path):
+    """Test that the page labels are stored, for indexes built from pages."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Unknown")
+
+    model_document.add_pages(
+        [
+            {"page_number": 2, "page_label": "A-1", "page_content": "Annex"},
+            {"page_number": 1, "page_label": "iv", "page_content": "Preface"},
+        ]
+    )
+
+    assert [page["page_label"] for page in model_document.get_pages_summary()] == [
+        "iv",
+        "A-1",
+    ]
+
+
+def test_analysis_metrics_shown_in_debug_view(db_app, tmp_path):
+    """Test that the stored call metrics are shown in the debug view."""
+    model_file = _create_file(tmp_path, "a.pdf", "abc")
+    model_document = Document.create(file=model_file, type="Lease")
+    metrics = {
+        "elapsed": 1.5,
+        "totals": {
+            "calls": 1,
+            "cached_calls": 0,
+            "wall_time": 1.2,
+            "retrieval_time": 0.1,
+            "prompt_tokens": 900,
+            "completion_tokens": 100,
+            "embedding_tokens": 20,
+            "cost": 0.0002,
+        },
+        "calls": [
+            {
+                "name": "risks",
+                "kind": "query",
+                "wall_time": 1.2,
+                "retrieval_time": 0.1,
+                "prompt_tokens": 900,
+                "completion_tokens": 100,
+                "embedding_tokens": 20,
+                "cost": 0.0002,
+                "cached": False,
+            }
+        ],
+    }
+    result = AnalysisResult.create(
+        document=model_document,
+        analysis_result=json.dumps({"document_type": "Lease", "risks": []}),
+        analysis_steps=json.dumps(
+            {"analysis_steps": [{"category": "risks", "type": "list"}]}
+        ),
+        metrics=json.dumps(metrics),
+    )
+
+    assert result.get_combined_analysis()["metrics"] == metrics
+
+    db_app.config["SECRET_KEY"] = "test_secret_key"
+    client = db_app.test_client()
+    html = client.get(f"/analysis?a={result.id}&debug=1").get_data(as_text=True)
+    assert "LLM Calls" in html and "<code>risks</code>" in html
+    assert "Ingestion" not in html
+
+    stage = {
+        "name": "embed",
+        "items_in": 10,
+        "items_out": 1,
+        "busy_time": 0.5,
+        "wait_time": 0.1,
+        "blocked_time": 0.0,
+        "throughput": 20.0,
+    }
+    metrics["ingestion"] = {"elapsed": 0.7, "bottleneck": "embed", "stages": [stage]}
+    counts = {"skipped": 1, "verified": 0, "queried": 0, "skip_rate": 1.0}
+    metrics["pre_extraction"] = {"dates": counts}
+    result.metrics = json.dumps(metrics)
+    result.save()
+    html = client.get(f"/analysis?a={result.id}&debug=1").get_data(as_text=True)
+    assert "Ingestion" in html and "bottleneck: <code>embed</code>" in html
+    assert "1 LLM queries skipped" in html
+
+    html = client.get(f"/analysis?a={result.id}").get_data(as_text=True)
+    assert "LLM Calls" not in html
+
+
+def test_expire_deletes_documents_and_unused_files(db_app, tmp_path):
+    (tmp_path / "ab/cd").mkdir(parents=True)
+    model_file = _create_file(tmp_path, "ab/cd/abcd.pdf", "abcd")
+    first = Document.create(file=model_file, type="Unknown")
+    model_file.acquire()
+    second = Document.create(file=model_file, type="Unknown")
+    AnalysisResult.create(document=first, analysis_result="{}", analysis_steps="{}")
+    job = Job.create(kind="analysis", document=first, status=Job.DONE)
+    JobEvent.create(job_id=job.id, event="done", data={})
+    pending = Job.create(kind="analysis", document=second)
+
+    later = datetime.utcnow() + timedelta(minutes=1)
+    assert Document.expire(later) == 1
+    assert (Job.query.count(), JobEvent.query.count()) == (1, 0)
+    assert AnalysisResult.query.count() == 0
+    assert (tmp_path / "ab/cd/abcd.pdf").exists()
+
+    # The last document of the content deletes the stored file
+    pending.status = Job.FAILED
+    pending.save()
+    assert Document.expire(later) == 1
+    assert not (tmp_path / "ab").exists()
+
+
+def test_release_deletes_file_with_last_reference(db_app, tmp_path):
+    (tmp_path / "ab/cd").mkdir(parents=True)
+    model_file = _create_file(tmp_path, "ab/cd/abcd.pdf", "abcd")
+    model_file.acquire()
+    assert model_file.ref_count == 2
+
+    assert model_file.release() is False
+    assert (tmp_path / "ab/cd/abcd.pdf").exists()
+
+    # Another row of the same content keeps the file
+    other = _create_file(tmp_path, "ab/cd/abcd.pdf", "abcd")
+    assert model_file.release() is False
+    assert other.release() is True
+    assert not (tmp_path / "ab").exists()
+    assert File.get_by_content("abcd") == other
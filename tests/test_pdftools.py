@@ -1,9 +1,21 @@
+import threading
+import time
 from pathlib import Path
 from unittest.mock import patch
 
 import pytest
 
-from se.pdftools import detect_pdf_type
+from se.pdftools import (
+    PDFDocument,
+    PDFProfiler,
+    _iter_page_results,
+    detect_pdf_type,
+    extract_pdf,
+    locate_signature_fields,
+    profile_pdf,
+    sample_page_indices,
+    scan_content_stream,
+)
 
 
 def test_nonexistent_file():
@@ -152,3 +164,402 @@ startxref
         assert result["total_pages"] == 1
         assert result["page_types"] == ["text-based"]
         assert result["overall_type"] == "text-based"
+
+
+def _write_pdf(path, objects) -> None:
+    """Write a PDF file made of the given objects, numbered from 1."""
+    body = b"%PDF-1.7\n"
+    offsets = []
+    for number, obj in enumerate(objects, start=1):
+        offsets.append(len(body))
+        body += b"%d 0 obj" % number + obj + b"endobj\n"
+
+    xref = len(body)
+    body += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    for offset in offsets:
+        body += b"%010d 00000 n \n" % offset
+    body += b"trailer\n<</Root 1 0 R/Size %d>>\n" % (len(objects) + 1)
+    body += b"startxref\n%d\n%%%%EOF" % xref
+    path.write_bytes(body)
+
+
+def _stream(content: bytes) -> bytes:
+    return b"<</Length %d>>stream\n" % len(content) + content + b"\nendstream"
+
+
+def _write_pdf_with_content(path, content: bytes, resources: bytes = b"") -> None:
+    """Write a single-page PDF with the given content stream and resources."""
+    _write_pdf(
+        path,
+        [
+            b"<</Pages 2 0 R/Type/Catalog>>",
+            b"<</Count 1/Kids[3 0 R]/Type/Pages>>",
+            b"<</Parent 2 0 R/Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R"
+            + (b"/Resources " + resources if resources else b"")
+            + b">>",
+            _stream(content),
+            b"<</Type/XObject/Subtype/Image/Width 1/Height 1"
+            b"/ColorSpace/DeviceGray/BitsPerComponent 8/Length 1>>stream\n\x00\nendstream",
+        ],
+    )
+
+
+@pytest.fixture
+def nested_pdf(tmp_path):
+    """A 4-page PDF with a nested page tree and inherited resources.
+
+    Pages 1-3 paint text with a font inherited from the intermediate node,
+    page 4 paints an image XObject declared on the root node.
+    """
+    pdf_path = tmp_path / "nested.pdf"
+    _write_pdf(
+        pdf_path,
+        [
+            b"<</Pages 2 0 R/Type/Catalog>>",
+            b"<</Type/Pages/Count 4/Kids[3 0 R 7 0 R]/MediaBox[0 0 612 792]"
+            b"/Resources<</Font<</F1 11 0 R>>/XObject<</Im0 12 0 R>>>>>>",
+            b"<</Type/Pages/Parent 2 0 R/Count 3/Kids[4 0 R 5 0 R 6 0 R]>>",
+            b"<</Type/Page/Parent 3 0 R/Contents 8 0 R>>",
+            b"<</Type/Page/Parent 3 0 R/Contents 9 0 R>>",
+            b"<</Type/Page/Parent 3 0 R/Contents 10 0 R>>",
+            b"<</Type/Page/Parent 2 0 R/Contents 13 0 R>>",
+            _stream(b"BT /F1 12 Tf 72 720 Td (Page one) Tj ET"),
+            _stream(b"BT /F1 12 Tf 72 720 Td (Page two) Tj ET"),
+            _stream(b"BT /F1 12 Tf 72 720 Td (Page three) Tj ET"),
+            b"<</Type/Font/Subtype/Type1/BaseFont/Helvetica>>",
+            b"<</Type/XObject/Subtype/Image/Width 1/Height 1"
+            b"/ColorSpace/DeviceGray/BitsPerComponent 8/Length 1>>stream\n\x00\nendstream",
+            _stream(b"q 612 0 0 792 0 0 cm /Im0 Do Q"),
+        ],
+    )
+    return pdf_path
+
+
+@pytest.mark.parametrize(
+    "content,has_text",
+    (
+        (b"BT /F1 12 Tf (Hello) Tj ET", True),
+        (b"BT [(He) -20 (llo)] TJ ET", True),
+        (b"BT (Hello) ' ET", True),
+        (b'BT 1 2 (Hello) " ET', True),
+        (b"BT <48656C6C6F> Tj ET", True),
+        (b"BT (a (nested\\) string)) Tj ET", True),
+        (b"BT ( ) Tj <20> Tj ET", False),
+        (b"% (Hello) Tj\nq 1 0 0 1 0 0 cm Q", False),
+        (b"BI /W 1 /H 1 ID (Tj) Tj EI", False),
+    ),
+)
+def test_scan_content_stream_text(content, has_text):
+    """Test detection of text-showing operators in content streams."""
+    assert scan_content_stream(content).has_text is has_text
+
+
+def test_scan_content_stream_images():
+    """Test detection of painted XObjects and inline images."""
+    scan = scan_content_stream(b"q /Im0 Do Q q /Fm1 Do Q BI /W 1 /H 1 ID \x00 EI")
+    assert scan.has_text is False
+    assert scan.has_image is True
+    assert scan.xobjects == ["Im0", "Fm1"]
+
+
+@pytest.mark.parametrize(
+    "pdf_path",
+    (
+        Path("tests/resources/blank.pdf"),
+        Path("tests/resources/agreement-10.pdf"),
+    ),
+)
+def test_profile_pdf_matches_detect_pdf_type(pdf_path):
+    """Test that the profiler agrees with the text extraction based detection."""
+    assert profile_pdf(pdf_path) == detect_pdf_type(pdf_path)
+
+
+def test_profile_pdf_nonexistent_file():
+    """Test profiling a nonexistent file."""
+    with pytest.raises(FileNotFoundError):
+        profile_pdf("nonexistent.pdf")
+
+
+def test_profile_pdf_invalid_pdf(tmp_path):
+    """Test profiling an invalid PDF file."""
+    invalid_pdf = tmp_path / "invalid.pdf"
+    invalid_pdf.write_text("This is not a PDF file")
+
+    assert profile_pdf(invalid_pdf) == {
+        "is_pdf": False,
+        "total_pages": 0,
+        "page_types": [],
+        "overall_type": "Unknown",
+    }
+
+
+@pytest.mark.parametrize(
+    "content,page_type",
+    (
+        (b"BT /F1 12 Tf 72 720 Td (Hello) Tj ET", "text-based"),
+        (b"q 612 0 0 792 0 0 cm /Im0 Do Q", "image-based"),
+        (b"q 1 0 0 1 0 0 cm Q", "text-based"),
+    ),
+)
+def test_profile_pdf_page_types(tmp_path, content, page_type):
+    """Test page classification from content streams."""
+    test_pdf = tmp_path / "page.pdf"
+    _write_pdf_with_content(test_pdf, content, resources=b"<</XObject<</Im0 5 0 R>>>>")
+
+    result = profile_pdf(test_pdf)
+    assert result["is_pdf"] is True
+    assert result["total_pages"] == 1
+    assert result["page_types"] == [page_type]
+    assert result["overall_type"] == page_type
+
+
+def test_profile_pdf_parallel_preserves_page_order(tmp_path):
+    """Test that the process pool returns pages in document order."""
+    pdf_path = Path("tests/resources/agreement-10.pdf")
+
+    serial = profile_pdf(pdf_path)
+    parallel = profile_pdf(pdf_path, workers=2, page_timeout=10, min_parallel_pages=1)
+    assert parallel == serial
+
+
+def _stuck_first_page(document, profiler, index, page):
+    """Page job of a child process, stuck on the first page."""
+    if index == 0:
+        time.sleep(60)
+    return profiler.classify_page(page)
+
+
+def test_page_timeout_in_thread():
+    """Test that a page over budget is skipped, even from another thread."""
+    pdf_path = Path("tests/resources/agreement-10.pdf")
+    results = []
+
+    def run():
+        with PDFDocument(pdf_path) as document:
+            results.extend(_iter_page_results(document, [0, 1], _stuck_first_page, 0.5))
+
+    thread = threading.Thread(target=run)
+    started = time.monotonic()
+    thread.start()
+    thread.join(timeout=30)
+
+    assert not thread.is_alive()
+    assert time.monotonic() - started < 30
+    assert results == [(0, None), (1, "image-based")]
+
+
+def test_profile_pdf_page_timeout_matches_profile():
+    """Test that pages read in child processes give the same results."""
+    pdf_path = Path("tests/resources/agreement-10.pdf")
+
+    assert profile_pdf(pdf_path, page_timeout=10) == profile_pdf(pdf_path)
+    assert extract_pdf(pdf_path, page_timeout=10) == extract_pdf(pdf_path)
+
+
+def test_pdf_document_page_count(nested_pdf):
+    """Test reading the page count from the page tree."""
+    with PDFDocument(nested_pdf) as pdf:
+        assert pdf.page_count == 4
+
+
+@pytest.mark.parametrize(
+    "start,stop,expected",
+    (
+        (0, None, [0, 1, 2, 3]),
+        (1, 3, [1, 2]),
+        (3, 4, [3]),
+        (2, 100, [2, 3]),
+        (4, None, []),
+    ),
+)
+def test_pdf_document_iter_pages_range(nested_pdf, start, stop, expected):
+    """Test iterating over page ranges of a nested page tree."""
+    with PDFDocument(nested_pdf) as pdf:
+        assert [index for index, _ in pdf.iter_pages(start, stop)] == expected
+
+
+def test_pdf_document_inherits_page_attributes(nested_pdf):
+    """Test that pages inherit resources and media box from ancestors."""
+    with PDFDocument(nested_pdf) as pdf:
+        _, page = next(pdf.iter_pages(3, 4))
+        assert "/Im0" in page["/Resources"]["/XObject"]
+        assert [float(v) for v in page.mediabox] == [0, 0, 612, 792]
+
+
+def test_pdf_document_extract_text(nested_pdf):
+    """Test extracting text of a page range."""
+    with PDFDocument(nested_pdf) as pdf:
+        assert list(pdf.extract_text(1, 3)) == [(1, "Page two"), (2, "Page three")]
+        assert pdf.page_label(1) == "2"
+
+
+def test_pdf_document_nonexistent_file():
+    """Test opening a nonexistent file."""
+    with pytest.raises(FileNotFoundError):
+        PDFDocument("nonexistent.pdf")
+
+
+def test_profile_pdf_nested_page_tree(nested_pdf):
+    """Test profiling a PDF with inherited resources."""
+    result = profile_pdf(nested_pdf)
+    assert result["total_pages"] == 4
+    assert result["page_types"] == ["text-based"] * 3 + ["image-based"]
+    assert result["overall_type"] == "mixed"
+
+
+def test_extract_pdf(nested_pdf):
+    """Test extracting the text and the profile in a single pass."""
+    info, pages = extract_pdf(nested_pdf)
+
+    assert info == profile_pdf(nested_pdf)
+    assert pages == [
+        {"page_number": 1, "page_label": "1", "page_content": "Page one"},
+        {"page_number": 2, "page_label": "2", "page_content": "Page two"},
+        {"page_number": 3, "page_label": "3", "page_content": "Page three"},
+        {"page_number": 4, "page_label": "4", "page_content": ""},
+    ]
+
+
+def test_extract_pdf_invalid_pdf(tmp_path):
+    """Test extracting an invalid PDF file."""
+    invalid_pdf = tmp_path / "invalid.pdf"
+    invalid_pdf.write_text("This is not a PDF file")
+
+    info, pages = extract_pdf(invalid_pdf)
+    assert info["is_pdf"] is False
+    assert pages == []
+
+
+@pytest.mark.parametrize(
+    "total_pages,sample_size,expected",
+    (
+        (5, 10, [0, 1, 2, 3, 4]),
+        (300, 1, [0]),
+        (300, 2, [0, 299]),
+    ),
+)
+def test_sample_page_indices_bounds(total_pages, sample_size, expected):
+    """Test the choice of sampled pages for small samples."""
+    assert sample_page_indices(total_pages, sample_size) == expected
+
+
+def test_sample_page_indices_stratified():
+    """Test that sampled pages cover the document and are reproducible."""
+    indices = sample_page_indices(300, 10, seed=42)
+
+    assert indices[:2] == [0, 299]
+    assert len(set(indices)) == 10
+    # One page per stratum of the 298 body pages
+    strata = [1 + (index - 1) * 8 // 298 for index in indices[2:]]
+    assert strata == list(range(1, 9))
+    assert sample_page_indices(300, 10, seed=42) == indices
+
+
+def test_profile_pdf_sample_exits_early_on_mixed(nested_pdf):
+    """Test that sampling stops once the document is known to be mixed."""
+    result = profile_pdf(nested_pdf, sample_size=3)
+
+    assert result["overall_type"] == "mixed"
+    assert result["exact"] is True
+    assert result["inspected_pages"] == [1, 4]
+    assert result["page_types"] == ["text-based", "unknown", "unknown", "image-based"]
+
+
+def test_profile_pdf_sample_is_not_exact(tmp_path):
+    """Test that a partial sample of a uniform document is not exact."""
+    pdf_path = tmp_path / "text.pdf"
+    kids = b" ".join(b"%d 0 R" % (3 + i) for i in range(6))
+    pages = [b"<</Type/Page/Parent 2 0 R/Contents 9 0 R>>"] * 6
+    _write_pdf(
+        pdf_path,
+        [
+            b"<</Pages 2 0 R/Type/Catalog>>",
+            b"<</Type/Pages/Count 6/Kids[" + kids + b"]>>",
+            *pages,
+            _stream(b"BT /F1 12 Tf (Hello) Tj ET"),
+        ],
+    )
+
+    result = profile_pdf(pdf_path, sample_size=3)
+    assert result["total_pages"] == 6
+    assert result["overall_type"] == "text-based"
+    assert result["exact"] is False
+    assert len(result["inspected_pages"]) == 3
+    assert result["page_types"].count("unknown") == 3
+
+
+def test_locate_signature_fields(tmp_path):
+    """Test locating signature fields from text anchors and form fields."""
+    pdf_path = tmp_path / "signatures.pdf"
+    content = b"""BT /F1 12 Tf 72 700 Td (By: __________) Tj ET
+BT /F1 12 Tf 72 685 Td (Name: John Smith) Tj ET
+BT /F1 12 Tf 72 600 Td (__________) Tj ET
+BT /F1 12 Tf 72 586 Td (ACME Inc., Seller) Tj ET
+BT /F1 12 Tf 72 500 Td (Initials: ______) Tj ET
+BT /F1 12 Tf 72 300 Td (Name: ____________) Tj ET
+BT /F1 12 Tf 300 120 Td (Signature: __________) Tj ET
+"""
+    _write_pdf(
+        pdf_path,
+        [
+            b"<</Pages 2 0 R/Type/Catalog/AcroForm<</Fields[5 0 R]>>>>",
+            b"<</Count 1/Kids[3 0 R]/Type/Pages>>",
+            b"<</Parent 2 0 R/Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R"
+            b"/Annots[5 0 R]/Resources<</Font<</F1<</Type/Font/Subtype/Type1"
+            b"/BaseFont/Helvetica>>>>>>>>",
+            _stream(content),
+            b"<</Type/Annot/Subtype/Widget/FT/Sig/T(Buyer)/V 6 0 R"
+            b"/Rect[300 100 450 140]/P 3 0 R>>",
+            b"<</Type/Sig>>",
+        ],
+    )
+
+    fields = locate_signature_fields(pdf_path)
+
+    assert [(f["field_type"], f["party"], f["source"]) for f in fields] == [
+        ("Signature", "John Smith", "text"),
+        ("Signature", "ACME Inc., Seller", "text"),
+        ("Initials", "", "text"),
+        ("Signature", "Buyer", "acroform"),
+    ]
+    assert all(field["page"] == 1 for field in fields)
+    assert fields[0]["bbox"] == [96.0, 697.0, 156.0, 712.0]
+    assert fields[3]["bbox"] == [300.0, 100.0, 450.0, 140.0]
+    assert fields[3]["signed"] == "Yes"
+
+
+def test_locate_signature_fields_without_anchors():
+    """Test that a document without anchors has no signature fields."""
+    assert locate_signature_fields("tests/resources/agreement-10.pdf") == []
+
+
+def test_locate_signature_fields_ignores_fill_in_blanks(tmp_path):
+    """Test that blanks of the text are not taken for signature fields."""
+    pdf_path = tmp_path / "blanks.pdf"
+    content = b"""BT /F1 12 Tf 72 700 Td (The Buyer shall pay the sum of ______ dollars) Tj ET
+BT /F1 12 Tf 72 686 Td (to the Seller, dated ______.) Tj ET
+BT /F1 12 Tf 72 640 Td (__________) Tj ET
+BT /F1 12 Tf 72 626 Td (as agreed by the parties to this agreement in writing) Tj ET
+BT /F1 12 Tf 72 400 Td (IN WITNESS WHEREOF, the parties have signed this agreement.) Tj ET
+BT /F1 12 Tf 72 300 Td (__________) Tj ET
+BT /F1 12 Tf 72 286 Td (John Smith) Tj ET
+"""
+    _write_pdf(
+        pdf_path,
+        [
+            b"<</Pages 2 0 R/Type/Catalog>>",
+            b"<</Count 1/Kids[3 0 R]/Type/Pages>>",
+            b"<</Parent 2 0 R/Type/Page/MediaBox[0 0 612 792]/Contents 4 0 R"
+            b"/Resources<</Font<</F1<</Type/Font/Subtype/Type1"
+            b"/BaseFont/Helvetica>>>>>>>>",
+            _stream(content),
+        ],
+    )
+
+    fields = locate_signature_fields(pdf_path)
+
+    # Only the line of the trailing signature block
+    assert [(f["field_type"], f["party"]) for f in fields] == [
+        ("Signature", "John Smith")
+    ]
+    assert fields[0]["bbox"][1] == 297.0